@@ -6,12 +6,12 @@ try:
 except ModuleNotFoundError:
     sys.exit("Error: Streamlit is not installed. Please install it with 'pip install streamlit' and try again.")
 
-import subprocess
 import os
-import time
-import base64
 from datetime import datetime
 
+from streamgrab.batch import default_workers
+from streamgrab.convert import QUALITIES, ConvertOptions, convert_all
+
 # Set page configuration
 st.set_page_config(
     page_title="StreamGrab - M3U8 Video Downloader",
@@ -146,58 +146,50 @@ with tab1:
         st.info(f"Created directory: {output_dir}")
 
     # Video quality
-    output_quality = st.select_slider(
+    output_qualities = st.multiselect(
         "Video Quality",
-        options=["Low", "Medium", "High", "Original"],
-        value="Original"
+        options=QUALITIES,
+        default=["Original"],
+        help="Pick several to get e.g. the original plus a Low preview from a single download"
+    )
+
+    # Concurrency limit
+    max_workers = st.number_input(
+        "Parallel Conversions",
+        min_value=1,
+        max_value=64,
+        value=default_workers(any(quality != "Original" for quality in output_qualities)),
+        help="How many videos are converted at the same time"
     )
 
     # Convert button
-    convert_all = st.button("Convert All Videos", use_container_width=True)
+    convert_clicked = st.button("Convert All Videos", use_container_width=True)
 
-    if convert_all:
-        if m3u8_files:
+    if convert_clicked:
+        if not output_qualities:
+            st.warning("Please select at least one video quality.")
+        elif m3u8_files:
             overall_progress = st.progress(0)
+            statuses = [st.empty() for _ in m3u8_files]
+            for status, m3u8_file in zip(statuses, m3u8_files):
+                status.caption(f"🕒 {m3u8_file.name}: queued")
             summary = []
 
-            for idx, m3u8_file in enumerate(m3u8_files, start=1):
-                # Save temp m3u8
-                input_path = os.path.join(output_dir, f"tmp_{idx}.m3u8")
-                with open(input_path, "wb") as f:
-                    f.write(m3u8_file.getvalue())
-
-                # Derive output file name
-                base = os.path.splitext(m3u8_file.name)[0]
-                output_path = os.path.join(output_dir, f"{base}.mp4")
-
-                # Build ffmpeg command
-                cmd = [
-                    "ffmpeg",
-                    "-protocol_whitelist", "file,http,https,tcp,tls",
-                    "-i", input_path,
-                ]
-                if output_quality != "Original":
-                    scale_map = {"Low": "640:-1", "Medium": "1280:-1", "High": "1920:-1"}
-                    cmd += ["-vf", f"scale={scale_map[output_quality]}", "-c:v", "libx264", "-c:a", "aac"]
-                else:
-                    cmd += ["-c", "copy"]
-                cmd.append(output_path)
-
-                # Run conversion
-                with st.spinner(f"Converting {m3u8_file.name}..."):
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-
-                if result.returncode == 0:
-                    summary.append(f"✅ {m3u8_file.name} → {output_path}")
-                else:
-                    err = result.stderr.splitlines()[-1] if result.stderr else "Unknown error"
-                    summary.append(f"❌ {m3u8_file.name} failed: {err}")
-
-                # Clean up temp file
-                os.remove(input_path)
-
-                # Update progress
-                overall_progress.progress(idx / len(m3u8_files))
+            options = ConvertOptions(quality=output_qualities[0], extra_qualities=output_qualities[1:])
+            with st.spinner(f"Converting {len(m3u8_files)} videos..."):
+                for done, (idx, _, result) in enumerate(
+                        convert_all(m3u8_files, output_dir, options, int(max_workers)), start=1):
+                    if result.skipped:
+                        line = f"⏭️ {result.name} already converted → {result.output_path}"
+                    elif result.ok:
+                        line = f"✅ {result.name} → {result.output_path}"
+                    else:
+                        line = f"❌ {result.name} failed: {result.error}"
+                    summary.append(line)
+                    statuses[idx].caption(line)
+
+                    # Update progress
+                    overall_progress.progress(done / len(m3u8_files))
 
             # Show summary
             st.markdown("### Conversion Summary")
@@ -237,7 +229,7 @@ with tab3:
     1. **Upload your .m3u8 files** using the file uploader on the Home tab  
     2. **Set the download directory** where videos will be saved  
     3. **Choose your preferred quality** setting  
-    4. **Click the Convert All Videos button** to start sequential conversion  
+    4. **Click the Convert All Videos button** to start the conversion  
     5. **Wait for the process to complete** - you can monitor progress in real-time  
     6. **Find your videos** in the specified download folder
     """)
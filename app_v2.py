@@ -1,11 +1,15 @@
 import sys
-import subprocess
 import os
-import time
-import base64
+import json
 from datetime import datetime
 import logging
-import tempfile
+
+from streamgrab.batch import default_workers
+from streamgrab.cache import DEFAULT_CACHE_DIR
+from streamgrab.clip import parse_timestamp
+from streamgrab.convert import QUALITIES, ConvertOptions
+from streamgrab.jobs import get_manager
+from streamgrab.logbuffer import LogBuffer, LogFile
 
 # Ensure Streamlit is available
 try:
@@ -97,26 +101,51 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Number of log entries rendered in the log panel
+LOG_WINDOW = 200
+
 # Initialize session state for logs
-if 'logs' not in st.session_state:
-    st.session_state.logs = []
+if not isinstance(st.session_state.get('logs'), LogBuffer):
+    st.session_state.logs = LogBuffer(capacity=1000)
 
-def add_log(message, level="INFO"):
-    """Add a log message to the session state and print to console"""
+def add_log(message, level="INFO", key=None):
+    """Add a log message to the session state and print to console
+
+    Messages sharing a key (e.g. progress for one file) update a single live entry,
+    and go to the console and log file at DEBUG level.
+    """
     timestamp = datetime.now().strftime("%H:%M:%S")
     log_entry = f"[{timestamp}] {level}: {message}"
     
     # Add to session state
-    st.session_state.logs.append((level, log_entry))
+    st.session_state.logs.add(level, log_entry, key=key)
+    write_log_file("DEBUG" if key is not None else level, message)
     
     # Log to console as well
-    if level == "ERROR":
+    if key is not None:
+        logger.debug(message)
+    elif level == "ERROR":
         logger.error(message)
     elif level == "WARNING":
         logger.warning(message)
     else:
         logger.info(message)
 
+def write_log_file(level, message):
+    """Append to this session's log file, if it writes one"""
+    log_file = st.session_state.get("log_file")
+    if log_file is not None:
+        log_file.write(level, message)
+
+def set_log_file(path):
+    """Write this session's log to path from now on, or stop writing a log file if path is None"""
+    current = st.session_state.get("log_file")
+    if current is not None and (path is None or current.path != os.path.abspath(path)):
+        current.close()
+        current = st.session_state.log_file = None
+    if path and current is None:
+        st.session_state.log_file = LogFile(path)
+
 def select_directory():
     """Provides directory selection options"""
     # Common directories to offer as quick options
@@ -189,144 +218,256 @@ if output_dir:
         except Exception as e:
             add_log(f"Failed to create directory: {str(e)}", "ERROR")
 
-# Video quality options
-output_quality = st.select_slider(
+# Video quality options; several are written from one download and decode
+output_qualities = st.multiselect(
     "Video Quality",
-    options=["Low", "Medium", "High", "Original"],
-    value="Original",
-    help="Low=640p, Medium=720p, High=1080p, Original=source quality"
+    options=QUALITIES,
+    default=["Original"],
+    help="Low=640p, Medium=720p, High=1080p, Original=source quality. "
+         "For master playlists the closest variant is downloaded instead of re-encoding. "
+         "With several qualities, the first is saved as <name>.mp4 and the others as <name>_<quality>.mp4"
 )
+transcoding = any(quality != "Original" for quality in output_qualities)
 
 # Hardware acceleration option
 use_hw_accel = st.checkbox(
     "Use Hardware Acceleration",
     value=False,
-    help="Speeds up conversion but may not work on all systems"
+    help="Uses the fastest GPU decode/encode path FFmpeg supports on this machine, "
+         "falling back to software encoding if it is missing or fails"
 )
 
-def convert_m3u8_to_mp4(m3u8_file, output_path, quality, use_hw_accel):
-    """Convert M3U8 to MP4 with progress tracking and logging"""
-    # Create a temporary file for the M3U8 content
-    with tempfile.NamedTemporaryFile(suffix='.m3u8', delete=False) as tmp_file:
-        tmp_file.write(m3u8_file.getvalue())
-        input_path = tmp_file.name
-    
-    try:
-        add_log(f"Starting conversion of {m3u8_file.name}", "INFO")
-        
-        # Build ffmpeg command
-        cmd = ["ffmpeg", "-y", "-stats"]
-        
-        # Add hardware acceleration if requested
-        if use_hw_accel:
-            # Try to detect platform and add appropriate HW accel
-            import platform
-            system = platform.system().lower()
-            if system == 'windows':
-                cmd.extend(["-hwaccel", "dxva2"])
-            elif system == 'darwin':  # macOS
-                cmd.extend(["-hwaccel", "videotoolbox"])
-            else:  # Linux and others
-                cmd.extend(["-hwaccel", "vaapi"])
-            
-            add_log(f"Using hardware acceleration for {system}", "INFO")
-        
-        cmd.extend([
-            "-protocol_whitelist", "file,http,https,tcp,tls",
-            "-i", input_path,
-        ])
-        
-        # Set quality
-        if quality != "Original":
-            scale_map = {"Low": "640:-1", "Medium": "1280:-1", "High": "1920:-1"}
-            cmd.extend(["-vf", f"scale={scale_map[quality]}", "-c:v", "libx264", "-c:a", "aac"])
-        else:
-            cmd.extend(["-c", "copy"])
-        
-        cmd.append(output_path)
-        
-        add_log(f"Running command: {' '.join(cmd)}", "INFO")
-        
-        # Execute conversion process with real-time output capturing
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            bufsize=1
-        )
-        
-        # Monitor the process output
-        while process.poll() is None:
-            stderr_line = process.stderr.readline().strip()
-            if stderr_line:
-                if "frame=" in stderr_line:
-                    # This is progress info, update the latest log instead of adding new
-                    progress_info = stderr_line.split('time=')[1].split(' ')[0] if 'time=' in stderr_line else "processing"
-                    add_log(f"Converting {m3u8_file.name} - Time: {progress_info}", "INFO")
-                elif stderr_line.lower().startswith('error'):
-                    add_log(stderr_line, "ERROR")
-                time.sleep(0.1)  # Small delay to prevent UI freezing
-        
-        # Get the return code
-        return_code = process.poll()
-        
-        # Clean up temp file
-        os.unlink(input_path)
-        
-        if return_code == 0:
-            add_log(f"Successfully converted {m3u8_file.name} to {output_path}", "SUCCESS")
-            return True
-        else:
-            remaining_errors = process.stderr.read()
-            add_log(f"Failed to convert {m3u8_file.name}: {remaining_errors}", "ERROR")
-            return False
-            
-    except Exception as e:
-        add_log(f"Error in conversion process: {str(e)}", "ERROR")
-        # Clean up temp file
-        if os.path.exists(input_path):
-            os.unlink(input_path)
-        return False
+# FFmpeg executable
+ffmpeg_path = st.text_input(
+    "FFmpeg Path",
+    value="ffmpeg",
+    help="Path to the FFmpeg executable. Its capabilities are probed once and cached"
+)
+
+# Output index: skip playlists already converted with the same settings
+skip_converted = st.checkbox(
+    "Skip Already Converted Videos",
+    value=True,
+    help="The output folder keeps an index of converted playlists and settings. A playlist whose output "
+         "is still there unchanged is skipped; a different playlist with the same name gets its own file"
+)
+
+# Time-range clip: only the segments overlapping the range are downloaded
+col1, col2, col3 = st.columns(3)
+with col1:
+    clip_start_text = st.text_input(
+        "Clip Start",
+        value="",
+        placeholder="00:00:00",
+        help="Convert from this time on (seconds or HH:MM:SS). Leave both empty for the whole video"
+    )
+with col2:
+    clip_end_text = st.text_input(
+        "Clip End",
+        value="",
+        placeholder="end",
+        help="Convert up to this time (seconds or HH:MM:SS). Empty runs to the end"
+    )
+with col3:
+    frame_accurate = st.checkbox(
+        "Frame-Accurate Cut",
+        value=False,
+        help="Without transcoding, a clip starts on the keyframe before Clip Start. This re-encodes just the "
+             "partial GOPs at both edges so the clip starts and ends on the exact frame"
+    )
+
+# Chunk-parallel transcoding of each video
+chunk_workers = st.number_input(
+    "Parallel Chunks per Video",
+    min_value=0,
+    max_value=64,
+    value=0,
+    disabled=not transcoding,
+    help="Split each video into time chunks and transcode them on this many FFmpeg processes at once. "
+         "Uses every core for a single file; 0 encodes in one pass"
+)
+
+# Concurrency limit for batch conversions
+max_workers = st.number_input(
+    "Parallel Conversions",
+    min_value=1,
+    max_value=64,
+    value=default_workers(transcoding, int(chunk_workers)),
+    help="How many ffmpeg processes run at once in the background. "
+         "Stream copies are network-bound; transcodes are CPU-bound"
+)
+
+# Native segment downloader
+segment_window = st.slider(
+    "Segments In Flight",
+    min_value=1,
+    max_value=32,
+    value=8,
+    help="Segments downloaded concurrently per video. Set to 1 to let FFmpeg fetch segments itself"
+)
+
+# Disk-free streaming
+pipeline_mode = st.checkbox(
+    "Streaming Mode",
+    value=False,
+    help="Pipe downloaded segments straight into FFmpeg instead of staging them on disk. "
+         "Uses less disk I/O, but interrupted jobs cannot resume"
+)
+
+# Per-host limits shared by all background jobs
+col1, col2 = st.columns(2)
+with col1:
+    host_connections = st.number_input(
+        "Connections per Host",
+        min_value=0,
+        max_value=256,
+        value=16,
+        help="Requests in flight to one CDN host across all jobs; a freed slot goes to the job with the "
+             "fewest. 0 for no limit"
+    )
+with col2:
+    host_bandwidth = st.number_input(
+        "Bandwidth per Host (MB/s)",
+        min_value=0.0,
+        value=0.0,
+        step=1.0,
+        help="Download bandwidth per CDN host shared by all jobs. 0 for no limit"
+    )
+
+# Shared segment cache
+cache_size_gb = st.number_input(
+    "Segment Cache Size (GB)",
+    min_value=0.0,
+    value=5.0,
+    step=1.0,
+    help=f"Segments are cached in {DEFAULT_CACHE_DIR} and reused across jobs. Set to 0 to disable"
+)
+
+# Log retention
+col1, col2 = st.columns(2)
+with col1:
+    log_capacity = st.number_input(
+        "Log Buffer Size",
+        min_value=100,
+        max_value=100_000,
+        value=1000,
+        step=100,
+        help="Maximum number of log entries kept in the session. Older entries are dropped"
+    )
+with col2:
+    log_to_file = st.checkbox(
+        "Write Full Log to File",
+        value=False,
+        help="Stream every log line to a rotating file in the output directory and keep only "
+             "the most recent entries on screen"
+    )
+if log_to_file and output_dir:
+    set_log_file(os.path.join(output_dir, ".streamgrab", "streamgrab.log"))
+    st.session_state.logs.resize(min(int(log_capacity), LOG_WINDOW))
+else:
+    set_log_file(None)
+    st.session_state.logs.resize(int(log_capacity))
+
+# Background job manager; its worker threads outlive script reruns
+manager = get_manager(workers=int(max_workers))
+job_queue = manager.queue
+if 'job_log_cursor' not in st.session_state:
+    st.session_state.job_log_cursor = 0
 
 # Convert button
 if st.button("Convert All Videos", use_container_width=True, type="primary"):
     if not m3u8_files:
         st.warning("Please select at least one .m3u8 file first.")
+    elif not output_qualities:
+        st.warning("Please select at least one video quality.")
     elif not output_dir or not os.path.isdir(output_dir):
         st.error("Please select a valid output directory.")
     else:
+        try:
+            clip_start, clip_end = parse_timestamp(clip_start_text), parse_timestamp(clip_end_text)
+        except ValueError as e:
+            st.error(f"Invalid clip range: {e}")
+            st.stop()
         # Clear previous logs
         st.session_state.logs.clear()
         
-        # Create progress bar
-        progress_bar = st.progress(0)
-        
-        # Process each file
-        for idx, m3u8_file in enumerate(m3u8_files, start=1):
-            base = os.path.splitext(m3u8_file.name)[0]
-            output_path = os.path.join(output_dir, f"{base}.mp4")
-            
-            # Show current file being processed
-            st.subheader(f"Processing {m3u8_file.name} ({idx}/{len(m3u8_files)})")
-            
-            # Convert the file
-            success = convert_m3u8_to_mp4(m3u8_file, output_path, output_quality, use_hw_accel)
-            
-            # Update progress
-            progress_bar.progress(idx / len(m3u8_files))
-        
-        # Final status
-        if len(m3u8_files) > 0:
-            add_log(f"Completed processing {len(m3u8_files)} files", "INFO")
+        options = ConvertOptions(
+            quality=output_qualities[0],
+            extra_qualities=output_qualities[1:],
+            use_hw_accel=use_hw_accel,
+            segment_window=segment_window,
+            cache_size_gb=cache_size_gb,
+            pipeline=pipeline_mode,
+            ffmpeg=ffmpeg_path or "ffmpeg",
+            chunk_workers=int(chunk_workers),
+            skip_converted=skip_converted,
+            host_connections=int(host_connections),
+            host_bandwidth=host_bandwidth,
+            clip_start=clip_start,
+            clip_end=clip_end,
+            frame_accurate=frame_accurate,
+        )
+        for m3u8_file in m3u8_files:
+            job_queue.submit(m3u8_file, output_dir, options)
+        add_log(f"Queued {len(m3u8_files)} files; up to {int(max_workers)} convert in parallel", "INFO")
 
-# Log viewer
-st.markdown("### Conversion Logs")
-log_container = st.container()
+JOB_ICONS = {"queued": "🕒", "running": "⏳", "done": "✅", "failed": "❌", "cancelled": "🚫"}
 
-with log_container:
+@st.fragment(run_every=2)
+def job_panel():
+    """Poll the job queue and render job status and logs without blocking the page"""
+    # Pull new job log lines into the session log buffer
+    for log_id, job_id, ts, level, message in job_queue.logs_since(st.session_state.job_log_cursor):
+        timestamp = datetime.fromtimestamp(ts).strftime("%H:%M:%S")
+        st.session_state.logs.add(level, f"[{timestamp}] {level}: #{job_id} {message}")
+        write_log_file(level, f"#{job_id} {message}")
+        st.session_state.job_log_cursor = log_id
+
+    jobs = job_queue.jobs(limit=50)
+    st.markdown("### Jobs")
+    if not jobs:
+        st.caption("No jobs yet")
+    counts = job_queue.counts()
+    if counts:
+        st.caption(" · ".join(f"{JOB_ICONS.get(state, '')} {state}: {n}" for state, n in sorted(counts.items())))
+    for job in jobs:
+        label = f"{JOB_ICONS.get(job.state, '')} #{job.id} {job.name}"
+        if job.state == "running":
+            st.progress(job.progress or 0.0, text=f"{label}: {job.progress_text or 'starting'}")
+        elif job.state == "done":
+            st.caption(f"{label} → {job.output_path}")
+        elif job.state == "failed":
+            st.caption(f"{label} failed: {job.error}")
+        elif job.state == "queued":
+            col1, col2 = st.columns([5, 1])
+            col1.caption(f"{label}: queued")
+            if col2.button("Cancel", key=f"cancel_{job.id}"):
+                job_queue.cancel(job.id)
+        else:
+            st.caption(f"{label}: {job.state}")
+    if any(job.state not in ("queued", "running") for job in jobs):
+        if st.button("Clear Finished Jobs"):
+            job_queue.clear_finished()
+
+    # Throughput and timing totals of the jobs finished by this process
+    if manager.metrics.totals().jobs:
+        with st.expander("Performance Metrics"):
+            st.caption(manager.metrics.describe())
+            summary = manager.metrics.summary()
+            st.json(summary["by_origin"], expanded=False)
+            col1, col2 = st.columns(2)
+            col1.download_button("Download JSON", json.dumps(summary, indent=2), file_name="streamgrab-metrics.json",
+                                 mime="application/json")
+            col2.download_button("Download Prometheus", manager.metrics.prometheus(), file_name="streamgrab.prom",
+                                 mime="text/plain")
+
+    # Log viewer
+    st.markdown("### Conversion Logs")
+    logs = st.session_state.logs
+    if logs.total > LOG_WINDOW:
+        st.caption(f"Showing the latest {min(LOG_WINDOW, len(logs))} of {logs.total} log entries")
     log_html = '<div class="log-container">'
-    for level, log in st.session_state.logs:
+    for level, log in logs.window(LOG_WINDOW):
         if "SUCCESS" in level:
             log_html += f'<div class="log-success">{log}</div>'
         elif "ERROR" in level:
@@ -336,6 +477,8 @@ with log_container:
     log_html += '</div>'
     st.markdown(log_html, unsafe_allow_html=True)
 
+job_panel()
+
 # Help section
 with st.expander("Need Help?"):
     st.markdown("""
@@ -343,8 +486,9 @@ with st.expander("Need Help?"):
     1. **Select your .m3u8 files** using the file uploader above
     2. **Choose an output directory** where videos will be saved
     3. **Select video quality** - lower quality for faster conversion, original for best quality
-    4. **Click "Convert All Videos"** to start the process
-    5. **Monitor the logs** for conversion progress and any issues
+    4. **Click "Convert All Videos"** to queue the files; they convert in the background
+    5. **Monitor the jobs and logs** for conversion progress and any issues - you can keep using
+       the page or reload it, and queued jobs resume if the app restarts
 
     ### Troubleshooting
     - **No conversion happening?** Make sure FFmpeg is installed on your system
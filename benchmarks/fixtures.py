@@ -0,0 +1,145 @@
+"""HLS fixtures generated locally from ffmpeg's lavfi test sources"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+from dataclasses import asdict, dataclass, field
+
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "streamgrab", "bench-fixtures")
+
+
+@dataclass
+class FixtureSpec:
+    """One generated stream; with several variants it becomes a master playlist"""
+    name: str
+    duration: int
+    segment_time: int
+    # (width, height, video bitrate in kbit/s) per rendition
+    variants: list = field(default_factory=lambda: [(1280, 720, 2500)])
+    # AES-128 encrypt the segments; "derived" omits the IV so clients use the media sequence
+    encryption: str = None  # None, "explicit-iv" or "derived"
+    # CMAF segments with an EXT-X-MAP init section instead of MPEG-TS
+    fmp4: bool = False
+    # One media file addressed with EXT-X-BYTERANGE instead of a file per segment
+    single_file: bool = False
+
+    @property
+    def is_master(self):
+        return len(self.variants) > 1
+
+    @property
+    def playlist(self):
+        return "master.m3u8" if self.is_master else "index.m3u8"
+
+    def digest(self):
+        return hashlib.sha256(json.dumps(asdict(self), sort_keys=True).encode()).hexdigest()[:12]
+
+
+DEFAULT_SUITE = [
+    FixtureSpec("short", duration=30, segment_time=2),
+    FixtureSpec("many-segments", duration=120, segment_time=1, variants=[(640, 360, 800)]),
+    FixtureSpec("high-bitrate", duration=60, segment_time=4, variants=[(1920, 1080, 8000)]),
+    FixtureSpec("master", duration=60, segment_time=4,
+                variants=[(640, 360, 800), (1280, 720, 2500), (1920, 1080, 5000)]),
+    FixtureSpec("encrypted", duration=60, segment_time=2, encryption="derived"),
+    FixtureSpec("byte-range", duration=120, segment_time=1, variants=[(640, 360, 800)], single_file=True),
+    FixtureSpec("fmp4", duration=60, segment_time=2, fmp4=True, single_file=True),
+]
+
+QUICK_SUITE = [
+    FixtureSpec("short", duration=10, segment_time=2),
+    FixtureSpec("master", duration=10, segment_time=2, variants=[(640, 360, 800), (1280, 720, 2500)]),
+    FixtureSpec("encrypted", duration=10, segment_time=2, encryption="explicit-iv"),
+    FixtureSpec("fmp4", duration=10, segment_time=1, fmp4=True, single_file=True),
+]
+
+
+def build_fixture(spec, root=DEFAULT_FIXTURE_DIR, ffmpeg="ffmpeg"):
+    """Generate spec under root (once; reused while the spec is unchanged) and return its directory"""
+    directory = os.path.join(root, f"{spec.name}-{spec.digest()}")
+    if os.path.exists(os.path.join(directory, spec.playlist)):
+        return directory
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for idx, (width, height, kbps) in enumerate(spec.variants):
+        variant_dir = os.path.join(tmp_dir, f"v{idx}") if spec.is_master else tmp_dir
+        os.makedirs(variant_dir, exist_ok=True)
+        encrypt_args = _encryption_args(spec, variant_dir) if spec.encryption else []
+        gop = 30 * spec.segment_time
+        ext = "m4s" if spec.fmp4 else "ts"
+        layout_args = ["-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4"] if spec.fmp4 else []
+        if spec.single_file:
+            layout_args += ["-hls_flags", "single_file"]
+        segment_name = f"media.{ext}" if spec.single_file else f"seg_%05d.{ext}"
+        cmd = [
+            ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30",
+            "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+            "-t", str(spec.duration),
+            "-c:v", "libx264", "-preset", "ultrafast", "-b:v", f"{kbps}k",
+            "-maxrate", f"{kbps}k", "-bufsize", f"{2 * kbps}k",
+            "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+            "-c:a", "aac", "-b:a", "128k",
+            "-f", "hls", "-hls_time", str(spec.segment_time), "-hls_playlist_type", "vod", *encrypt_args,
+            *layout_args, "-hls_segment_filename", os.path.join(variant_dir, segment_name),
+            os.path.join(variant_dir, "index.m3u8"),
+        ]
+        subprocess.run(cmd, check=True)
+
+    if spec.is_master:
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        for idx, (width, height, kbps) in enumerate(spec.variants):
+            lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={(kbps + 128) * 1000},RESOLUTION={width}x{height},"
+                         f'CODECS="avc1.640028,mp4a.40.2"')
+            lines.append(f"v{idx}/index.m3u8")
+        with open(os.path.join(tmp_dir, "master.m3u8"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return directory
+
+
+def _encryption_args(spec, variant_dir):
+    """ffmpeg HLS muxer options that AES-128 encrypt the segments with a key derived from the spec"""
+    key = hashlib.sha256(("streamgrab-bench-" + spec.digest()).encode()).digest()[:16]
+    key_path = os.path.join(variant_dir, "key.bin")
+    with open(key_path, "wb") as f:
+        f.write(key)
+    info = ["key.bin", key_path]
+    if spec.encryption == "explicit-iv":
+        info.append(hashlib.md5(key).hexdigest())
+    info_path = os.path.join(variant_dir, "key.info")
+    with open(info_path, "w") as f:
+        f.write("\n".join(info) + "\n")
+    return ["-hls_key_info_file", info_path]
+
+
+def absolute_playlist(directory, spec, base_url):
+    """The fixture's top-level playlist with every URI made absolute against base_url.
+
+    This is what a user would upload: segment, variant, key and init section URIs pointing at the origin.
+    """
+    lines = []
+    with open(os.path.join(directory, spec.playlist)) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                line = base_url + line
+            elif line.startswith(("#EXT-X-KEY:", "#EXT-X-MAP:")):
+                line = re.sub(r'URI="([^"]+)"', lambda m: f'URI="{base_url}{m.group(1)}"', line)
+            lines.append(line)
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def fixture_bytes(directory):
+    """Total size of the media files in a fixture"""
+    total = 0
+    for dirpath, _, files in os.walk(directory):
+        total += sum(os.path.getsize(os.path.join(dirpath, name))
+                     for name in files if name.endswith((".ts", ".m4s", ".mp4")))
+    return total
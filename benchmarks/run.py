@@ -0,0 +1,234 @@
+"""Benchmark the conversion pipeline against locally generated HLS fixtures.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --quick --latency 0.05 --bandwidth 5000000
+    python -m benchmarks.run --output new.json --compare old.json
+
+Fixtures are generated once with ffmpeg's lavfi sources and served from a
+local HTTP origin with the requested latency, bandwidth and error rate.
+Every scenario runs in a fresh subprocess so CPU time and peak RSS are
+measured per scenario. Results are written as JSON together with the git
+commit, so runs from different commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+
+from benchmarks.fixtures import (DEFAULT_FIXTURE_DIR, DEFAULT_SUITE, QUICK_SUITE, absolute_playlist, build_fixture,
+                                 fixture_bytes)
+from benchmarks.server import NetworkProfile, OriginServer
+
+MODES = ["Original", "Low", "Medium", "High"]
+FETCH_MODES = {"native": 8, "ffmpeg": 1}
+
+
+def distinct_copy(playlist_bytes, copy):
+    """The playlist with a per-copy query on each segment or variant URI.
+
+    The output index would otherwise recognise the copies of a batch as one
+    source and convert it only once. The origin ignores the query.
+    """
+    lines = []
+    for line in playlist_bytes.decode("utf-8").splitlines():
+        if line and not line.startswith("#"):
+            line += f"{'&' if '?' in line else '?'}copy={copy}"
+        lines.append(line)
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def run_scenario(scenario):
+    """Run one scenario in this process and return its measurements"""
+    from streamgrab.convert import ConvertOptions, PlaylistFile, convert_all
+
+    with open(scenario["playlist_path"], "rb") as f:
+        data = f.read()
+    files = [PlaylistFile(f"{scenario['fixture']}-{i}.m3u8", distinct_copy(data, i))
+             for i in range(scenario["batch_size"])]
+    options = ConvertOptions(
+        quality=scenario["mode"],
+        segment_window=scenario["segment_window"],
+        cache_size_gb=0,
+        pipeline=scenario["pipeline"],
+        ffmpeg=scenario["ffmpeg"],
+        skip_converted=False,
+    )
+    output_dir = tempfile.mkdtemp(prefix="streamgrab-bench-")
+
+    def quiet(message, level="INFO", key=None):
+        if level == "ERROR":
+            print(message, file=sys.stderr)
+
+    try:
+        started = time.perf_counter()
+        results = [result for _, _, result in convert_all(files, output_dir, options, scenario["jobs"], log=quiet)]
+        wall = time.perf_counter() - started
+        skipped = [r.name for r in results if r.skipped]
+        if skipped:
+            raise RuntimeError(f"Reused earlier outputs instead of converting: {', '.join(skipped)}")
+        output_bytes = sum(os.path.getsize(r.output_path) for r in results if r.ok and os.path.exists(r.output_path))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "wall_s": round(wall, 3),
+        "cpu_s": round(self_usage.ru_utime + self_usage.ru_stime + child_usage.ru_utime + child_usage.ru_stime, 3),
+        "peak_rss_mb": round(self_usage.ru_maxrss * rss_unit / 1024 ** 2, 1),
+        "peak_ffmpeg_rss_mb": round(child_usage.ru_maxrss * rss_unit / 1024 ** 2, 1),
+        "output_bytes": output_bytes,
+        "failed": sum(1 for r in results if not r.ok),
+    }
+
+
+def scenarios(suite, modes, fetch_modes, batch_size, parallel_jobs, pipeline):
+    for spec in suite:
+        for mode in modes:
+            for fetch in fetch_modes:
+                for batch, jobs in (("sequential", 1), ("parallel", parallel_jobs)):
+                    yield spec, {"mode": mode, "fetch": fetch, "segment_window": FETCH_MODES[fetch],
+                                 "batch": batch, "jobs": jobs, "batch_size": batch_size,
+                                 "pipeline": pipeline and fetch == "native"}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def ffmpeg_version(ffmpeg):
+    try:
+        out = subprocess.run([ffmpeg, "-version"], capture_output=True, text=True).stdout
+    except OSError:
+        return ""
+    return out.splitlines()[0] if out else ""
+
+
+def compare(old_path, new):
+    """Print wall time per scenario relative to an earlier result file"""
+    with open(old_path) as f:
+        old = json.load(f)
+
+    def key(r):
+        return r["fixture"], r["mode"], r["fetch"], r["batch"]
+
+    previous = {key(r): r for r in old["results"]}
+    print(f"\n{'scenario':<48} {'old s':>8} {'new s':>8} {'change':>8}")
+    for r in new["results"]:
+        before = previous.get(key(r))
+        if before is None or not before["wall_s"]:
+            continue
+        change = (r["wall_s"] - before["wall_s"]) / before["wall_s"] * 100
+        print(f"{'/'.join(key(r)):<48} {before['wall_s']:>8.2f} {r['wall_s']:>8.2f} {change:>+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="earlier JSON results to compare wall times against")
+    parser.add_argument("--quick", action="store_true", help="small fixtures, Original and Low only")
+    parser.add_argument("--modes", nargs="+", choices=MODES, help="qualities to run (default: all)")
+    parser.add_argument("--fetch", nargs="+", choices=list(FETCH_MODES), default=list(FETCH_MODES),
+                        help="segment fetch paths to run (default: both)")
+    parser.add_argument("--pipeline", action="store_true", help="use pipeline mode for native fetches")
+    parser.add_argument("--batch-size", type=int, default=4, help="playlists per batch (default: 4)")
+    parser.add_argument("--jobs", type=int, default=4, help="workers for the parallel batch (default: 4)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each origin response")
+    parser.add_argument("--bandwidth", type=int, default=0, help="bytes/s per origin connection, 0 = unlimited")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of segment requests that fail")
+    parser.add_argument("--seed", type=int, default=0, help="seed for error injection")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURE_DIR, help="fixture cache directory")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="ffmpeg executable")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        # Child process: run a single scenario and report on stdout
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return 0
+
+    suite = QUICK_SUITE if args.quick else DEFAULT_SUITE
+    modes = args.modes or (["Original", "Low"] if args.quick else MODES)
+    profile = NetworkProfile(latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                             seed=args.seed)
+    work_dir = tempfile.mkdtemp(prefix="streamgrab-bench-playlists-")
+    results = []
+    try:
+        fixture_dirs = {}
+        for spec in suite:
+            print(f"Preparing fixture {spec.name}...", file=sys.stderr)
+            fixture_dirs[spec.name] = build_fixture(spec, args.fixtures, args.ffmpeg)
+
+        for spec, scenario in scenarios(suite, modes, args.fetch, args.batch_size, args.jobs, args.pipeline):
+            directory = fixture_dirs[spec.name]
+            # A fresh origin per scenario keeps its byte counters separate
+            with OriginServer(directory, profile) as origin:
+                playlist_path = os.path.join(work_dir, f"{spec.name}.m3u8")
+                with open(playlist_path, "wb") as f:
+                    f.write(absolute_playlist(directory, spec, origin.base_url))
+                child = {**scenario, "fixture": spec.name, "playlist_path": playlist_path, "ffmpeg": args.ffmpeg}
+                label = f"{spec.name}/{scenario['mode']}/{scenario['fetch']}/{scenario['batch']}"
+                print(f"Running {label}...", file=sys.stderr)
+                proc = subprocess.run([sys.executable, "-m", "benchmarks.run", "--scenario", json.dumps(child)],
+                                      capture_output=True, text=True)
+                if proc.returncode != 0:
+                    print(proc.stderr, file=sys.stderr)
+                    continue
+                measured = json.loads(proc.stdout.strip().splitlines()[-1])
+                stats = dict(origin.stats)
+
+            media_seconds = spec.duration * scenario["batch_size"]
+            results.append({
+                "fixture": spec.name,
+                **{k: scenario[k] for k in ("mode", "fetch", "batch", "jobs", "batch_size", "pipeline")},
+                **measured,
+                "bytes_downloaded": stats["bytes"],
+                "requests": stats["requests"],
+                "range_requests": stats["range_requests"],
+                "injected_errors": stats["errors"],
+                "throughput_mbps": round(stats["bytes"] * 8 / 1e6 / measured["wall_s"], 2) if measured["wall_s"] else 0,
+                "realtime_factor": round(media_seconds / measured["wall_s"], 2) if measured["wall_s"] else 0,
+            })
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": ffmpeg_version(args.ffmpeg),
+            "network": asdict(profile),
+            "fixtures": {spec.name: {**asdict(spec), "bytes": fixture_bytes(fixture_dirs[spec.name])}
+                         for spec in suite},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        compare(args.compare, report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""Local HLS origin with configurable latency, bandwidth, error injection and live playlists
+
+Static files are also served in byte ranges (a single "Range: bytes=..."
+per request), as CDNs do for EXT-X-BYTERANGE playlists.
+"""
+import bisect
+import http.server
+import io
+import math
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from streamgrab.playlist import parse_playlist
+
+
+@dataclass
+class NetworkProfile:
+    """Simulated network conditions for the local origin"""
+    latency: float = 0.0          # seconds added before each response
+    bandwidth: int = 0            # bytes per second per connection, 0 = unlimited
+    error_rate: float = 0.0       # fraction of segment requests answered with error_status
+    error_status: int = 503
+    seed: int = 0
+
+
+@dataclass
+class LiveWindow:
+    """Serves a VOD playlist of the directory as a sliding-window live playlist.
+
+    Requests for `path` get the segments of `source` published so far,
+    starting with `window` segments and adding one per segment duration
+    (divided by `speed`), at most `window` at a time, with EXT-X-ENDLIST
+    once the last segment is out. reload_error_rate fails that fraction of
+    playlist requests with a 503.
+    """
+    source: str = "index.m3u8"
+    path: str = "live.m3u8"
+    window: int = 4
+    speed: float = 1.0
+    reload_error_rate: float = 0.0
+
+    def load(self, directory):
+        with open(os.path.join(directory, self.source)) as f:
+            self.playlist = parse_playlist(f.read())
+        self.started = time.monotonic()
+        # Publication time of every segment after the initial window
+        self._published_at = []
+        elapsed = 0.0
+        for seg in self.playlist.segments[self.window:]:
+            elapsed += seg.duration
+            self._published_at.append(elapsed)
+
+    def render(self):
+        segments = self.playlist.segments
+        elapsed = (time.monotonic() - self.started) * self.speed
+        published = min(len(segments), self.window + bisect.bisect_right(self._published_at, elapsed))
+        first = max(0, published - self.window)
+        target = int(self.playlist.target_duration) or math.ceil(max(seg.duration for seg in segments))
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{target}",
+                 f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+        for seg in segments[first:published]:
+            lines.append(f"#EXTINF:{seg.duration:.6f},")
+            lines.append(seg.uri)
+        if published == len(segments):
+            lines.append("#EXT-X-ENDLIST")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    profile = NetworkProfile()
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+    stats = None
+    live = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.profile.latency:
+            time.sleep(self.profile.latency)
+        self.stats["requests"] += 1
+        if self.live and self.path.split("?", 1)[0].lstrip("/") == self.live.path:
+            self._serve_live()
+            return
+        if self.profile.error_rate and not self.path.split("?", 1)[0].endswith(".m3u8"):
+            with self.rng_lock:
+                fail = self.rng.random() < self.profile.error_rate
+            if fail:
+                self.stats["errors"] += 1
+                self.send_response(self.profile.error_status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        byte_range = _parse_range(self.headers.get("Range"))
+        if byte_range is not None:
+            self._serve_range(*byte_range)
+            return
+        super().do_GET()
+
+    def _serve_range(self, first, last):
+        path = self.translate_path(self.path)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if first is None:
+                # Suffix range: the last `last` bytes
+                first, last = max(0, size - last), size - 1
+            last = size - 1 if last is None else min(last, size - 1)
+            if first >= size or first > last:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            f.seek(first)
+            body = f.read(last - first + 1)
+        self.stats["range_requests"] += 1
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        self.copyfile(io.BytesIO(body), self.wfile)
+
+    def _serve_live(self):
+        with self.rng_lock:
+            fail = self.live.reload_error_rate and self.rng.random() < self.live.reload_error_rate
+        if fail:
+            self.stats["errors"] += 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.live.render()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.apple.mpegurl")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def copyfile(self, source, outputfile):
+        bandwidth = self.profile.bandwidth
+        chunk = 64 * 1024 if not bandwidth else max(1024, min(64 * 1024, bandwidth // 20))
+        while True:
+            started = time.monotonic()
+            data = source.read(chunk)
+            if not data:
+                break
+            outputfile.write(data)
+            self.stats["bytes"] += len(data)
+            if bandwidth:
+                delay = len(data) / bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+def _parse_range(header):
+    """(first, last) from a single-range "bytes=first-last" header, with None for an open end; else None"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[6:].strip().partition("-")
+    if not sep or not (first or last):
+        return None
+    try:
+        return (int(first) if first else None), (int(last) if last else None)
+    except ValueError:
+        return None
+
+
+class OriginServer:
+    """Serves a directory over HTTP/1.1 keep-alive on 127.0.0.1 in a background thread.
+
+    Use as a context manager; base_url points at the served directory.
+    With a LiveWindow, base_url + live.path is a live playlist whose window
+    starts sliding when the server starts.
+    """
+
+    def __init__(self, directory, profile=None, port=0, live=None):
+        self.stats = {"requests": 0, "range_requests": 0, "errors": 0, "bytes": 0}
+        profile = profile or NetworkProfile()
+        handler = type("Handler", (_Handler,), {
+            "profile": profile,
+            "rng": random.Random(profile.seed),
+            "rng_lock": threading.Lock(),
+            "stats": self.stats,
+            "live": live,
+        })
+        directory = os.path.abspath(directory)
+        self.directory = directory
+        self.live = live
+        self.httpd = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", port), lambda *args: handler(*args, directory=directory))
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="origin-server")
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self):
+        if self.live:
+            self.live.load(self.directory)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1 @@
+"""StreamGrab conversion engine shared by the Streamlit front-ends."""
@@ -0,0 +1,5 @@
+import sys
+
+from streamgrab.cli import main
+
+sys.exit(main())
@@ -0,0 +1,58 @@
+"""Bounded worker pool for running a batch of conversions concurrently"""
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+
+
+@dataclass
+class JobResult:
+    """Outcome of converting a single playlist"""
+    name: str
+    output_path: str
+    ok: bool
+    error: str = ""
+    # The output already existed from an earlier run with the same source and settings
+    skipped: bool = False
+    # JobMetrics.to_dict() of the conversion, when it got far enough to record any
+    metrics: dict = field(default_factory=dict)
+
+
+def default_workers(transcode, chunk_workers=0):
+    """Pick a concurrency limit from the CPU count.
+
+    Stream-copy remuxes spend almost all their time waiting on the network,
+    so several can share a core. Transcodes keep libx264 busy on every core
+    it can get, so running more than a couple at once only adds contention.
+    A chunked transcode already spreads one file over every core.
+    """
+    cpus = os.cpu_count() or 1
+    if transcode and chunk_workers > 1:
+        return 1
+    if transcode:
+        return max(1, cpus // 4)
+    return max(2, min(16, cpus * 2))
+
+
+def run_batch(items, convert, max_workers, on_tick=None, tick_interval=0.2):
+    """Run convert(index, item) for every item on a bounded thread pool.
+
+    Yields (index, item, result) as each job finishes, in completion order.
+    on_tick is called from the calling thread between completions so the UI
+    can drain logs and refresh per-file progress while jobs are running.
+    An exception raised by convert is reported as a failed JobResult.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="convert") as pool:
+        pending = {pool.submit(convert, idx, item): (idx, item) for idx, item in enumerate(items)}
+        while pending:
+            done, _ = wait(pending, timeout=tick_interval, return_when=FIRST_COMPLETED)
+            if on_tick:
+                on_tick()
+            for future in done:
+                idx, item = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = JobResult(getattr(item, "name", str(item)), "", False, str(e))
+                yield idx, item, result
+        if on_tick:
+            on_tick()
@@ -0,0 +1,116 @@
+"""Shared content-addressed segment cache with size-bounded LRU eviction"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("StreamGrab")
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "streamgrab", "segments")
+
+
+def cache_key(uri, byte_range=None):
+    """Cache key for a segment: its URI plus byte range.
+
+    Bodies are cached as served, still encrypted, so the key and IV they
+    are decrypted with do not belong in the key.
+    """
+    digest = hashlib.sha256(uri.encode("utf-8"))
+    digest.update(b"\0" + (f"{byte_range[0]}-{byte_range[1]}" if byte_range else "").encode("ascii"))
+    return digest.hexdigest()
+
+
+class SegmentCache:
+    """Segment bodies stored on disk by key, shared by every job.
+
+    An SQLite index tracks each entry's size and last access time. When the
+    total size exceeds max_bytes, the least recently used entries are
+    evicted. Hit and miss counts are kept for the life of the object.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=5 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False,
+                                   isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss"""
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        with self._lock:
+            self.hits += 1
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return data
+
+    def put(self, key, data):
+        """Store data under key and evict old entries if over the size limit"""
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                (key, len(data), time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            victims.append(key)
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        for key in victims:
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in victims])
+        logger.info(f"Segment cache evicted {len(victims)} entries ({freed / 1024 ** 2:.1f} MB)")
+
+    def size(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def summary(self):
+        """One-line hit/miss/usage summary for the log panel"""
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups else 0
+        return (f"Segment cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+                f"{self.size() / 1024 ** 2:.1f} of {self.max_bytes / 1024 ** 2:.0f} MB used")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,127 @@
+"""Chunk-parallel transcoding of downloaded segments
+
+A single libx264 process scaling one stream leaves most cores of a large
+host idle. Here the downloaded segment list is split at segment boundaries
+into time-contiguous chunks whose video is encoded by separate ffmpeg
+processes at once. The encoded chunks are joined losslessly with the
+concat demuxer while the audio is taken from the whole stream in one
+pass, so there are no priming gaps or drift at the seams.
+"""
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from streamgrab.fetch import render_local_playlist
+from streamgrab.playlist import MediaPlaylist, parse_playlist
+from streamgrab.progress import Progress
+
+logger = logging.getLogger("StreamGrab")
+
+# Chunks shorter than this spend more time starting ffmpeg than encoding
+MIN_CHUNK_SECONDS = 10.0
+
+# Chunks per worker, so a pool that finishes some chunks early is kept busy
+CHUNKS_PER_WORKER = 2
+
+
+class ChunkError(Exception):
+    """A chunk failed to encode"""
+
+
+def plan_chunks(durations, workers, min_seconds=MIN_CHUNK_SECONDS):
+    """Split segment durations into contiguous (start, end) index ranges of similar total duration"""
+    total = sum(durations)
+    count = max(1, min(len(durations), workers * CHUNKS_PER_WORKER, int(total // min_seconds)))
+    target = total / count
+    chunks = []
+    start = 0
+    elapsed = 0.0
+    for idx, duration in enumerate(durations):
+        elapsed += duration
+        # Cut once this chunk's share of the stream is reached, keeping the last chunk open
+        if elapsed >= target * (len(chunks) + 1) and len(chunks) < count - 1:
+            chunks.append((start, idx + 1))
+            start = idx + 1
+    if start < len(durations):
+        chunks.append((start, len(durations)))
+    return chunks
+
+
+def chunk_threads(workers):
+    """libx264 threads per chunk so the chunks together use every core once"""
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def _with_threads(video_args, threads):
+    args = list(video_args)
+    if "-threads" in args:
+        args[args.index("-threads") + 1] = str(threads)
+    else:
+        args += ["-threads", str(threads)]
+    return args
+
+
+def encode_chunks(ffmpeg, local_playlist, plan, workers, on_progress=None):
+    """Encode the video of a downloaded playlist in parallel chunks.
+
+    local_playlist is the rewritten playlist in the job's work dir; chunk
+    playlists and encoded chunks are written next to it. Returns the path
+    of a concat demuxer list of the encoded chunks and the number of
+    chunks. on_progress receives a Progress snapshot after each chunk.
+    Raises ChunkError when a chunk fails; chunks still queued are then
+    cancelled.
+    """
+    work_dir = os.path.dirname(local_playlist)
+    with open(local_playlist, encoding="utf-8") as f:
+        playlist = parse_playlist(f.read())
+    segments = playlist.segments
+    ranges = plan_chunks([seg.duration for seg in segments], workers)
+    video_args = _with_threads(plan.video_args, chunk_threads(workers))
+
+    jobs = []
+    for idx, (start, end) in enumerate(ranges):
+        part = MediaPlaylist(segments=segments[start:end], target_duration=playlist.target_duration,
+                             media_sequence=playlist.media_sequence + start)
+        chunk_playlist = os.path.join(work_dir, f"chunk_{idx:03d}.m3u8")
+        # Segment and init URIs of the local playlist already name the downloaded files
+        inits = {seg.init: seg.init.uri for seg in part.segments if seg.init is not None}
+        with open(chunk_playlist, "w") as f:
+            f.write(render_local_playlist(part, [seg.uri for seg in part.segments], inits))
+        output = os.path.join(work_dir, f"chunk_{idx:03d}.mp4")
+        cmd = [ffmpeg, "-y", "-nostats", "-loglevel", "error", *plan.input_args,
+               "-protocol_whitelist", "file", "-i", chunk_playlist,
+               "-map", "0:v:0", "-an", *video_args, output]
+        jobs.append((cmd, output, part.total_duration))
+
+    total = playlist.total_duration
+    done = 0.0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="chunk") as executor:
+        # Each worker thread drives one ffmpeg process, so the encodes run on separate cores
+        pending = {executor.submit(subprocess.run, cmd, capture_output=True, text=True): (cmd, duration)
+                   for cmd, _, duration in jobs}
+        try:
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    cmd, duration = pending.pop(future)
+                    result = future.result()
+                    if result.returncode != 0:
+                        raise ChunkError(f"Encoding {os.path.basename(cmd[-1])} failed: "
+                                         f"{result.stderr.strip()[-500:]}")
+                    done += duration
+                    if on_progress:
+                        elapsed = time.monotonic() - started
+                        on_progress(Progress(out_time=done, total_duration=total,
+                                             speed=done / elapsed if elapsed else 0.0, elapsed=elapsed))
+        finally:
+            for future in pending:
+                future.cancel()
+
+    concat_list = os.path.join(work_dir, "chunks.txt")
+    with open(concat_list, "w") as f:
+        for _, output, _ in jobs:
+            f.write(f"file '{os.path.basename(output)}'\n")
+    return concat_list, len(jobs)
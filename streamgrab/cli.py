@@ -0,0 +1,220 @@
+"""Headless command-line front-end: streamgrab [options] PLAYLIST|DIR ..."""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+
+# Same as streamgrab.convert.QUALITIES; repeated so that --help and argument
+# errors do not pay for importing the engine
+QUALITIES = ["Low", "Medium", "High", "Original"]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="streamgrab",
+        description="Convert M3U8 playlists to MP4 without the Streamlit UI.",
+    )
+    parser.add_argument("inputs", nargs="*", metavar="PLAYLIST",
+                        help=".m3u8 files, directories containing them, or http(s) playlist URLs")
+    parser.add_argument("-m", "--manifest", action="append", default=[],
+                        help="JSON or CSV manifest listing playlists (may be repeated)")
+    parser.add_argument("-o", "--output-dir", default=".", help="where MP4 files are written (default: .)")
+    parser.add_argument("-q", "--quality", choices=QUALITIES, action="append",
+                        help="output quality (default: Original); repeat to write several qualities from one "
+                             "decode, e.g. -q Original -q Low")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="conversions run in parallel (default: based on CPU count)")
+    parser.add_argument("--segments", type=int, default=8,
+                        help="segments downloaded concurrently per video; 1 lets ffmpeg fetch them (default: 8)")
+    parser.add_argument("--cache-size", type=float, default=5.0, metavar="GB",
+                        help="shared segment cache size in GB, 0 to disable (default: 5)")
+    parser.add_argument("--host-connections", type=int, default=16, metavar="N",
+                        help="requests in flight per origin host across all jobs, 0 for no limit (default: 16)")
+    parser.add_argument("--host-bandwidth", type=float, default=0.0, metavar="MBPS",
+                        help="download bandwidth per origin host in MB/s, shared by all jobs (default: unlimited)")
+    parser.add_argument("--range-span", type=float, default=4.0, metavar="MB",
+                        help="largest single Range request when merging adjacent byte-range segments (default: 4)")
+    parser.add_argument("--min-free", type=float, default=1.0, metavar="GB",
+                        help="disk space kept free; jobs wait until their estimated output fits above it (default: 1)")
+    parser.add_argument("--chunks", type=int, default=0, metavar="N",
+                        help="transcode each video in time chunks on N ffmpeg processes (default: one pass)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="stream segments into ffmpeg's stdin instead of staging them on disk")
+    parser.add_argument("--start", type=timestamp, default=0.0, metavar="TIME",
+                        help="convert from this time on, in seconds or HH:MM:SS; only overlapping segments are fetched")
+    parser.add_argument("--end", type=timestamp, default=0.0, metavar="TIME",
+                        help="convert up to this time, in seconds or HH:MM:SS (default: the end)")
+    parser.add_argument("--frame-accurate", action="store_true",
+                        help="with --start/--end and a stream copy, re-encode the edge GOPs to cut on the exact frame")
+    parser.add_argument("--stop-after", type=float, default=0.0, metavar="SECONDS",
+                        help="for live playlists, stop recording after this much media (default: until it ends)")
+    parser.add_argument("--force", action="store_true",
+                        help="convert again even if the output directory's index has an up-to-date output")
+    parser.add_argument("--hwaccel", action="store_true",
+                        help="use the fastest hardware decode/encode path, falling back to software")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="ffmpeg executable (default: ffmpeg)")
+    parser.add_argument("--json", action="store_true", help="print a JSON summary instead of text")
+    parser.add_argument("--metrics-json", metavar="PATH",
+                        help="write per-job and batch metrics (fetch latency, bytes, retries, phases) as JSON")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+                        help="write batch metrics in Prometheus text format, e.g. for a textfile collector")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log conversion progress to stderr")
+    return parser
+
+
+def timestamp(text):
+    """argparse type for --start/--end"""
+    from streamgrab.clip import parse_timestamp
+
+    try:
+        return parse_timestamp(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def collect_playlists(inputs, manifests):
+    """Expand files, directories and manifests into a list of (path, name) pairs"""
+    playlists = []
+    for path in inputs:
+        if _is_url(path):
+            playlists.append((path, None))
+        elif os.path.isdir(path):
+            for entry in sorted(os.listdir(path)):
+                if entry.lower().endswith(".m3u8"):
+                    playlists.append((os.path.join(path, entry), entry))
+        else:
+            playlists.append((path, os.path.basename(path)))
+    for manifest in manifests:
+        playlists.extend(read_manifest(manifest))
+    return playlists
+
+
+def read_manifest(path):
+    """Read a manifest of playlists.
+
+    JSON: a list of paths or of {"playlist": path, "name": output name}
+    objects. CSV: a `playlist` column and an optional `name` column.
+    Relative playlist paths are resolved against the manifest's directory;
+    http(s) URLs are kept as they are.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = json.load(f)
+    entries = []
+    for row in rows:
+        if isinstance(row, str):
+            row = {"playlist": row}
+        if _is_url(row["playlist"]):
+            entries.append((row["playlist"], row.get("name")))
+            continue
+        playlist = os.path.join(base, row["playlist"])
+        entries.append((playlist, row.get("name") or os.path.basename(playlist)))
+    return entries
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stderr,
+    )
+
+    try:
+        playlists = collect_playlists(args.inputs, args.manifest)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"streamgrab: cannot read manifest: {e}", file=sys.stderr)
+        return 2
+    if not playlists:
+        print("streamgrab: no playlists given", file=sys.stderr)
+        return 2
+
+    # The engine pulls in the HTTP and SQLite stacks; import it only once there is work to do
+    from streamgrab.batch import default_workers
+    from streamgrab.convert import ConvertOptions, PlaylistFile, convert_all
+    from streamgrab.fetch import ConnectionPool, FetchError
+    from streamgrab.metrics import MetricsRegistry, write_atomic
+
+    files = []
+    pool = ConnectionPool()
+    try:
+        for path, name in playlists:
+            if _is_url(path):
+                files.append(PlaylistFile.from_url(path, pool, name))
+                continue
+            with open(path, "rb") as f:
+                files.append(PlaylistFile(name, f.read()))
+    except (OSError, FetchError) as e:
+        print(f"streamgrab: {e}", file=sys.stderr)
+        return 2
+    finally:
+        pool.close()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    qualities = args.quality or ["Original"]
+    options = ConvertOptions(
+        quality=qualities[0],
+        extra_qualities=qualities[1:],
+        use_hw_accel=args.hwaccel,
+        segment_window=args.segments,
+        cache_size_gb=args.cache_size,
+        pipeline=args.pipeline,
+        ffmpeg=args.ffmpeg,
+        live_stop_after=args.stop_after,
+        chunk_workers=args.chunks,
+        skip_converted=not args.force,
+        host_connections=args.host_connections,
+        host_bandwidth=args.host_bandwidth,
+        range_span_mb=args.range_span,
+        min_free_gb=args.min_free,
+        clip_start=args.start,
+        clip_end=args.end,
+        frame_accurate=args.frame_accurate,
+    )
+    jobs = args.jobs or default_workers(options.transcode, options.chunk_workers)
+
+    registry = MetricsRegistry()
+    results = []
+    for _, _, result in convert_all(files, args.output_dir, options, jobs, registry=registry):
+        results.append(result)
+        if not args.json:
+            if result.skipped:
+                print(f"skipped {result.name} -> {result.output_path}")
+            elif result.ok:
+                print(f"ok      {result.name} -> {result.output_path}")
+            else:
+                print(f"FAILED  {result.name}: {result.error}")
+
+    failed = sum(1 for r in results if not r.ok)
+    summary = registry.summary()
+    if args.json:
+        json.dump({
+            "total": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "skipped": sum(1 for r in results if r.skipped),
+            "metrics": summary["totals"],
+            "results": [vars(r) for r in results],
+        }, sys.stdout, indent=2)
+        print()
+    try:
+        if args.metrics_json:
+            write_atomic(args.metrics_json, json.dumps(summary, indent=2) + "\n")
+        if args.metrics_prom:
+            registry.write_prometheus(args.metrics_prom)
+    except OSError as e:
+        print(f"streamgrab: cannot write metrics: {e}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _is_url(path):
+    return path.startswith(("http://", "https://"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""Time-range clips of VOD playlists
+
+select_clip finds the segments overlapping [start, end) by binary search
+over the cumulative EXTINF offsets, so only those are fetched; FFmpeg then
+cuts the result to the exact range. A stream copy starts on the keyframe
+at or before the start; with frame accuracy, smart_cut re-encodes only the
+partial GOPs at both edges and copies everything between them. The edges
+are encoded at the source's profile, level and pixel format, with the
+parameter sets repeated in-band so decoders pick them up at each join.
+"""
+import itertools
+import json
+import logging
+import os
+import subprocess
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, replace
+
+from streamgrab.playlist import parse_playlist, render_playlist
+
+logger = logging.getLogger("StreamGrab")
+
+# Software encoders for the re-encoded edges of a frame-accurate copy, by source codec
+EDGE_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+
+# ffprobe profile names to encoder -profile values, by encoder
+EDGE_PROFILES = {
+    "libx264": {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high",
+                "High 10": "high10", "High 4:2:2": "high422", "High 4:4:4 Predictive": "high444"},
+    "libx265": {"Main": "main", "Main 10": "main10", "Main Still Picture": "mainstillpicture"},
+}
+
+# Keyframe times are printed to the microsecond; seek a little past them so rounding never lands a GOP early
+KEYFRAME_EPSILON = 0.0005
+
+
+class ClipError(ValueError):
+    """A clip range that does not fit the playlist"""
+
+
+@dataclass
+class Clip:
+    """A time range of a playlist and the segments fetched for it.
+
+    start and end are seconds from the start of the source playlist;
+    offset is where the first selected segment starts, so the range begins
+    start - offset seconds into the clipped playlist.
+    """
+    start: float
+    end: float
+    offset: float
+    first: int
+    last: int
+    total: int
+    # The range runs to the end of the playlist
+    to_end: bool = False
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def seek_args(self, absolute=False):
+        """FFmpeg input options cutting an input to the range.
+
+        The input is the clipped playlist, or with absolute set the whole
+        source (a separate audio rendition, for instance).
+        """
+        skip = self.start if absolute else self.start - self.offset
+        args = ["-ss", f"{skip:.6f}"] if skip > 0 else []
+        return [*args, "-t", f"{self.duration:.6f}"]
+
+    def describe(self):
+        return (f"{format_timestamp(self.start)}-{format_timestamp(self.end)}: "
+                f"segments {self.first + 1}-{self.last} of {self.total}")
+
+
+def parse_timestamp(text):
+    """Seconds from "SS", "MM:SS" or "HH:MM:SS" (fractions allowed); empty means 0"""
+    text = (text or "").strip()
+    if not text:
+        return 0.0
+    seconds = 0.0
+    for part in text.split(":"):
+        try:
+            value = float(part)
+        except ValueError:
+            raise ValueError(f"{text!r} is not a time in seconds or HH:MM:SS") from None
+        if value < 0:
+            raise ValueError(f"{text!r} is negative")
+        seconds = seconds * 60 + value
+    return seconds
+
+
+def format_timestamp(seconds):
+    whole = int(seconds)
+    fraction = f"{seconds - whole:.3f}"[1:] if seconds != whole else ""
+    return f"{whole // 3600:02d}:{whole % 3600 // 60:02d}:{whole % 60:02d}{fraction}"
+
+
+def clip_name(name, start, end):
+    """Output name for a clip of name, e.g. talk_00h10m00s-00h12m30s.m3u8"""
+    base, ext = os.path.splitext(name)
+
+    def label(seconds):
+        seconds = int(seconds)
+        return f"{seconds // 3600:02d}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
+    return f"{base}_{label(start)}-{label(end) if end else 'end'}{ext}"
+
+
+def select_clip(segments, start, end=0.0):
+    """The Clip of segments overlapping [start, end); end 0 means the end of the playlist.
+
+    Raises ClipError when the range is empty or starts past the end.
+    """
+    starts = list(itertools.accumulate((seg.duration for seg in segments), initial=0.0))
+    total_duration = starts[-1]
+    if end and end <= start:
+        raise ClipError(f"clip end {format_timestamp(end)} is not after its start {format_timestamp(start)}")
+    if start >= total_duration:
+        raise ClipError(f"clip start {format_timestamp(start)} is past the end of the playlist "
+                        f"({format_timestamp(total_duration)})")
+    to_end = not end or end >= total_duration
+    end = total_duration if to_end else end
+    # Last segment starting at or before start, up to the first one starting at or after end
+    first = bisect_right(starts, start, hi=len(segments)) - 1
+    last = max(bisect_left(starts, end, lo=first, hi=len(segments)), first + 1)
+    return Clip(start, end, starts[first], first, last, len(segments), to_end)
+
+
+def clip_playlist(playlist_bytes, base_url, start, end=0.0):
+    """Return (playlist bytes holding only the segments of the range, Clip).
+
+    URIs of the clipped playlist are resolved against base_url, so it can
+    be handed to FFmpeg from anywhere.
+    """
+    playlist = parse_playlist(playlist_bytes.decode("utf-8-sig"), base_url)
+    if playlist.is_master or not playlist.segments:
+        raise ClipError("only media playlists with segments can be clipped")
+    clip = select_clip(playlist.segments, start, end)
+    segments = playlist.segments[clip.first:clip.last]
+    clipped = replace(playlist, segments=segments, media_sequence=segments[0].sequence, endlist=True)
+    return render_playlist(clipped).encode("utf-8"), clip
+
+
+def keyframe_times(ffprobe, source, input_args=()):
+    """Times of the video keyframes of source, in seconds from its start"""
+    cmd = [ffprobe, "-v", "error", "-protocol_whitelist", "file,http,https,tcp,tls", *input_args,
+           "-select_streams", "v:0", "-skip_frame", "nokey",
+           "-show_entries", "frame=best_effort_timestamp_time:format=start_time", "-of", "json", source]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+    if result.returncode != 0:
+        raise OSError(f"ffprobe could not list keyframes: {result.stderr.strip()[-300:]}")
+    data = json.loads(result.stdout or "{}")
+    origin = float(data.get("format", {}).get("start_time") or 0.0)
+    times = []
+    for frame in data.get("frames", []):
+        try:
+            times.append(float(frame["best_effort_timestamp_time"]) - origin)
+        except (KeyError, ValueError):
+            continue
+    return sorted(times)
+
+
+def video_params(ffprobe, source, input_args=()):
+    """Profile, level and pixel format of the first video stream of source, or None if ffprobe fails"""
+    cmd = [ffprobe, "-v", "error", "-protocol_whitelist", "file,http,https,tcp,tls", *input_args,
+           "-select_streams", "v:0", "-show_entries", "stream=profile,level,pix_fmt", "-of", "json", source]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        streams = json.loads(result.stdout or "{}").get("streams") or [{}]
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return None
+    if result.returncode != 0 or not streams[0].get("pix_fmt"):
+        return None
+    return streams[0]
+
+
+def edge_encode_args(encoder, params):
+    """Encoder options for a re-encoded edge that the copied middle can follow, or None.
+
+    The edge keeps the source's profile, level and pixel format, and
+    repeats its SPS/PPS (and VPS for HEVC) before every keyframe so the
+    decoder has them at each join. None when the source profile has no
+    counterpart in encoder.
+    """
+    args = ["-c:v", encoder, "-crf", "18", "-preset", "medium", "-pix_fmt", params["pix_fmt"]]
+    profile = params.get("profile")
+    if profile and profile != "unknown":
+        if EDGE_PROFILES[encoder].get(profile) is None:
+            return None
+        args += ["-profile:v", EDGE_PROFILES[encoder][profile]]
+    level = params.get("level")
+    codec_params = ["repeat-headers=1"]
+    if isinstance(level, int) and level > 0:
+        # H.264 levels are reported times 10 (40 is 4.0), HEVC levels times 30 (120 is 4.0)
+        if encoder == "libx264":
+            args += ["-level:v", f"{level / 10:.1f}"]
+        else:
+            codec_params.append(f"level-idc={level / 30:.1f}")
+    flag = "-x264-params" if encoder == "libx264" else "-x265-params"
+    return [*args, flag, ":".join(codec_params)]
+
+
+def smart_cut(ffmpeg, ffprobe, source, input_args, clip, codec, parts_dir, add_log):
+    """Cut the video of a clipped playlist frame-accurately and return a concat list of the parts.
+
+    The partial GOP before the first keyframe in the range and the part
+    after the last one are re-encoded; the keyframe-aligned middle is a
+    stream copy. Returns None when the codec or its profile has no
+    matching encoder, or the source cannot be probed, in which case the
+    caller copies from the keyframe before the start.
+    Raises OSError if FFmpeg fails on a part.
+    """
+    encoder = EDGE_ENCODERS.get(codec)
+    if encoder is None:
+        add_log(f"Frame-accurate cuts need re-encoding {codec or 'unknown'} video, which is not supported; "
+                f"cutting at the nearest keyframe instead", "WARNING")
+        return None
+    params = video_params(ffprobe, source, input_args)
+    encode = edge_encode_args(encoder, params) if params else None
+    if encode is None:
+        profile = params.get("profile") if params else "unknown"
+        add_log(f"Frame-accurate cuts need re-encoding {codec} video at the source's profile ({profile}), "
+                f"which is not supported; cutting at the nearest keyframe instead", "WARNING")
+        return None
+    start = clip.start - clip.offset
+    end = clip.end - clip.offset
+    keyframes = keyframe_times(ffprobe, source, input_args)
+    inner = [t for t in keyframes if start - KEYFRAME_EPSILON <= t <= end]
+    copy_from = inner[0] if inner else None
+    copy_to = end if clip.to_end else (inner[-1] if inner else None)
+
+    def run(name, seek, duration, video_args):
+        path = os.path.join(parts_dir, name)
+        cmd = [ffmpeg, "-y", "-v", "error", "-protocol_whitelist", "file,http,https,tcp,tls", *input_args,
+               "-ss", f"{seek:.6f}", "-i", source, "-t", f"{duration:.6f}",
+               "-map", "0:v:0", "-an", "-sn", *video_args, "-f", "mpegts", path]
+        logger.debug(f"Smart cut part: {' '.join(cmd)}")
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise OSError(f"FFmpeg failed on clip part {name}: {result.stderr.strip()[-300:]}")
+        return name
+
+    parts = []
+    if copy_from is None or copy_to - copy_from <= KEYFRAME_EPSILON:
+        add_log(f"No keyframe inside the clip, re-encoding all {clip.duration:.1f}s of video", "INFO")
+        parts.append(run("whole.ts", start, end - start, encode))
+    else:
+        if copy_from - start > KEYFRAME_EPSILON:
+            parts.append(run("head.ts", start, copy_from - start, encode))
+        parts.append(run("middle.ts", copy_from + KEYFRAME_EPSILON, copy_to - copy_from, ["-c:v", "copy"]))
+        if end - copy_to > KEYFRAME_EPSILON:
+            parts.append(run("tail.ts", copy_to, end - copy_to, encode))
+        add_log(f"Frame-accurate cut: re-encoded {max(0.0, copy_from - start):.2f}s + "
+                f"{max(0.0, end - copy_to):.2f}s at the edges, copied {copy_to - copy_from:.2f}s", "INFO")
+
+    concat_list = os.path.join(parts_dir, "parts.txt")
+    with open(concat_list, "w") as f:
+        f.write("ffconcat version 1.0\n")
+        f.writelines(f"file '{part}'\n" for part in parts)
+    return concat_list
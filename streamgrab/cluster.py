@@ -0,0 +1,453 @@
+"""Coordinator/worker mode for spreading a conversion backlog over several machines
+
+The coordinator owns the SQLite job queue and serves it over plain HTTP
+with JSON bodies; workers claim jobs under a lease, renew it with
+heartbeats while converting, and report progress, log lines, the result
+and the job's metrics back. A reaper queues again jobs whose lease ran
+out, so the work of a dead worker is picked up by another one.
+
+    streamgrab-cluster coordinator --db jobs.sqlite --port 8470
+    streamgrab-cluster worker -c http://coordinator:8470 --workers 2 -o /mnt/videos
+    streamgrab-cluster submit -c http://coordinator:8470 -q Low archive/*.m3u8
+    streamgrab-cluster status -c http://coordinator:8470
+
+Several workers can run on one host, each as its own process. The
+coordinator listens on loopback only unless it is given a token.
+"""
+import argparse
+import base64
+import dataclasses
+import http.server
+import ipaddress
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from streamgrab.cli import timestamp
+from streamgrab.convert import ConvertOptions, PlaylistFile
+from streamgrab.jobs import DEFAULT_DB_PATH, MAX_ATTEMPTS, JobManager, JobQueue
+from streamgrab.metrics import JobMetrics, MetricsRegistry
+
+logger = logging.getLogger("StreamGrab")
+
+DEFAULT_PORT = 8470
+DEFAULT_URL = f"http://127.0.0.1:{DEFAULT_PORT}"
+
+# Seconds a claimed job stays assigned without a heartbeat
+DEFAULT_LEASE = 60.0
+
+TOKEN_HEADER = "X-StreamGrab-Token"
+
+# Options that name programs or paths on the worker's own host; never taken from, or handed out over, the network
+HOST_LOCAL_OPTIONS = frozenset({"ffmpeg", "cache_dir", "cache_size_gb", "min_free_gb"})
+
+
+class ClusterError(OSError):
+    """The coordinator rejected a request"""
+
+
+def _encode_options(options):
+    return {k: v for k, v in dataclasses.asdict(options).items() if k not in HOST_LOCAL_OPTIONS}
+
+
+def _decode_options(data):
+    # Ignore fields a newer coordinator knows about and this worker does not, and host-local ones
+    known = {f.name for f in dataclasses.fields(ConvertOptions)} - HOST_LOCAL_OPTIONS
+    return ConvertOptions(**{k: v for k, v in data.items() if k in known})
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    coordinator = None
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == "/status":
+            self._reply(self.coordinator.status())
+        elif self.path == "/metrics":
+            self._reply(self.coordinator.prometheus(), content_type="text/plain; version=0.0.4")
+        else:
+            self._reply({"error": f"Unknown path {self.path}"}, 404)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        handler = self.coordinator.routes.get(self.path)
+        if handler is None:
+            self._reply({"error": f"Unknown path {self.path}"}, 404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            self._reply(handler(payload))
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply({"error": f"Bad request: {e}"}, 400)
+
+    def _authorized(self):
+        token = self.coordinator.token
+        if token and self.headers.get(TOKEN_HEADER) != token:
+            self._reply({"error": "Missing or wrong token"}, 403)
+            return False
+        return True
+
+    def _reply(self, body, status=200, content_type="application/json"):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Coordinator:
+    """Serves a JobQueue to remote workers over HTTP.
+
+    Every POST takes and returns a JSON object. A reaper thread checks for
+    expired leases a few times per lease; jobs that expired max_attempts
+    times are failed rather than handed out again.
+    """
+
+    def __init__(self, queue, host="127.0.0.1", port=DEFAULT_PORT, token=None, max_attempts=MAX_ATTEMPTS,
+                 reap_interval=5.0):
+        self.queue = queue
+        self.token = token
+        self.max_attempts = max_attempts
+        self.reap_interval = reap_interval
+        self.routes = {
+            "/submit": self._submit,
+            "/claim": self._claim,
+            "/heartbeat": self._heartbeat,
+            "/progress": self._progress,
+            "/log": self._log,
+            "/finish": self._finish,
+        }
+        handler = type("Handler", (_Handler,), {"coordinator": self})
+        self.httpd = http.server.ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._stop = threading.Event()
+        self._reaper = threading.Thread(target=self._reap, daemon=True, name="lease-reaper")
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{'127.0.0.1' if host == '0.0.0.0' else host}:{port}"
+
+    def serve_forever(self):
+        self._reaper.start()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self._stop.set()
+            self.httpd.server_close()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+    def _reap(self):
+        while not self._stop.wait(self.reap_interval):
+            try:
+                self.queue.requeue_expired(self.max_attempts)
+            except Exception as e:
+                logger.error(f"Checking job leases failed: {e}")
+
+    def _submit(self, payload):
+        playlist = PlaylistFile(payload["name"], base64.b64decode(payload["playlist"]), url=payload.get("url"))
+        job_id = self.queue.submit(playlist, payload["output_dir"], _decode_options(payload.get("options", {})))
+        return {"id": job_id}
+
+    def _claim(self, payload):
+        claimed = self.queue.claim(payload["owner"], lease=float(payload.get("lease") or DEFAULT_LEASE))
+        if claimed is None:
+            return {"job": None}
+        job_id, playlist, output_dir, options = claimed
+        logger.info(f"Job #{job_id} ({playlist.name}) claimed by {payload['owner']}")
+        return {"job": {
+            "id": job_id,
+            "name": playlist.name,
+            "playlist": base64.b64encode(playlist.getvalue()).decode("ascii"),
+            "url": playlist.url,
+            "output_dir": output_dir,
+            "options": _encode_options(options),
+        }}
+
+    def _heartbeat(self, payload):
+        return {"ok": self.queue.heartbeat(payload["id"], payload["owner"], float(payload["lease"]))}
+
+    def _progress(self, payload):
+        self.queue.set_progress(payload["id"], payload.get("fraction"), payload.get("text"))
+        return {"ok": True}
+
+    def _log(self, payload):
+        self.queue.log(payload["id"], payload.get("level", "INFO"), payload["message"])
+        return {"ok": True}
+
+    def _finish(self, payload):
+        ok = self.queue.finish(payload["id"], bool(payload["ok"]), payload.get("output_path"),
+                               payload.get("error", ""), metrics=payload.get("metrics"), owner=payload["owner"])
+        if ok:
+            logger.info(f"Job #{payload['id']} {'done' if payload['ok'] else 'failed'} on {payload['owner']}")
+        return {"ok": ok}
+
+    def status(self):
+        return {
+            "counts": self.queue.counts(),
+            "jobs": [dataclasses.asdict(job) for job in self.queue.jobs(limit=100)],
+        }
+
+    def prometheus(self):
+        registry = MetricsRegistry()
+        for data in self.queue.job_metrics():
+            registry.record(JobMetrics.from_dict(data))
+        return registry.prometheus()
+
+
+class RemoteQueue:
+    """The part of the JobQueue interface a JobManager uses, backed by a coordinator.
+
+    Progress and log updates are best effort: a coordinator that is briefly
+    unreachable must not fail a conversion that is otherwise going fine.
+    overrides replaces ConvertOptions fields of every claimed job, for
+    settings that depend on the worker host such as the ffmpeg path.
+    """
+
+    def __init__(self, url, token=None, timeout=30.0, overrides=None):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+        self.overrides = overrides or {}
+
+    def _request(self, path, payload=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                if response.headers.get_content_type() != "application/json":
+                    return body.decode("utf-8")
+                return json.loads(body)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                message = e.reason
+            raise ClusterError(f"{path}: {message}") from None
+
+    def submit(self, m3u8_file, output_dir, options):
+        return self._request("/submit", {
+            "name": m3u8_file.name,
+            "playlist": base64.b64encode(m3u8_file.getvalue()).decode("ascii"),
+            "url": getattr(m3u8_file, "url", None),
+            "output_dir": output_dir,
+            "options": _encode_options(options),
+        })["id"]
+
+    def claim(self, owner, lease=None):
+        job = self._request("/claim", {"owner": owner, "lease": lease})["job"]
+        if job is None:
+            return None
+        options = _decode_options(job["options"])
+        if self.overrides:
+            options = dataclasses.replace(options, **self.overrides)
+        playlist = PlaylistFile(job["name"], base64.b64decode(job["playlist"]), url=job.get("url"))
+        return job["id"], playlist, job["output_dir"], options
+
+    def heartbeat(self, job_id, owner, lease):
+        return self._request("/heartbeat", {"id": job_id, "owner": owner, "lease": lease})["ok"]
+
+    def finish(self, job_id, ok, output_path, error="", metrics=None, owner=None):
+        payload = {"id": job_id, "ok": ok, "output_path": output_path, "error": error, "metrics": metrics,
+                   "owner": owner}
+        for attempt in range(3):
+            try:
+                return self._request("/finish", payload)["ok"]
+            except OSError as e:
+                # The lease keeps the job ours for a while; give the coordinator a moment to come back
+                logger.warning(f"Reporting job #{job_id} failed (attempt {attempt + 1}/3): {e}")
+                time.sleep(2 ** attempt)
+        return False
+
+    def set_progress(self, job_id, fraction, text):
+        try:
+            self._request("/progress", {"id": job_id, "fraction": fraction, "text": text})
+        except OSError as e:
+            logger.debug(f"Progress update for job #{job_id} failed: {e}")
+
+    def log(self, job_id, level, message):
+        try:
+            self._request("/log", {"id": job_id, "level": level, "message": message})
+        except OSError as e:
+            logger.debug(f"Log line for job #{job_id} failed: {e}")
+
+    def status(self):
+        return self._request("/status")
+
+    def requeue_orphans(self):
+        # Jobs of dead remote workers are recovered by lease expiry on the coordinator
+        return []
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="streamgrab-cluster",
+                                     description="Spread conversion jobs over several worker machines.")
+    parser.add_argument("--token", default=os.environ.get("STREAMGRAB_TOKEN"),
+                        help="shared secret required on every request (default: $STREAMGRAB_TOKEN)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+    remote = argparse.ArgumentParser(add_help=False)
+    remote.add_argument("-c", "--coordinator", default=os.environ.get("STREAMGRAB_COORDINATOR", DEFAULT_URL),
+                        help=f"coordinator URL (default: $STREAMGRAB_COORDINATOR or {DEFAULT_URL})")
+
+    coordinator = commands.add_parser("coordinator", help="serve the job queue to workers")
+    coordinator.add_argument("--db", default=DEFAULT_DB_PATH, help=f"job database (default: {DEFAULT_DB_PATH})")
+    coordinator.add_argument("--host", default="127.0.0.1",
+                             help="address to listen on (default: 127.0.0.1); other addresses need --token")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"(default: {DEFAULT_PORT})")
+    coordinator.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                             help=f"claims of a job before it is failed (default: {MAX_ATTEMPTS})")
+
+    worker = commands.add_parser("worker", parents=[remote], help="run jobs claimed from a coordinator")
+    worker.add_argument("-j", "--workers", type=int, default=1, help="jobs run in parallel (default: 1)")
+    worker.add_argument("--lease", type=float, default=DEFAULT_LEASE,
+                        help=f"seconds a job stays ours without a heartbeat (default: {DEFAULT_LEASE:.0f})")
+    worker.add_argument("-o", "--output-dir", help="write outputs here instead of the submitted directory")
+    worker.add_argument("--ffmpeg", help="ffmpeg executable on this worker")
+    worker.add_argument("--min-free", type=float, metavar="GB", help="disk space this worker keeps free (default: 1)")
+    worker.add_argument("--metrics-prom", metavar="PATH", help="write this worker's metrics in Prometheus format")
+
+    submit = commands.add_parser("submit", parents=[remote], help="queue playlists on a coordinator")
+    submit.add_argument("inputs", nargs="*", metavar="PLAYLIST", help=".m3u8 files, directories or URLs")
+    submit.add_argument("-m", "--manifest", action="append", default=[], help="JSON or CSV manifest")
+    submit.add_argument("-o", "--output-dir", default=".", help="where workers write MP4 files (default: .)")
+    submit.add_argument("-q", "--quality", choices=["Low", "Medium", "High", "Original"], action="append",
+                        help="output quality (default: Original); repeat for several qualities in one pass")
+    submit.add_argument("--segments", type=int, default=8, help="segments downloaded concurrently per video")
+    submit.add_argument("--hwaccel", action="store_true", help="let workers use hardware encoding")
+    submit.add_argument("--start", type=timestamp, default=0.0, metavar="TIME",
+                        help="convert from this time on (seconds or HH:MM:SS)")
+    submit.add_argument("--end", type=timestamp, default=0.0, metavar="TIME",
+                        help="convert up to this time (default: the end)")
+    submit.add_argument("--frame-accurate", action="store_true", help="cut stream copies on the exact frame")
+    submit.add_argument("--force", action="store_true", help="convert again even if an up-to-date output exists")
+
+    status = commands.add_parser("status", parents=[remote], help="show job counts on a coordinator")
+    status.add_argument("--json", action="store_true", help="print the full status as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose or args.command in ("coordinator", "worker") else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stderr,
+    )
+    try:
+        return COMMANDS[args.command](args)
+    except OSError as e:
+        print(f"streamgrab-cluster: {e}", file=sys.stderr)
+        return 2
+
+
+def _coordinator(args):
+    if not args.token and not _is_loopback(args.host):
+        print(f"streamgrab-cluster: refusing to listen on {args.host} without --token or $STREAMGRAB_TOKEN",
+              file=sys.stderr)
+        return 2
+    coordinator = Coordinator(JobQueue(args.db), args.host, args.port, token=args.token,
+                              max_attempts=args.max_attempts)
+    logger.info(f"Coordinator for {args.db} listening on {args.host}:{coordinator.httpd.server_address[1]}")
+    try:
+        coordinator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _worker(args):
+    overrides = {"ffmpeg": args.ffmpeg} if args.ffmpeg else {}
+    if args.min_free is not None:
+        overrides["min_free_gb"] = args.min_free
+    queue = RemoteQueue(args.coordinator, args.token, overrides=overrides)
+    manager = JobManager(queue, args.workers, lease=args.lease, output_dir=args.output_dir,
+                         metrics_path=args.metrics_prom)
+    logger.info(f"Worker {manager.owner} running {args.workers} jobs at a time from {args.coordinator}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        manager.stop()
+    return 0
+
+
+def _submit(args):
+    from streamgrab.cli import collect_playlists
+    from streamgrab.fetch import ConnectionPool, FetchError
+
+    qualities = args.quality or ["Original"]
+    options = ConvertOptions(quality=qualities[0], extra_qualities=qualities[1:], use_hw_accel=args.hwaccel,
+                             segment_window=args.segments, skip_converted=not args.force, clip_start=args.start,
+                             clip_end=args.end, frame_accurate=args.frame_accurate)
+    try:
+        playlists = collect_playlists(args.inputs, args.manifest)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"streamgrab-cluster: cannot read manifest: {e}", file=sys.stderr)
+        return 2
+    queue = RemoteQueue(args.coordinator, args.token)
+    pool = ConnectionPool()
+    try:
+        for path, name in playlists:
+            if path.startswith(("http://", "https://")):
+                playlist = PlaylistFile.from_url(path, pool, name)
+            else:
+                with open(path, "rb") as f:
+                    playlist = PlaylistFile(name, f.read())
+            job_id = queue.submit(playlist, os.path.abspath(args.output_dir), options)
+            print(f"queued  #{job_id} {playlist.name}")
+    except (OSError, FetchError) as e:
+        print(f"streamgrab-cluster: {e}", file=sys.stderr)
+        return 2
+    finally:
+        pool.close()
+    return 0
+
+
+def _status(args):
+    status = RemoteQueue(args.coordinator, args.token).status()
+    if args.json:
+        json.dump(status, sys.stdout, indent=2)
+        print()
+        return 0
+    print("  ".join(f"{state}: {count}" for state, count in sorted(status["counts"].items())) or "no jobs")
+    for job in status["jobs"]:
+        if job["state"] == "running":
+            print(f"running #{job['id']} {job['name']} on {job['owner']} "
+                  f"(attempt {job['attempts']}) {job['progress_text'] or ''}")
+    return 0
+
+
+COMMANDS = {"coordinator": _coordinator, "worker": _worker, "submit": _submit, "status": _status}
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,940 @@
+"""Conversion engine: M3U8 playlist in, MP4 out
+
+Importable without Streamlit; the Streamlit apps and the CLI are thin
+front-ends over convert_m3u8_to_mp4 and convert_all.
+"""
+import functools
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from streamgrab.batch import JobResult, run_batch
+from streamgrab.cache import DEFAULT_CACHE_DIR, SegmentCache
+from streamgrab.chunked import encode_chunks
+from streamgrab.clip import ClipError, clip_name, clip_playlist, smart_cut
+from streamgrab.crypto import can_decrypt
+from streamgrab.diskspace import DiskSpaceError, disk_admission
+from streamgrab.fetch import (DEFAULT_MAX_SPAN, ConnectionPool, coalesce_ranges, content_length, download_playlist,
+                              fetch_url)
+from streamgrab.hwaccel import (Capabilities, EncodePlan, encode_plans, init_failed, mark_broken, probe,
+                                software_encoder_args)
+from streamgrab.journal import job_dir, job_dir_path
+from streamgrab.live import LiveFeeder, LivePoller, live_playlist
+from streamgrab.metrics import JobMetrics, MetricsRegistry
+from streamgrab.outputs import output_fingerprint, output_index
+from streamgrab.pipeline import BytesFeeder, StdinFeeder, streamable_playlist
+from streamgrab.playlist import PlaylistError, is_remote, parse_playlist, select_variant
+from streamgrab.probe import ffprobe_for, playlist_fingerprint, probe_stream
+from streamgrab.progress import ProgressParser, StderrDrain, format_seconds
+from streamgrab.scheduler import FetchScheduler, HostLimits
+
+logger = logging.getLogger("StreamGrab")
+
+QUALITIES = ["Low", "Medium", "High", "Original"]
+
+# FFmpeg scale filter per quality preset
+SCALE_MAP = {"Low": "640:-1", "Medium": "1280:-1", "High": "1920:-1"}
+
+# Target width and, for variants without RESOLUTION, bandwidth ceiling per quality
+QUALITY_TARGETS = {"Low": (640, 1_500_000), "Medium": (1280, 4_000_000), "High": (1920, 8_000_000)}
+
+# Bitrate assumed for disk space estimates when a playlist gives neither BANDWIDTH nor segment sizes
+FALLBACK_BITRATE = 8_000_000
+
+# Slack on disk space estimates for container overhead and bitrate peaks
+ESTIMATE_MARGIN = 1.1
+
+
+@dataclass
+class ConvertOptions:
+    """Settings shared by every job in a batch"""
+    quality: str = "Original"
+    # Further qualities written from the same download and decode, each to <name>_<quality>.mp4
+    extra_qualities: list = field(default_factory=list)
+    use_hw_accel: bool = False
+    segment_window: int = 8
+    cache_size_gb: float = 5.0
+    cache_dir: str = DEFAULT_CACHE_DIR
+    # Stream segments straight into ffmpeg's stdin instead of staging them on disk
+    pipeline: bool = False
+    ffmpeg: str = "ffmpeg"
+    # Seconds of media to record from a live playlist; 0 records until it ends
+    live_stop_after: float = 0.0
+    # Transcode downloaded segments in chunks on this many ffmpeg processes; 0 or 1 is one pass
+    chunk_workers: int = 0
+    # Skip playlists the output directory's index says were already converted with these settings
+    skip_converted: bool = True
+    # Requests in flight and MB/s per origin host, over all jobs sharing a connection pool; 0 is unlimited
+    host_connections: int = 16
+    host_bandwidth: float = 0.0
+    # Convert only [clip_start, clip_end) seconds of a VOD playlist; clip_end 0 runs to the end
+    clip_start: float = 0.0
+    clip_end: float = 0.0
+    # Cut a stream-copied clip on the exact frame by re-encoding the GOPs at its edges
+    frame_accurate: bool = False
+    # Largest merged Range request, in MB, for adjacent EXT-X-BYTERANGE segments
+    range_span_mb: float = DEFAULT_MAX_SPAN / 1024 ** 2
+    # GB left free on the output and staging filesystems; jobs wait until theirs fits above it
+    min_free_gb: float = 1.0
+
+    @property
+    def qualities(self):
+        """Every quality to write, options.quality first"""
+        return list(dict.fromkeys([self.quality, *self.extra_qualities]))
+
+    @property
+    def transcode(self):
+        return any(quality != "Original" for quality in self.qualities)
+
+    @property
+    def clipped(self):
+        return bool(self.clip_start or self.clip_end)
+
+    @property
+    def host_limits(self):
+        return HostLimits(self.host_connections, self.host_bandwidth * 1024 ** 2)
+
+    @property
+    def max_span(self):
+        return max(1, int(self.range_span_mb * 1024 ** 2))
+
+
+class PlaylistFile:
+    """An in-memory playlist with the same interface as a Streamlit UploadedFile.
+
+    url is where the playlist was downloaded from, if anywhere; it resolves
+    relative URIs and lets live playlists be reloaded.
+    """
+
+    def __init__(self, name, data, url=None):
+        self.name = name
+        self._data = data
+        self.url = url
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, "rb") as f:
+            return cls(os.path.basename(path), f.read())
+
+    @classmethod
+    def from_url(cls, url, pool, name=None):
+        name = name or os.path.basename(urlsplit(url).path) or "playlist.m3u8"
+        return cls(name, fetch_url(pool, url), url=url)
+
+    def getvalue(self):
+        return self._data
+
+
+def log_to_logger(message, level="INFO", key=None):
+    """Default log callback: forward to the StreamGrab logger.
+
+    Keyed messages are live progress updates and go out at DEBUG level.
+    """
+    if key is not None:
+        logger.debug(message)
+    elif level == "ERROR":
+        logger.error(message)
+    elif level == "WARNING":
+        logger.warning(message)
+    else:
+        logger.info(message)
+
+
+def output_path_for(output_dir, name):
+    base = os.path.splitext(name)[0]
+    return os.path.join(output_dir, f"{base}.mp4")
+
+
+def partial_path(path):
+    """Where FFmpeg writes path until it finishes: a hidden .partial.mp4 in the same directory"""
+    head, tail = os.path.split(path)
+    return os.path.join(head, f".{os.path.splitext(tail)[0]}.partial.mp4")
+
+
+def finish_outputs(paths):
+    """Rename each finished partial_path() output over its final path"""
+    for path in paths:
+        os.replace(partial_path(path), path)
+
+
+def rendition_paths(output_path, options):
+    """Output path per quality: output_path for options.quality, <base>_<quality>.mp4 for the others"""
+    base = os.path.splitext(output_path)[0]
+    return {quality: output_path if quality == options.quality else f"{base}_{quality.lower()}.mp4"
+            for quality in options.qualities}
+
+
+def claim_output(m3u8_file, output_dir, options):
+    """Pick a job's output path through the output directory's index.
+
+    Returns (output path, fingerprint, True if an unchanged output with the
+    same fingerprint exists and options.skip_converted is set). A
+    fingerprint that is not None must be handed back with
+    output_index(output_dir).release() when the job ends.
+    """
+    name = m3u8_file.name
+    if options.clipped:
+        name = clip_name(name, options.clip_start, options.clip_end)
+    fingerprint = output_fingerprint(m3u8_file, options)
+    if fingerprint is None:
+        return output_path_for(output_dir, name), None, False
+    index = output_index(output_dir)
+    output_path, converted = index.claim(fingerprint, name, reuse=options.skip_converted)
+    if converted and not all(os.path.exists(path) for path in rendition_paths(output_path, options).values()):
+        # The index tracks the main output; a missing extra quality means converting again
+        output_path, converted = index.claim(fingerprint, name, reuse=False)
+    return output_path, fingerprint, converted
+
+
+def select_rendition(m3u8_file, quality, pool, add_log):
+    """Resolve the upload to the media playlist that should be converted.
+
+    For a master playlist, the EXT-X-STREAM-INF variant that best fits the
+    quality is fetched so it can be remuxed instead of downscaled. Returns
+    (playlist bytes, base URL, separate audio URL, whether a transcode is needed,
+    the variant's BANDWIDTH or 0). Raises PlaylistError for a malformed upload.
+    """
+    playlist_bytes = m3u8_file.getvalue()
+    url = getattr(m3u8_file, "url", None)
+    transcode = quality != "Original"
+    playlist = preflight(playlist_bytes, url)
+    if not playlist.is_master or not playlist.variants:
+        return playlist_bytes, url, None, transcode, 0
+
+    max_width, max_bandwidth = QUALITY_TARGETS.get(quality, (None, None))
+    variant, fits = select_variant(playlist.variants, max_width, max_bandwidth)
+    size = "x".join(map(str, variant.resolution)) if variant.resolution else "unknown size"
+    if not is_remote(variant.uri):
+        add_log(f"{m3u8_file.name} is a master playlist with relative variant URIs, "
+                f"letting FFmpeg choose the stream", "WARNING")
+        return playlist_bytes, url, None, transcode, 0
+    if fits:
+        add_log(f"Selected {size} @ {variant.bandwidth // 1000} kbps variant of {m3u8_file.name} "
+                f"for {quality} quality, remuxing without re-encoding", "INFO")
+    else:
+        add_log(f"No variant of {m3u8_file.name} fits {quality} quality, "
+                f"downscaling the smallest ({size} @ {variant.bandwidth // 1000} kbps)", "INFO")
+
+    audio = playlist.audio_rendition(variant)
+    return fetch_url(pool, variant.uri), variant.uri, audio.uri if audio else None, not fits, variant.bandwidth
+
+
+def preflight(playlist_bytes, base_url=None):
+    """Parse and check a playlist before anything is downloaded or FFmpeg is started.
+
+    Returns the parsed playlist. Raises PlaylistError naming the line at
+    fault, including for problems the parser accepts but a conversion
+    cannot get past: no segments, or relative segment URIs with no
+    playlist URL to resolve them against.
+    """
+    try:
+        text = playlist_bytes.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise PlaylistError(playlist_bytes[:e.start].count(b"\n") + 1, "not valid UTF-8 text") from None
+    playlist = parse_playlist(text, base_url)
+    if playlist.is_master:
+        return playlist
+    if not playlist.segments and playlist.endlist:
+        raise PlaylistError(len(text.splitlines()), "playlist ends without any segments")
+    if not base_url:
+        for seg in playlist.segments:
+            if not is_remote(seg.uri) and not os.path.isabs(seg.uri):
+                raise PlaylistError(_line_of(text, seg.uri), f"segment URI {seg.uri!r} is relative, and the "
+                                    f"playlist has no URL to resolve it against; load it by URL instead")
+    return playlist
+
+
+def _line_of(text, uri):
+    for lineno, line in enumerate(text.splitlines(), 1):
+        if line.strip() == uri:
+            return lineno
+    return 0
+
+
+def fetch_segments_locally(name, playlist_bytes, base_url, output_path, segment_window, pool, add_log,
+                           cache=None, metrics=None, max_span=DEFAULT_MAX_SPAN):
+    """Download the playlist's segments in parallel and return (local playlist, work dir).
+
+    The work dir lives next to the output and is journaled, so a job that is
+    interrupted only fetches its missing segments when it is run again.
+    Returns (None, None) when the playlist is not a media playlist with
+    absolute HTTP(S) segment URIs, in which case FFmpeg fetches it itself.
+    """
+    if segment_window <= 1:
+        return None, None
+    try:
+        playlist = parse_playlist(playlist_bytes.decode("utf-8-sig"), base_url)
+    except (UnicodeDecodeError, ValueError) as e:
+        add_log(f"Could not parse {name}, falling back to FFmpeg: {e}", "WARNING")
+        return None, None
+    if playlist.is_master or not playlist.segments or not all(is_remote(s.uri) for s in playlist.segments):
+        return None, None
+    if playlist.encrypted and any(seg.init is not None for seg in playlist.segments):
+        # An encrypted EXT-X-MAP section needs the IV of the key that applies to it; FFmpeg tracks that
+        return None, None
+    if not can_decrypt(playlist):
+        add_log(f"{name} uses encryption that cannot be decrypted here (install 'cryptography' for AES-128), "
+                f"letting FFmpeg fetch and decrypt it", "WARNING")
+        return None, None
+
+    work_dir = job_dir(jobs_root_for(output_path), playlist_bytes, output_path)
+    ranged = f" in {len(coalesce_ranges(playlist.segments, max_span))} requests" if playlist.ranged else ""
+    add_log(f"Downloading {len(playlist.segments)} segments of {name}{ranged} "
+            f"({segment_window} in flight)", "INFO")
+
+    def on_segment(done, total):
+        add_log(f"Downloading {name} - Segments: {done}/{total}", "INFO", key=f"download:{output_path}")
+
+    metrics = metrics or JobMetrics(name)
+    try:
+        with metrics.phase("fetch"):
+            local_playlist = download_playlist(playlist, work_dir, window=segment_window, pool=pool,
+                                               on_segment=on_segment, cache=cache, metrics=metrics,
+                                               max_span=max_span)
+        if cache is not None and metrics.segments:
+            add_log(f"Segment cache for {name}: {metrics.cache_hits} hits, "
+                    f"{metrics.cache_misses} misses", "INFO")
+        return local_playlist, work_dir
+    except Exception:
+        add_log(f"Keeping partial download of {name} in {work_dir} for resume", "WARNING")
+        raise
+
+
+def jobs_root_for(output_path):
+    """Directory the work dirs of downloads into output_path's directory live in"""
+    return os.path.join(os.path.dirname(os.path.abspath(output_path)), ".streamgrab", "jobs")
+
+
+def estimate_space(playlist_bytes, base_url, bandwidth, options, pool, metrics=None):
+    """Estimate the bytes a job writes, as (outputs, staged segments).
+
+    The source size is the sum of the byte ranges of a single-file playlist,
+    else the variant's BANDWIDTH over the duration, else the first segment's
+    size (from a HEAD request) times the segment count. A transcoded quality
+    is taken at its target bitrate, or the source's if that is lower.
+    """
+    playlist = parse_playlist(playlist_bytes.decode("utf-8-sig"), base_url)
+    segments = playlist.segments
+    duration = playlist.total_duration
+    if segments and all(seg.byte_range is not None for seg in segments):
+        source = sum(seg.byte_range[0] for seg in segments)
+    elif bandwidth:
+        source = bandwidth * duration / 8
+    else:
+        size = content_length(pool, segments[0].uri, metrics) if segments and is_remote(segments[0].uri) else None
+        source = size * len(segments) if size else FALLBACK_BITRATE * duration / 8
+    sizes = [source if quality == "Original" else min(source, QUALITY_TARGETS[quality][1] * duration / 8)
+             for quality in options.qualities]
+    staged = source if options.segment_window > 1 and not options.pipeline else 0
+    if staged and options.chunk_workers > 1 and options.transcode:
+        # Encoded chunks sit next to the segments until they are joined
+        staged += sizes[0]
+    return int(sum(sizes) * ESTIMATE_MARGIN), int(staged * ESTIMATE_MARGIN)
+
+
+def reserve_space(name, playlist_bytes, base_url, bandwidth, output_path, options, pool, add_log, metrics):
+    """Wait until the job's estimated outputs and staged segments fit on disk, and return its Reservation.
+
+    Raises DiskSpaceError if they can never fit.
+    """
+    outputs, staged = estimate_space(playlist_bytes, base_url, bandwidth, options, pool, metrics)
+    needs = {os.path.dirname(os.path.abspath(output_path)): outputs}
+    if staged:
+        needs[jobs_root_for(output_path)] = staged
+    add_log(f"{name} needs about {(outputs + staged) / 1024 ** 3:.2f} GB of disk space", "INFO")
+    reservation = disk_admission().admit(name, needs, int(options.min_free_gb * 1024 ** 3), add_log)
+    for path in rendition_paths(output_path, options).values():
+        reservation.track(partial_path(path))
+    if staged:
+        reservation.track(job_dir_path(jobs_root_for(output_path), playlist_bytes, output_path))
+    return reservation
+
+
+def reserve_live_space(name, bandwidth, transcode, output_path, options, add_log):
+    """Reserve what a live recording will write, and return its Reservation.
+
+    Only a recording bounded by options.live_stop_after has a known size:
+    the variant's BANDWIDTH (or FALLBACK_BITRATE), capped at the quality's
+    target bitrate when transcoding, over that many seconds. An unbounded
+    recording sets nothing aside but still waits while min_free is not met.
+    """
+    nbytes = 0
+    if options.live_stop_after:
+        rate = bandwidth or FALLBACK_BITRATE
+        if transcode and options.quality in QUALITY_TARGETS:
+            rate = min(rate, QUALITY_TARGETS[options.quality][1])
+        nbytes = int(rate * options.live_stop_after / 8 * ESTIMATE_MARGIN)
+        add_log(f"{name} needs about {nbytes / 1024 ** 3:.2f} GB of disk space", "INFO")
+    needs = {os.path.dirname(os.path.abspath(output_path)): nbytes}
+    reservation = disk_admission().admit(name, needs, int(options.min_free_gb * 1024 ** 3), add_log)
+    reservation.track(partial_path(output_path))
+    return reservation
+
+
+def playlist_duration(playlist_bytes, base_url=None):
+    """Sum of the EXTINF durations, or 0.0 when it cannot be determined"""
+    try:
+        return parse_playlist(playlist_bytes.decode("utf-8-sig"), base_url).total_duration
+    except (UnicodeDecodeError, ValueError):
+        return 0.0
+
+
+def probe_source(playlist_bytes, base_url, source, options, local_playlist=None):
+    """Cached ffprobe metadata (StreamInfo) of the stream FFmpeg will read, or None.
+
+    local_playlist, once the segments are downloaded, is probed instead of
+    anything remote.
+    """
+    try:
+        playlist = parse_playlist(playlist_bytes.decode("utf-8-sig"), base_url)
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if playlist.is_master or not playlist.segments:
+        return None
+    first = playlist.segments[0].uri
+    target = first if is_remote(first) or source == "pipe:0" else source
+    if playlist.segments[0].key is not None or playlist.segments[0].init is not None:
+        # Raw segments are encrypted or need their init section; probe what FFmpeg will actually read
+        target = source if source != "pipe:0" else base_url or first
+    if local_playlist:
+        target = local_playlist
+    fingerprint = playlist_fingerprint(seg.uri for seg in playlist.segments)
+    return probe_stream(target, fingerprint, ffprobe=ffprobe_for(options.ffmpeg))
+
+
+def transcode_needed(name, playlist_bytes, base_url, source, options, add_log, quality=None, local_playlist=None):
+    """Decide from cached ffprobe metadata whether the quality preset really needs a re-encode.
+
+    Returns False, logging the reason, when the source is no wider than the
+    preset's target and its codecs fit the MP4 container as they are.
+    quality defaults to options.quality.
+    """
+    quality = quality or options.quality
+    info = probe_source(playlist_bytes, base_url, source, options, local_playlist)
+    if info is None or not info.width:
+        add_log(f"transcode: could not probe {name}", "INFO")
+        return True
+
+    max_width = QUALITY_TARGETS[quality][0]
+    if info.width > max_width:
+        add_log(f"transcode: source {info.resolution} > target {max_width} wide", "INFO")
+        return True
+    if not info.mp4_compatible():
+        add_log(f"transcode: source codecs {info.video_codec}/{info.audio_codec or 'none'} "
+                f"do not fit MP4", "INFO")
+        return True
+    add_log(f"copy: source {info.resolution} <= target {max_width} wide "
+            f"({info.video_codec}/{info.audio_codec or 'none'})", "INFO")
+    return False
+
+
+def caps_for(options):
+    """Probed capabilities of the configured ffmpeg (cached on disk after the first probe)"""
+    return probe(options.ffmpeg)
+
+
+def transcode_plans(options, add_log):
+    """Encode paths to try for a transcode, falling back to software on probe failure"""
+    try:
+        caps = caps_for(options)
+    except OSError as e:
+        add_log(f"Could not probe FFmpeg capabilities: {e}", "WARNING")
+        caps = Capabilities(path=options.ffmpeg)
+    plans = encode_plans(caps, options.quality, SCALE_MAP[options.quality], options.use_hw_accel)
+    add_log(f"Encode paths: {', '.join(plan.name for plan in plans)}", "INFO")
+    return plans
+
+
+def chunk_transcode(name, source, work_dir, plans, options, output_path, add_log, on_progress, metrics):
+    """Encode the video of a downloaded stream in parallel chunks and return their concat list.
+
+    Returns None when chunking does not apply: FFmpeg fetches the stream
+    itself, or a hardware encoder will do the work. Raises ChunkError if
+    a chunk fails to encode.
+    """
+    if not work_dir:
+        add_log(f"Chunked transcoding needs the native segment download, encoding {name} in one pass", "INFO")
+        return None
+    if plans[0].hardware:
+        add_log(f"Encoding {name} with {plans[0].name} instead of in software chunks", "INFO")
+        return None
+
+    def chunk_progress(progress):
+        on_progress(progress)
+        add_log(f"Converting {name} - {progress.describe()}", "INFO", key=f"progress:{output_path}")
+
+    add_log(f"Transcoding {name} in chunks on {options.chunk_workers} FFmpeg processes", "INFO")
+    with metrics.phase("encode"):
+        concat_list, count = encode_chunks(options.ffmpeg, source, plans[-1], options.chunk_workers, chunk_progress)
+    add_log(f"Encoded {count} chunks of {name}, joining them with the audio track", "INFO")
+    return concat_list
+
+
+def convert_renditions(name, playlist_bytes, base_url, input_args, source, audio_input, feeder, total_duration,
+                       output_path, options, add_log, on_progress, metrics, local_playlist=None):
+    """Write every quality of options.qualities from one FFmpeg run over the source.
+
+    The video is decoded once and split into a scale filter and libx264
+    encoder per quality that needs a transcode; qualities the source
+    already fits are stream copies of the same input. audio_input, when
+    given, is the input options for a separate audio rendition. Download
+    and decode cost do not grow with the number of qualities. Returns True
+    on success.
+    """
+    paths = rendition_paths(output_path, options)
+    audio = "1:a?" if audio_input else "0:a?"
+    encoded = [quality for quality in paths if quality != "Original" and
+               transcode_needed(name, playlist_bytes, base_url, source, options, add_log, quality, local_playlist)]
+
+    cmd = [options.ffmpeg, "-y", "-nostats", "-progress", "pipe:1",
+           "-protocol_whitelist", "file,http,https,tcp,tls,pipe", *input_args, "-i", source]
+    if audio_input:
+        cmd.extend(["-protocol_whitelist", "file,http,https,tcp,tls", *audio_input])
+    if encoded:
+        # [0:v]split=2[v0][v1];[v0]scale=640:-1[out0];[v1]scale=1280:-1[out1]
+        inputs = [f"[v{idx}]" for idx in range(len(encoded))] if len(encoded) > 1 else ["[0:v]"]
+        chains = [f"[0:v]split={len(encoded)}{''.join(inputs)}"] if len(encoded) > 1 else []
+        chains += [f"{inputs[idx]}scale={SCALE_MAP[quality]}[out{idx}]" for idx, quality in enumerate(encoded)]
+        cmd.extend(["-filter_complex", ";".join(chains)])
+    for quality, path in paths.items():
+        if quality in encoded:
+            cmd.extend(["-map", f"[out{encoded.index(quality)}]", "-map", audio,
+                        *software_encoder_args(quality), "-c:a", "aac", partial_path(path)])
+        else:
+            cmd.extend(["-map", "0:v?", "-map", audio, "-c", "copy", partial_path(path)])
+
+    add_log(f"Writing {', '.join(paths)} from one decode of {name}: {len(encoded)} encoded, "
+            f"{len(paths) - len(encoded)} copied", "INFO")
+    add_log(f"Running command: {' '.join(cmd)}", "INFO")
+    metrics.encode_path = f"split x{len(encoded)}" if encoded else "copy"
+    with metrics.phase("encode" if encoded else "mux"):
+        return_code, errors, feed_error = run_ffmpeg(cmd, feeder, total_duration, name, output_path, add_log,
+                                                     on_progress)
+    if return_code != 0:
+        add_log(f"Failed to convert {name}: {errors}", "ERROR")
+        return False
+    if feed_error:
+        add_log(f"Failed to stream {name}: {feed_error}", "ERROR")
+        return False
+    finish_outputs(paths.values())
+    add_log(f"Successfully converted {name} to {', '.join(paths.values())}", "SUCCESS")
+    return True
+
+
+def run_ffmpeg(cmd, feeder, total_duration, name, output_path, add_log, on_progress):
+    """Run one ffmpeg attempt and report progress.
+
+    feeder, when given, builds the thread that writes to ffmpeg's stdin.
+    Returns (return code, stderr tail, stdin feeder error).
+    """
+    # Pipes are binary because stdin may carry segment bytes; stdout and
+    # stderr are decoded as text below
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if feeder else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout = io.TextIOWrapper(process.stdout, encoding="utf-8", errors="replace")
+    stderr = io.TextIOWrapper(process.stderr, encoding="utf-8", errors="replace")
+    if feeder:
+        feeder = feeder(process.stdin)
+        feeder.start()
+
+    # Drain stderr on its own thread so FFmpeg never blocks on a full pipe
+    stderr_drain = StderrDrain(stderr, on_error=lambda line: add_log(line, "ERROR"))
+    stderr_drain.start()
+
+    # Monitor the progress stream
+    parser = ProgressParser(total_duration)
+    progress_key = f"progress:{output_path}"
+    for line in stdout:
+        progress = parser.feed(line)
+        if progress is None:
+            continue
+        if on_progress:
+            on_progress(progress)
+        # Progress updates for this file share one live log entry
+        add_log(f"Converting {name} - {progress.describe()}", "INFO", key=progress_key)
+
+    return_code = process.wait()
+    feed_error = None
+    if feeder:
+        feeder.join()
+        feed_error = feeder.error
+    return return_code, stderr_drain.tail(), feed_error
+
+
+def record_live(name, playlist, url, audio_url, transcode, output_path, options, pool, add_log, on_progress,
+                metrics):
+    """Record a live playlist into a fragmented MP4 that grows as segments are published.
+
+    The playlist is reloaded on its own schedule and only new segments are
+    fetched. The fragmented MP4 is written to partial_path(output_path),
+    where it is playable while it grows, and renamed to output_path once
+    the stream ends or options.live_stop_after is reached. A recording cut
+    short stays valid and is left under its partial name, since the media
+    cannot be fetched again. Returns True on success.
+    """
+    limit = (f"the first {format_seconds(options.live_stop_after)}" if options.live_stop_after
+             else "until the stream ends")
+    add_log(f"{name} is a live playlist with {len(playlist.segments)} segments in its window, "
+            f"recording {limit}", "INFO")
+    poller = LivePoller(url, pool, stop_after=options.live_stop_after,
+                        on_warning=lambda message: add_log(message, "WARNING"), metrics=metrics)
+
+    def on_segment(count, recorded):
+        add_log(f"Recording {name} - {count} segments, {format_seconds(recorded)}", "INFO",
+                key=f"download:{output_path}")
+
+    feeder = functools.partial(LiveFeeder, poller=poller, first=playlist, pool=pool,
+                               window=max(1, options.segment_window), on_segment=on_segment, metrics=metrics)
+    if transcode:
+        # A live input cannot be replayed into a fallback encoder, so use the software path
+        plan = transcode_plans(options, add_log)[-1]
+    else:
+        plan = EncodePlan("copy", [], ["-c", "copy"])
+
+    cmd = [options.ffmpeg, "-y", "-nostats", "-progress", "pipe:1", *plan.input_args, "-f", "mpegts", "-i", "pipe:0"]
+    if audio_url:
+        cmd.extend(["-protocol_whitelist", "file,http,https,tcp,tls", "-i", audio_url,
+                    "-map", "0:v", "-map", "1:a", "-shortest"])
+    cmd.extend(plan.video_args)
+    if transcode:
+        cmd.extend(["-c:a", "aac"])
+    cmd.extend(["-f", "mp4", "-movflags", "+frag_keyframe+empty_moov+default_base_moof", partial_path(output_path)])
+
+    add_log(f"Running command: {' '.join(cmd)}", "INFO")
+    metrics.encode_path = plan.name
+    with metrics.phase("encode" if transcode else "mux"):
+        return_code, errors, feed_error = run_ffmpeg(cmd, feeder, options.live_stop_after, name, output_path,
+                                                     add_log, on_progress)
+    if poller.skipped:
+        add_log(f"{poller.skipped} segments of {name} left the live window before they could be fetched",
+                "WARNING")
+    if return_code != 0:
+        add_log(f"Failed to record {name}, {format_seconds(poller.recorded)} kept in {partial_path(output_path)}: "
+                f"{errors}", "ERROR")
+        return False
+    if feed_error:
+        add_log(f"Recording of {name} stopped early, {format_seconds(poller.recorded)} kept in "
+                f"{partial_path(output_path)}: {feed_error}", "ERROR")
+        return False
+    finish_outputs([output_path])
+    add_log(f"Recorded {format_seconds(poller.recorded)} of {name} to {output_path} "
+            f"({poller.segments} segments, {poller.reloads} reloads)", "SUCCESS")
+    return True
+
+
+def convert_m3u8_to_mp4(m3u8_file, output_path, options, add_log=log_to_logger, pool=None, cache=None,
+                        on_progress=None, metrics=None):
+    """Convert M3U8 to MP4 with progress tracking and logging.
+
+    m3u8_file is anything with .name and .getvalue() (a Streamlit upload or
+    a PlaylistFile). Returns True on success. Fetch, mux and encode figures
+    are recorded in metrics (a JobMetrics) when given.
+    """
+    input_path = None
+    work_dir = None
+    live = None
+    local_playlist = None
+    parts_dir = None
+    reservation = None
+    own_pool = pool is None
+    pool = pool or ConnectionPool(scheduler=FetchScheduler(options.host_limits))
+    metrics = metrics or JobMetrics(m3u8_file.name, options.quality)
+    ok = False
+
+    def job_progress(progress):
+        metrics.observe_progress(progress)
+        if on_progress:
+            on_progress(progress)
+
+    try:
+        add_log(f"Starting conversion of {m3u8_file.name}", "INFO")
+
+        # Pick the best-fitting variant of a master playlist; with several qualities, the one the highest needs
+        renditions = len(options.qualities) > 1
+        source_quality = max(options.qualities, key=QUALITIES.index)
+        playlist_bytes, base_url, audio_url, transcode, bandwidth = select_rendition(m3u8_file, source_quality,
+                                                                                     pool, add_log)
+        if playlist_bytes is not m3u8_file.getvalue():
+            # The selected variant is checked as well before FFmpeg gets it
+            preflight(playlist_bytes, base_url)
+        if base_url:
+            metrics.host = urlsplit(base_url).netloc
+
+        # Live/event playlists are recorded by reloading them until they end
+        live = live_playlist(playlist_bytes, base_url)
+        if live is not None:
+            if options.clipped:
+                add_log(f"{m3u8_file.name} is live, recording it whole instead of clipping it", "WARNING")
+            if renditions:
+                add_log(f"{m3u8_file.name} is live, recording it in {source_quality} quality only", "WARNING")
+            reservation = reserve_live_space(m3u8_file.name, bandwidth, transcode, output_path, options, add_log)
+            ok = record_live(m3u8_file.name, live, base_url, audio_url, transcode, output_path, options, pool,
+                             add_log, job_progress, metrics)
+            return ok
+
+        # A time range only needs the segments overlapping it; FFmpeg cuts them to the exact range
+        clip = None
+        if options.clipped:
+            playlist_bytes, clip = clip_playlist(playlist_bytes, base_url, options.clip_start, options.clip_end)
+            add_log(f"Clipping {m3u8_file.name} to {clip.describe()}", "INFO")
+
+        # Nothing is downloaded until the outputs and staged segments fit on disk next to the running jobs'
+        reservation = reserve_space(m3u8_file.name, playlist_bytes, base_url, bandwidth, output_path, options, pool,
+                                    add_log, metrics)
+
+        # Pipeline mode: fetched segments go straight into FFmpeg's stdin
+        input_args = []
+        feeder = None
+        streamed = None
+        if options.pipeline and options.segment_window > 1:
+            streamed = streamable_playlist(playlist_bytes, base_url)
+            if streamed is None:
+                add_log(f"{m3u8_file.name} cannot be streamed (needs absolute MPEG-TS segments without "
+                        f"discontinuities), using the regular download path", "WARNING")
+
+        if streamed is not None:
+            add_log(f"Streaming {len(streamed.segments)} segments of {m3u8_file.name} into FFmpeg "
+                    f"({options.segment_window} in flight)", "INFO")
+            input_args = ["-f", "mpegts"]
+            source = "pipe:0"
+
+            def on_segment(done, total):
+                add_log(f"Streaming {m3u8_file.name} - Segments: {done}/{total}", "INFO",
+                        key=f"download:{output_path}")
+
+            feeder = functools.partial(StdinFeeder, segments=streamed.segments, pool=pool,
+                                       window=options.segment_window, cache=cache, on_segment=on_segment,
+                                       metrics=metrics, max_span=options.max_span)
+        else:
+            # Fetch segments ourselves when possible and hand FFmpeg a local playlist
+            local_playlist, work_dir = fetch_segments_locally(m3u8_file.name, playlist_bytes, base_url,
+                                                              output_path, options.segment_window, pool, add_log,
+                                                              cache=cache, metrics=metrics,
+                                                              max_span=options.max_span)
+            if local_playlist:
+                source = local_playlist
+            elif base_url and clip is None:
+                source = base_url
+            elif options.pipeline:
+                # Hand FFmpeg the playlist itself through stdin rather than a temp file
+                input_args = ["-f", "hls"]
+                source = "pipe:0"
+                feeder = functools.partial(BytesFeeder, data=playlist_bytes)
+            else:
+                # Create a temporary file for the M3U8 content
+                with tempfile.NamedTemporaryFile(suffix='.m3u8', delete=False) as tmp_file:
+                    tmp_file.write(playlist_bytes)
+                    input_path = tmp_file.name
+                source = input_path
+
+        # Expected output duration from the EXTINF values, for percentage and ETA
+        total_duration = clip.duration if clip else playlist_duration(playlist_bytes, base_url)
+
+        # Input options cutting a clip: the clipped playlist starts at clip.offset, a separate audio rendition at 0
+        seek = clip.seek_args() if clip else []
+        audio_seek = clip.seek_args(absolute=True) if clip and audio_url else []
+
+        # Several qualities: one FFmpeg run decodes the stream once and writes them all
+        if renditions:
+            if options.chunk_workers > 1 or (clip and options.frame_accurate):
+                add_log(f"Chunked transcoding and frame-accurate cuts apply to single-quality jobs, writing "
+                        f"{len(options.qualities)} qualities of {m3u8_file.name} in one pass", "INFO")
+            ok = convert_renditions(m3u8_file.name, playlist_bytes, base_url, [*input_args, *seek], source,
+                                    audio_url and [*audio_seek, "-i", audio_url], feeder, total_duration,
+                                    output_path, options, add_log, job_progress, metrics, local_playlist)
+            if ok and work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            return ok
+
+        # A source already within the target size only needs a stream copy
+        if transcode:
+            transcode = transcode_needed(m3u8_file.name, playlist_bytes, base_url, source, options, add_log,
+                                         local_playlist=local_playlist)
+
+        # Candidate encode paths: stream copy, or the fastest working encoder first
+        if transcode:
+            plans = transcode_plans(options, add_log)
+        else:
+            plans = [EncodePlan("copy", [], ["-c", "copy"])]
+
+        # Chunk-parallel transcode: the chunks' video is joined below with the whole stream's audio.
+        # A clip is cut on the exact frame by the single-pass encode instead.
+        if transcode and options.chunk_workers > 1 and clip is None:
+            concat_list = chunk_transcode(m3u8_file.name, source, work_dir, plans, options, output_path, add_log,
+                                          job_progress, metrics)
+            if concat_list:
+                audio_url = audio_url or source
+                input_args = ["-f", "concat", "-safe", "0"]
+                source = concat_list
+                plans = [EncodePlan("libx264 chunks", [], ["-c:v", "copy"])]
+
+        # Frame-accurate stream copy of a clip: re-encoded edges joined with the copied middle
+        if clip and options.frame_accurate and not transcode:
+            if feeder is not None:
+                add_log(f"Frame-accurate cuts need a seekable input, cutting {m3u8_file.name} at the nearest "
+                        f"keyframe instead", "WARNING")
+            else:
+                parts_dir = tempfile.mkdtemp(prefix=".clip-", dir=os.path.dirname(os.path.abspath(output_path)))
+                info = probe_source(playlist_bytes, base_url, source, options, local_playlist)
+                with metrics.phase("encode"):
+                    concat_list = smart_cut(options.ffmpeg, ffprobe_for(options.ffmpeg), source, input_args, clip,
+                                            info.video_codec if info else "", parts_dir, add_log)
+                if concat_list:
+                    if not audio_url:
+                        audio_url, audio_seek = source, seek
+                    input_args = ["-f", "concat", "-safe", "0"]
+                    source = concat_list
+                    seek = []
+                    plans = [EncodePlan("copy, re-encoded edges", [], ["-c", "copy"])]
+
+        # Hardware paths that failed on this job without a device error; only a working fallback convicts them
+        suspect = []
+        for attempt, plan in enumerate(plans):
+            # Build ffmpeg command; progress comes as key=value pairs on stdout
+            cmd = [options.ffmpeg, "-y", "-nostats", "-progress", "pipe:1", *plan.input_args]
+            cmd.extend([
+                "-protocol_whitelist", "file,http,https,tcp,tls,pipe",
+                *input_args,
+                *seek,
+                "-i", source,
+            ])
+            if audio_url:
+                # Audio from a separate rendition playlist, or the whole stream's audio under chunked or cut video
+                cmd.extend(["-protocol_whitelist", "file,http,https,tcp,tls", *audio_seek, "-i", audio_url,
+                            "-map", "0:v", "-map", "1:a?"])
+            cmd.extend(plan.video_args)
+            if transcode:
+                cmd.extend(["-c:a", "aac"])
+            cmd.append(partial_path(output_path))
+
+            add_log(f"Running command: {' '.join(cmd)}", "INFO")
+            metrics.encode_path = plan.name
+            with metrics.phase("encode" if transcode else "mux"):
+                return_code, errors, feed_error = run_ffmpeg(cmd, feeder, total_duration, m3u8_file.name,
+                                                             output_path, add_log, job_progress)
+            if feed_error and return_code == 0:
+                # FFmpeg finished cleanly on a truncated stream
+                add_log(f"Failed to stream {m3u8_file.name}: {feed_error}", "ERROR")
+                return False
+            if return_code == 0:
+                for name in suspect:
+                    mark_broken(caps_for(options), name)
+                break
+            if plan.hardware and attempt + 1 < len(plans):
+                if init_failed(errors):
+                    mark_broken(caps_for(options), plan.name)
+                else:
+                    suspect.append(plan.name)
+                add_log(f"Hardware encode path {plan.name} failed for {m3u8_file.name}, "
+                        f"falling back to {plans[attempt + 1].name}", "WARNING")
+                continue
+            add_log(f"Failed to convert {m3u8_file.name}: {errors}", "ERROR")
+            return False
+
+        finish_outputs([output_path])
+        # Downloaded segments are kept until the mux succeeds
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        add_log(f"Successfully converted {m3u8_file.name} to {output_path}", "SUCCESS")
+        ok = True
+        return True
+
+    except PlaylistError as e:
+        add_log(f"Invalid playlist {m3u8_file.name}: {e}", "ERROR")
+        return False
+    except ClipError as e:
+        add_log(f"Cannot clip {m3u8_file.name}: {e}", "ERROR")
+        return False
+    except DiskSpaceError as e:
+        add_log(f"Not enough disk space: {e}", "ERROR")
+        return False
+    except Exception as e:
+        add_log(f"Error in conversion process: {str(e)}", "ERROR")
+        return False
+    finally:
+        metrics.finish(ok, rendition_paths(output_path, options).values())
+        if reservation is not None:
+            disk_admission().release(reservation)
+            # A failed or interrupted FFmpeg run leaves no truncated output under the final name;
+            # a live recording keeps its partial file, as the media it holds cannot be fetched again
+            for path in rendition_paths(output_path, options).values():
+                if live is None and os.path.exists(partial_path(path)):
+                    os.unlink(partial_path(path))
+        # Clean up temp file
+        if input_path and os.path.exists(input_path):
+            os.unlink(input_path)
+        if parts_dir:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+        if own_pool:
+            pool.close()
+
+
+def convert_all(m3u8_files, output_dir, options, max_workers, log=log_to_logger, log_for=None, on_progress=None,
+                on_tick=None, registry=None):
+    """Convert a batch of playlists on a bounded worker pool.
+
+    Yields (index, file, JobResult) as each job finishes. Batch-level
+    messages go to log; log_for(index), when given, returns the log callback
+    for one job, which is called from a worker thread. on_progress(index,
+    progress) receives ffmpeg progress snapshots, also from worker threads.
+    All jobs share one keep-alive connection pool, whose scheduler applies
+    the per-host limits across the batch, and one segment cache.
+    Each job's metrics are recorded in registry (a MetricsRegistry) for
+    batch totals and attached to its JobResult.
+    """
+    last_error = {}
+
+    def convert(idx, m3u8_file):
+        job_log = log_for(idx) if log_for else log
+
+        def add_log(message, level="INFO", key=None):
+            if level == "ERROR":
+                last_error[idx] = message
+            job_log(message, level, key=key)
+
+        def job_progress(progress):
+            if on_progress:
+                on_progress(idx, progress)
+
+        output_path, fingerprint, converted = claim_output(m3u8_file, output_dir, options)
+        if converted:
+            add_log(f"Skipping {m3u8_file.name}: already converted to {output_path} with these settings", "SUCCESS")
+            return JobResult(m3u8_file.name, output_path, True, skipped=True)
+        metrics = JobMetrics(m3u8_file.name, options.quality)
+        ok = False
+        try:
+            ok = convert_m3u8_to_mp4(m3u8_file, output_path, options, add_log=add_log, pool=pool, cache=cache,
+                                     on_progress=job_progress, metrics=metrics)
+        finally:
+            if fingerprint:
+                output_index(output_dir).release(fingerprint, output_path, ok)
+        registry.record(metrics)
+        if ok:
+            return JobResult(m3u8_file.name, output_path, True, metrics=metrics.to_dict())
+        err = last_error.get(idx, "").strip().splitlines()
+        return JobResult(m3u8_file.name, output_path, False, err[-1] if err else "Unknown error",
+                         metrics=metrics.to_dict())
+
+    registry = registry if registry is not None else MetricsRegistry()
+    pool = ConnectionPool(max_idle_per_host=max_workers * max(1, options.segment_window),
+                          scheduler=FetchScheduler(options.host_limits))
+    cache = None
+    if options.cache_size_gb > 0 and options.segment_window > 1:
+        cache = SegmentCache(options.cache_dir, max_bytes=int(options.cache_size_gb * 1024 ** 3))
+    try:
+        yield from run_batch(m3u8_files, convert, max_workers, on_tick=on_tick)
+    finally:
+        pool.close()
+        log(registry.describe(), "INFO")
+        if cache is not None:
+            log(cache.summary(), "INFO")
+            cache.close()
@@ -0,0 +1,164 @@
+"""Disk space admission for conversions
+
+Before a job downloads anything it reserves the bytes it expects to write
+on each filesystem it touches: the output directory and the directory its
+segments are staged in. A job is admitted only when every one of them has
+that much free space left, after keeping min_free spare and setting aside
+what the jobs already running have yet to write; otherwise it waits until
+enough space frees up. A job that could not fit even with nothing else
+running fails at once instead of leaving a truncated MP4 behind.
+"""
+import logging
+import os
+import shutil
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger("StreamGrab")
+
+# Seconds between re-checks of free space while a job waits, in case space is freed outside this process
+RECHECK_INTERVAL = 5.0
+
+
+class DiskSpaceError(OSError):
+    """A job needs more disk space than its filesystem can ever offer"""
+
+
+class Reservation:
+    """Bytes one job expects to write, per filesystem (st_dev), and the paths it writes them to"""
+
+    def __init__(self, name, needs, dirs):
+        self.name = name
+        self.needs = needs
+        self.dirs = dirs
+        self.paths = []
+
+    def track(self, path):
+        """Count what is written to path (a file or directory) against this reservation"""
+        self.paths.append((_device(path), path))
+
+    def outstanding(self, device):
+        """Bytes still to be written on device"""
+        written = sum(_size(path) for dev, path in self.paths if dev == device)
+        return max(0, self.needs.get(device, 0) - written)
+
+
+class DiskAdmission:
+    """Admission control over free disk space, shared by every job in the process"""
+
+    def __init__(self):
+        self._active = []
+        # Bumped on every admission, so a measurement taken without the lock can tell it is stale
+        self._admitted = 0
+        self._cond = threading.Condition()
+
+    def admit(self, name, needs, min_free=0, add_log=None):
+        """Block until needs ({directory: bytes}) fit, and return the Reservation to release().
+
+        Raises DiskSpaceError when a filesystem is too small for the job
+        even with no other job reserving space on it. Free space and what
+        the running jobs have written are measured without holding the
+        lock; the lock only guards the reservation arithmetic.
+        """
+        by_device = defaultdict(int)
+        dirs = {}
+        for directory, nbytes in needs.items():
+            device = _device(directory)
+            by_device[device] += nbytes
+            dirs.setdefault(device, directory)
+        reservation = Reservation(name, dict(by_device), dirs)
+        waited = False
+        while True:
+            with self._cond:
+                active = list(self._active)
+                admitted = self._admitted
+            usage = _usage(reservation, active)
+            with self._cond:
+                if self._admitted != admitted:
+                    # Another job was admitted while measuring; its reservation was not counted
+                    continue
+                short = _shortfall(reservation, usage, min_free)
+                if short is None:
+                    self._active.append(reservation)
+                    self._admitted += 1
+                    if waited and add_log:
+                        add_log(f"Disk space available for {name}, starting", "INFO")
+                    return reservation
+                device, need, available = short
+                if not any(device in other.needs for other in self._active):
+                    raise DiskSpaceError(f"{name} needs about {_gb(need)} on {dirs[device]} but only "
+                                         f"{_gb(available)} is free (keeping {_gb(min_free)} spare)")
+                if not waited and add_log:
+                    add_log(f"Waiting for disk space: {name} needs about {_gb(need)} on {dirs[device]}, "
+                            f"{_gb(available)} is left after running jobs", "WARNING")
+                waited = True
+                self._cond.wait(RECHECK_INTERVAL)
+
+    def release(self, reservation):
+        with self._cond:
+            if reservation in self._active:
+                self._active.remove(reservation)
+            self._cond.notify_all()
+
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+def disk_admission():
+    """The process-wide DiskAdmission, so batches and background jobs see each other's reservations"""
+    global _admission
+    with _admission_lock:
+        if _admission is None:
+            _admission = DiskAdmission()
+        return _admission
+
+
+def _usage(reservation, active):
+    """{device: (free bytes, bytes the active reservations have yet to write)} for reservation's filesystems"""
+    return {device: (shutil.disk_usage(reservation.dirs[device]).free,
+                     sum(other.outstanding(device) for other in active))
+            for device in reservation.needs}
+
+
+def _shortfall(reservation, usage, min_free):
+    """(device, need, available) of the first filesystem reservation does not fit on, or None"""
+    for device, need in reservation.needs.items():
+        free, pending = usage[device]
+        available = max(0, free - pending - min_free)
+        if need > available:
+            return device, need, available
+    return None
+
+
+def _device(path):
+    # A path not created yet lives on its nearest existing parent's filesystem
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+def _size(path):
+    try:
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+    except OSError:
+        return 0
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _gb(nbytes):
+    return f"{nbytes / 1024 ** 3:.2f} GB"
@@ -0,0 +1,396 @@
+"""Parallel HLS segment fetching over pooled keep-alive connections"""
+import functools
+import http.client
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+from streamgrab.cache import cache_key
+from streamgrab.crypto import KeyStore
+from streamgrab.journal import SegmentJournal
+from streamgrab.scheduler import PACING_CHUNK, FetchScheduler, retry_after_seconds
+
+logger = logging.getLogger("StreamGrab")
+
+USER_AGENT = "StreamGrab/1.1"
+MAX_REDIRECTS = 5
+
+# Attempts after the first for each playlist, key and segment request
+DEFAULT_RETRIES = 5
+
+# Largest span of bytes fetched in one request when adjacent EXT-X-BYTERANGE segments are merged
+DEFAULT_MAX_SPAN = 4 * 1024 ** 2
+
+
+class FetchError(Exception):
+    """A segment or playlist could not be downloaded"""
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections shared between fetch threads.
+
+    Idle connections are kept per (scheme, host, port) and reused for the
+    next request to the same origin, so a playlist of thousands of segments
+    costs a handful of TCP/TLS handshakes rather than one per segment.
+    Every request waits for a slot from the pool's FetchScheduler, which
+    enforces the per-host limits across all jobs sharing the pool.
+    """
+
+    def __init__(self, max_idle_per_host=16, timeout=30, scheduler=None):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.scheduler = scheduler or FetchScheduler()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _new_connection(self, origin):
+        scheme, host, port = origin
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=self.timeout)
+
+    def _acquire(self, origin):
+        with self._lock:
+            idle = self._idle.get(origin)
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(origin), False
+
+    def _release(self, origin, conn):
+        with self._lock:
+            idle = self._idle.setdefault(origin, deque())
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, url, headers=None, job=None, method="GET"):
+        """GET (or method) url and return (status, headers, body), following redirects.
+
+        job identifies the requesting job to the scheduler for fair sharing.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            status, resp_headers, body = self._request_once(url, headers or {}, job, method)
+            if status in (301, 302, 303, 307, 308) and "location" in resp_headers:
+                url = urljoin(url, resp_headers["location"])
+                continue
+            return status, resp_headers, body
+        raise FetchError(f"Too many redirects for {url}")
+
+    def _request_once(self, url, headers, job, method="GET"):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        origin = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = {"User-Agent": USER_AGENT, **headers}
+
+        pace = functools.partial(self.scheduler.pace, parts.hostname) if self.scheduler.pacing else None
+        with self.scheduler.slot(parts.hostname, job):
+            conn, reused = self._acquire(origin)
+            try:
+                resp, body = _send(conn, path, headers, pace, method)
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection; retry on a fresh one
+                conn = self._new_connection(origin)
+                try:
+                    resp, body = _send(conn, path, headers, pace, method)
+                except Exception:
+                    conn.close()
+                    raise
+        resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(origin, conn)
+        return resp.status, resp_headers, body
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+def _send(conn, path, headers, pace=None, method="GET"):
+    conn.request(method, path, headers=headers)
+    resp = conn.getresponse()
+    if pace is None:
+        return resp, resp.read()
+    # Read in chunks so a bandwidth limit is applied as the body arrives
+    chunks = []
+    while True:
+        chunk = resp.read(PACING_CHUNK)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        pace(len(chunk))
+    return resp, b"".join(chunks)
+
+
+def fetch_url(pool, url, retries=DEFAULT_RETRIES, metrics=None, byte_range=None):
+    """Fetch url through pool, retrying transient failures (counted in metrics).
+
+    429, 5xx and connection errors are retried after an exponential backoff
+    with jitter from the pool's scheduler. Requests are attributed to the
+    job whose metrics are given, for fair sharing between jobs. With a
+    (length, offset) byte_range only those bytes are requested and returned,
+    also from servers that ignore Range and send the whole resource.
+    """
+    host = urlsplit(url).hostname
+    headers = {}
+    if byte_range is not None:
+        length, offset = byte_range
+        headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+    last_error = None
+    for attempt in range(retries + 1):
+        if attempt and metrics is not None:
+            metrics.add_retry()
+        retry_after = None
+        try:
+            status, resp_headers, body = pool.request(url, headers, job=metrics)
+        except (http.client.HTTPException, OSError) as e:
+            last_error = str(e)
+        else:
+            if status == 200 and byte_range is not None:
+                body = body[offset:offset + length]
+            if status == 200 or (status == 206 and byte_range is not None):
+                if byte_range is not None and len(body) != length:
+                    raise FetchError(f"Range {headers['Range']} of {url} returned {len(body)} bytes, "
+                                     f"expected {length}")
+                pool.scheduler.succeeded(host)
+                return body
+            last_error = f"HTTP {status}"
+            if status < 500 and status != 429:
+                break
+            retry_after = retry_after_seconds(resp_headers.get("retry-after"))
+        if attempt < retries:
+            time.sleep(pool.scheduler.backoff(host, attempt, retry_after))
+    raise FetchError(f"Failed to fetch {url}: {last_error}")
+
+
+def content_length(pool, url, metrics=None):
+    """Size in bytes of url from a HEAD request, or None if it fails or the server does not say"""
+    try:
+        status, resp_headers, _ = pool.request(url, job=metrics, method="HEAD")
+        if status == 200:
+            return int(resp_headers["content-length"])
+    except (http.client.HTTPException, OSError, KeyError, ValueError, FetchError):
+        pass
+    return None
+
+
+class RangeRequest:
+    """One HTTP request covering one or more consecutive segments of a resource.
+
+    offset and length span the merged byte ranges; offset is None for a
+    segment that is a whole resource. members are the segments' positions.
+    """
+    __slots__ = ("uri", "offset", "length", "members")
+
+    def __init__(self, uri, offset, length, members):
+        self.uri = uri
+        self.offset = offset
+        self.length = length
+        self.members = members
+
+    @property
+    def byte_range(self):
+        return None if self.offset is None else (self.length, self.offset)
+
+
+def coalesce_ranges(segments, max_span=DEFAULT_MAX_SPAN):
+    """Group segments into RangeRequests, merging adjacent or overlapping byte ranges of one URI.
+
+    Only consecutive segments are merged, so the requests stay in playlist
+    order, and a merged request never spans more than max_span bytes.
+    """
+    requests = []
+    last = None
+    for pos, seg in enumerate(segments):
+        if seg.byte_range is None:
+            last = None
+            requests.append(RangeRequest(seg.uri, None, None, [pos]))
+            continue
+        length, offset = seg.byte_range
+        if last is not None and last.uri == seg.uri and last.offset <= offset <= last.offset + last.length:
+            end = max(last.offset + last.length, offset + length)
+            if end - last.offset <= max_span:
+                last.length = end - last.offset
+                last.members.append(pos)
+                continue
+        last = RangeRequest(seg.uri, offset, length, [pos])
+        requests.append(last)
+    return requests
+
+
+def fetch_segment(pool, seg, retries=DEFAULT_RETRIES, cache=None, metrics=None, keys=None):
+    """Fetch one segment, serving it from the shared cache when possible.
+
+    Returns (data, cache_hit). The cache holds segments as served; encrypted
+    segments are decrypted with keys (a KeyStore) on the calling worker
+    thread. The fetch is timed into metrics when given.
+    """
+    length, offset = seg.byte_range or (None, None)
+    return fetch_range(pool, RangeRequest(seg.uri, offset, length, [0]), [seg], retries, cache, metrics, keys)[0]
+
+
+def fetch_range(pool, request, segments, retries=DEFAULT_RETRIES, cache=None, metrics=None, keys=None):
+    """Fetch one RangeRequest and return (data, cache_hit) for each of its member segments.
+
+    Members are cached and decrypted one by one, as if fetched alone; the
+    request is only sent if any of them is missing from the cache.
+    """
+    started = time.monotonic()
+    members = [segments[pos] for pos in request.members]
+    cache_keys = [cache_key(seg.uri, seg.byte_range) for seg in members] if cache is not None else None
+    datas = [cache.get(key) for key in cache_keys] if cache_keys else [None]
+    hit = all(data is not None for data in datas)
+    if not hit:
+        body = fetch_url(pool, request.uri, retries, metrics, byte_range=request.byte_range)
+        datas = []
+        for seg in members:
+            if seg.byte_range is None:
+                datas.append(body)
+                continue
+            length, offset = seg.byte_range
+            datas.append(body[offset - request.offset:offset - request.offset + length])
+        if cache_keys:
+            for key, data in zip(cache_keys, datas):
+                cache.put(key, data)
+    if metrics is not None:
+        metrics.observe_fetch(request.uri, time.monotonic() - started, sum(map(len, datas)), hit,
+                              segments=len(members))
+    return [(keys.decrypt_segment(seg, data) if seg.key is not None else data, hit)
+            for seg, data in zip(members, datas)]
+
+
+def fetch_segments(segments, pool, window=8, retries=DEFAULT_RETRIES, cache=None, metrics=None, keys=None,
+                   max_span=DEFAULT_MAX_SPAN):
+    """Download segments concurrently and yield (index, data) in playlist order.
+
+    Consecutive EXT-X-BYTERANGE segments of one resource are fetched with a
+    single Range request of up to max_span bytes (see coalesce_ranges).
+    At most `window` requests are in flight at once. Segments that finish
+    early are held until every earlier segment has been yielded, so memory
+    use is bounded by the window size. Encrypted segments are yielded
+    decrypted; pass a job-wide KeyStore as keys to share fetched keys
+    between calls.
+    """
+    window = max(1, window)
+    keys = keys or KeyStore(functools.partial(fetch_url, pool, retries=retries))
+    with ThreadPoolExecutor(max_workers=window, thread_name_prefix="segment") as executor:
+        in_flight = deque()
+        try:
+            for request in coalesce_ranges(segments, max_span):
+                in_flight.append((request, executor.submit(fetch_range, pool, request, segments, retries, cache,
+                                                           metrics, keys)))
+                if len(in_flight) >= window:
+                    done, future = in_flight.popleft()
+                    for idx, (data, _) in zip(done.members, future.result()):
+                        yield idx, data
+            while in_flight:
+                done, future = in_flight.popleft()
+                for idx, (data, _) in zip(done.members, future.result()):
+                    yield idx, data
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+
+def download_playlist(playlist, dest_dir, window=8, pool=None, on_segment=None, cache=None, metrics=None,
+                      max_span=DEFAULT_MAX_SPAN):
+    """Download every segment of a media playlist into dest_dir.
+
+    Writes the segments as numbered files next to a rewritten local playlist
+    that ffmpeg can concat with -c copy, and returns the playlist path.
+    Byte-range segments become files of their own, fetched with merged
+    Range requests of up to max_span bytes, and each EXT-X-MAP
+    initialization section is fetched once and referenced by every
+    segment that uses it.
+    Segments already recorded in dest_dir's journal are not fetched again,
+    so calling this again after an interruption resumes the download.
+    With a SegmentCache, segments are served from local disk when any job
+    has fetched them before. Fetch latencies, bytes and cache hits are
+    recorded in metrics (a JobMetrics) when given.
+    on_segment(done, total) is called after each segment is written.
+    """
+    own_pool = pool is None
+    pool = pool or ConnectionPool(max_idle_per_host=window)
+    total = len(playlist.segments)
+    names = [f"seg_{idx:06d}{'.m4s' if seg.init else _segment_ext(seg.uri)}"
+             for idx, seg in enumerate(playlist.segments)]
+    inits = {}
+    for seg in playlist.segments:
+        if seg.init is not None and seg.init not in inits:
+            inits[seg.init] = f"init_{len(inits)}{_segment_ext(seg.init.uri)}"
+    os.makedirs(dest_dir, exist_ok=True)
+    try:
+        for init, name in inits.items():
+            path = os.path.join(dest_dir, name)
+            if not os.path.exists(path):
+                data = fetch_url(pool, init.uri, metrics=metrics, byte_range=init.byte_range)
+                with open(path + ".part", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".part", path)
+        with SegmentJournal(dest_dir) as journal:
+            completed = journal.completed()
+            missing = [idx for idx in range(total) if idx not in completed]
+            if completed:
+                logger.info(f"Resuming download in {dest_dir}: {len(completed)}/{total} segments already on disk")
+            done = len(completed)
+            segments = [playlist.segments[idx] for idx in missing]
+            for pos, data in fetch_segments(segments, pool, window=window, cache=cache, metrics=metrics,
+                                            max_span=max_span):
+                idx = missing[pos]
+                journal.write(idx, names[idx], data)
+                done += 1
+                if on_segment:
+                    on_segment(done, total)
+    finally:
+        if own_pool:
+            pool.close()
+
+    local_path = os.path.join(dest_dir, "local.m3u8")
+    with open(local_path, "w") as f:
+        f.write(render_local_playlist(playlist, names, inits))
+    return local_path
+
+
+def render_local_playlist(playlist, names, inits=None):
+    """Render a VOD playlist pointing at the downloaded segment files.
+
+    inits maps each InitSection to the file it was downloaded to.
+    """
+    target = int(playlist.target_duration) or int(max((s.duration for s in playlist.segments), default=1) + 0.999)
+    lines = [
+        "#EXTM3U",
+        f"#EXT-X-VERSION:{6 if inits else 3}",
+        f"#EXT-X-TARGETDURATION:{target}",
+        f"#EXT-X-MEDIA-SEQUENCE:{playlist.media_sequence}",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    init = None
+    for seg, name in zip(playlist.segments, names):
+        if seg.discontinuity:
+            lines.append("#EXT-X-DISCONTINUITY")
+        if seg.init is not None and seg.init != init:
+            init = seg.init
+            lines.append(f'#EXT-X-MAP:URI="{inits[init]}"')
+        lines.append(f"#EXTINF:{seg.duration:.6f},")
+        lines.append(name)
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def _segment_ext(uri):
+    ext = os.path.splitext(urlsplit(uri).path)[1]
+    return ext if ext and len(ext) <= 5 else ".ts"
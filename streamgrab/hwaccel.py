@@ -0,0 +1,207 @@
+"""One-time probing of ffmpeg's hwaccels and encoders, cached on disk
+
+The probe result is keyed by the ffmpeg binary's resolved path, size and
+mtime, so upgrading or switching ffmpeg triggers a fresh probe.
+An encode path that fails to start its device or encoder, or that fails
+where the software fallback then succeeds on the same input, is recorded
+in the same cache so later jobs skip straight to the next candidate.
+"""
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import threading
+from dataclasses import dataclass, field
+
+logger = logging.getLogger("StreamGrab")
+
+DEFAULT_CAPS_PATH = os.path.join(os.path.expanduser("~"), ".cache", "streamgrab", "ffmpeg-caps.json")
+
+# libx264 preset and thread count per quality on CPU-only hosts. Small
+# outputs encode quickly at a fast preset and gain little from many threads;
+# leaving cores free lets more jobs run side by side.
+SOFTWARE_PRESETS = {
+    "Low": ("veryfast", 2),
+    "Medium": ("faster", 4),
+    "High": ("medium", 0),
+}
+
+# FFmpeg stderr that shows a hardware device or encoder failing to start, rather than a bad input
+HARDWARE_INIT_ERRORS = (
+    "Device creation failed",
+    "No device available",
+    "Cannot load",
+    "Cannot init CUDA",
+    "OpenEncodeSessionEx failed",
+    "No capable devices found",
+    "Failed to initialise VAAPI",
+    "hwaccel initialisation returned error",
+    "Error initializing output stream",
+    "Error while opening encoder",
+    "Could not open encoder",
+)
+
+_lock = threading.Lock()
+
+
+@dataclass
+class Capabilities:
+    """What one ffmpeg binary supports"""
+    path: str
+    version: str = ""
+    hwaccels: list = field(default_factory=list)
+    encoders: list = field(default_factory=list)
+    broken: list = field(default_factory=list)
+
+
+@dataclass
+class EncodePlan:
+    """How to decode, scale and encode video for one attempt"""
+    name: str
+    input_args: list
+    video_args: list
+    hardware: bool = False
+
+
+def probe(ffmpeg="ffmpeg", cache_path=DEFAULT_CAPS_PATH):
+    """Return the Capabilities of ffmpeg, probing it only if the cache is stale"""
+    resolved = shutil.which(ffmpeg)
+    if resolved is None:
+        raise FileNotFoundError(f"FFmpeg not found: {ffmpeg}")
+    resolved = os.path.realpath(resolved)
+    stat = os.stat(resolved)
+    key = f"{resolved}:{stat.st_size}:{int(stat.st_mtime)}"
+
+    with _lock:
+        cache = _load(cache_path)
+        entry = cache.get(key)
+        if entry is not None:
+            return Capabilities(**entry)
+
+        caps = Capabilities(
+            path=resolved,
+            version=_first_line(_run(resolved, "-version")),
+            hwaccels=_parse_hwaccels(_run(resolved, "-hide_banner", "-hwaccels")),
+            encoders=_parse_encoders(_run(resolved, "-hide_banner", "-encoders")),
+        )
+        logger.info(f"Probed {caps.version or resolved}: hwaccels={','.join(caps.hwaccels) or 'none'}")
+        cache = {k: v for k, v in cache.items() if not k.startswith(resolved + ":")}
+        cache[key] = vars(caps)
+        _save(cache_path, cache)
+        return caps
+
+
+def mark_broken(caps, plan_name, cache_path=DEFAULT_CAPS_PATH):
+    """Remember that an encode path failed on this host so it is not tried again"""
+    if plan_name in caps.broken:
+        return
+    caps.broken.append(plan_name)
+    with _lock:
+        cache = _load(cache_path)
+        for key, entry in cache.items():
+            if entry.get("path") == caps.path:
+                entry["broken"] = sorted(set(entry.get("broken", [])) | {plan_name})
+        _save(cache_path, cache)
+
+
+def init_failed(errors):
+    """Whether FFmpeg's stderr shows a hardware device or encoder that could not start"""
+    return any(marker in errors for marker in HARDWARE_INIT_ERRORS)
+
+
+def encode_plans(caps, quality, scale, use_hw_accel, system=None):
+    """Candidate encode paths for a transcode, fastest first.
+
+    Hardware paths are offered only when both the hwaccel and its encoder
+    are present and have not failed before; software libx264 always comes
+    last as the fallback.
+    """
+    system = (system or platform.system()).lower()
+    plans = []
+    if use_hw_accel:
+        vf = f"scale={scale}"
+        candidates = [
+            ("cuda", "h264_nvenc", ["-hwaccel", "cuda"], ["-vf", vf, "-c:v", "h264_nvenc", "-preset", "p4"]),
+            ("qsv", "h264_qsv", ["-hwaccel", "qsv"], ["-vf", f"{vf},format=nv12", "-c:v", "h264_qsv"]),
+        ]
+        if system == "darwin":
+            candidates.insert(0, ("videotoolbox", "h264_videotoolbox", ["-hwaccel", "videotoolbox"],
+                                  ["-vf", vf, "-c:v", "h264_videotoolbox"]))
+        elif system == "windows":
+            candidates += [
+                ("d3d11va", "h264_amf", ["-hwaccel", "d3d11va"], ["-vf", vf, "-c:v", "h264_amf"]),
+                ("dxva2", "h264_amf", ["-hwaccel", "dxva2"], ["-vf", vf, "-c:v", "h264_amf"]),
+            ]
+        else:
+            candidates.append(("vaapi", "h264_vaapi",
+                               ["-hwaccel", "vaapi", "-vaapi_device", "/dev/dri/renderD128"],
+                               ["-vf", f"{vf},format=nv12,hwupload", "-c:v", "h264_vaapi"]))
+        for hwaccel, encoder, input_args, video_args in candidates:
+            name = f"{hwaccel}+{encoder}"
+            if hwaccel in caps.hwaccels and encoder in caps.encoders and name not in caps.broken:
+                plans.append(EncodePlan(name, input_args, video_args, hardware=True))
+        if not plans:
+            logger.info("No working hardware encode path found, using libx264")
+
+    plans.append(EncodePlan("libx264", [], ["-vf", f"scale={scale}", *software_encoder_args(quality)]))
+    return plans
+
+
+def software_encoder_args(quality):
+    """libx264 output options for quality, without the scale filter"""
+    preset, threads = SOFTWARE_PRESETS.get(quality, ("medium", 0))
+    threads = min(threads, os.cpu_count() or 1) if threads else 0
+    return ["-c:v", "libx264", "-preset", preset, "-threads", str(threads)]
+
+
+def _run(ffmpeg, *args):
+    try:
+        result = subprocess.run([ffmpeg, *args], capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"FFmpeg probe {' '.join(args)} failed: {e}")
+        return ""
+    return result.stdout
+
+
+def _first_line(text):
+    return text.splitlines()[0].strip() if text.strip() else ""
+
+
+def _parse_hwaccels(text):
+    # "Hardware acceleration methods:" followed by one name per line
+    lines = [line.strip() for line in text.splitlines()]
+    if "Hardware acceleration methods:" in lines:
+        lines = lines[lines.index("Hardware acceleration methods:") + 1:]
+    return [line for line in lines if line and " " not in line]
+
+
+def _parse_encoders(text):
+    # " V....D libx264   libx264 H.264 ..." after a "------" separator
+    encoders = []
+    seen_separator = False
+    for line in text.splitlines():
+        if line.strip().startswith("------"):
+            seen_separator = True
+            continue
+        parts = line.split()
+        if seen_separator and len(parts) >= 2:
+            encoders.append(parts[1])
+    return encoders
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,468 @@
+"""Persistent background job queue backed by SQLite
+
+Jobs are submitted to an SQLite table and run by worker threads owned by a
+JobManager, so they keep going while the Streamlit script reruns. Status,
+progress and log lines are written back to the database for the UI to
+poll. A job left running by a process that died is queued again when the
+next manager starts. It then resumes from its segment journal.
+
+Jobs claimed with a lease (by remote workers, see streamgrab.cluster)
+must be kept alive with heartbeats; when a lease expires the job is
+queued again for another worker.
+"""
+import dataclasses
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from streamgrab.convert import ConvertOptions, PlaylistFile, claim_output, convert_m3u8_to_mp4
+from streamgrab.fetch import ConnectionPool
+from streamgrab.cache import SegmentCache
+from streamgrab.metrics import DEFAULT_METRICS_PATH, JobMetrics, MetricsRegistry
+from streamgrab.outputs import output_index
+
+logger = logging.getLogger("StreamGrab")
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".cache", "streamgrab", "jobs.sqlite")
+
+# Log lines kept per job; older lines are trimmed as new ones arrive
+MAX_LOG_LINES_PER_JOB = 500
+
+# Minimum seconds between progress writes for one job
+PROGRESS_INTERVAL = 1.0
+
+# Claims of a job before it is failed instead of being handed out again
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    playlist BLOB NOT NULL,
+    output_dir TEXT NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    owner TEXT,
+    progress REAL,
+    progress_text TEXT,
+    output_path TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+CREATE TABLE IF NOT EXISTS job_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    level TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_logs_job ON job_logs (job_id, id);
+"""
+
+# Columns added after the first release, created on open when missing
+MIGRATIONS = {
+    "lease_until": "ALTER TABLE jobs ADD COLUMN lease_until REAL",
+    "attempts": "ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+    "metrics": "ALTER TABLE jobs ADD COLUMN metrics TEXT",
+    # Where a playlist given by URL was loaded from, to resolve relative URIs and reload live playlists
+    "url": "ALTER TABLE jobs ADD COLUMN url TEXT",
+}
+
+ACTIVE_STATES = ("queued", "running")
+
+
+@dataclasses.dataclass
+class Job:
+    """A row of the jobs table, without the playlist body"""
+    id: int
+    name: str
+    output_dir: str
+    state: str
+    progress: float
+    progress_text: str
+    output_path: str
+    error: str
+    created: float
+    updated: float
+    owner: str = None
+    attempts: int = 0
+
+
+class JobQueue:
+    """SQLite-backed job table shared by the UI and the worker threads"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, statement in MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(statement)
+
+    def submit(self, m3u8_file, output_dir, options):
+        """Queue a playlist for conversion and return its job id"""
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO jobs (name, playlist, url, output_dir, options, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (m3u8_file.name, m3u8_file.getvalue(), getattr(m3u8_file, "url", None), output_dir,
+                 json.dumps(dataclasses.asdict(options)), now, now),
+            )
+            return cur.lastrowid
+
+    def claim(self, owner, lease=None):
+        """Atomically take the oldest queued job, or return None.
+
+        With a lease (seconds), the job is queued again unless heartbeat()
+        renews it before it runs out.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "UPDATE jobs SET state = 'running', owner = ?, updated = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE id = (SELECT id FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1) "
+                "RETURNING id, name, playlist, url, output_dir, options",
+                (owner, now, now + lease if lease else None),
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, name, playlist, url, output_dir, options = row
+        return job_id, PlaylistFile(name, playlist, url=url), output_dir, ConvertOptions(**json.loads(options))
+
+    def finish(self, job_id, ok, output_path, error="", metrics=None, owner=None):
+        """Record a job's outcome; returns False if owner is given and no longer holds the job"""
+        query = ("UPDATE jobs SET state = ?, owner = NULL, lease_until = NULL, "
+                 "progress = CASE WHEN ? THEN 1.0 ELSE progress END, progress_text = NULL, "
+                 "output_path = ?, error = ?, metrics = ?, updated = ? WHERE id = ?")
+        params = ["done" if ok else "failed", ok, output_path, error,
+                  json.dumps(metrics) if metrics else None, time.time(), job_id]
+        if owner is not None:
+            query += " AND owner = ? AND state = 'running'"
+            params.append(owner)
+        with self._lock:
+            return self._db.execute(query, params).rowcount > 0
+
+    def heartbeat(self, job_id, owner, lease):
+        """Extend the lease of a running job; False if it was reassigned meanwhile"""
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND owner = ? AND state = 'running'",
+                (now + lease, now, job_id, owner),
+            )
+            return cur.rowcount > 0
+
+    def requeue_expired(self, max_attempts=MAX_ATTEMPTS):
+        """Queue again leased jobs whose worker stopped sending heartbeats.
+
+        Jobs that have already been claimed max_attempts times are failed
+        instead, so one playlist that kills its workers cannot stall the queue.
+        Returns the ids of the requeued jobs.
+        """
+        now = time.time()
+        with self._lock:
+            expired = self._db.execute(
+                "SELECT id, owner, attempts FROM jobs WHERE state = 'running' AND lease_until < ?", (now,)
+            ).fetchall()
+            requeued = []
+            for job_id, owner, attempts in expired:
+                if attempts >= max_attempts:
+                    self._db.execute(
+                        "UPDATE jobs SET state = 'failed', owner = NULL, lease_until = NULL, error = ?, updated = ? "
+                        "WHERE id = ?",
+                        (f"Lease expired on {attempts} workers, last {owner}", now, job_id),
+                    )
+                else:
+                    self._db.execute(
+                        "UPDATE jobs SET state = 'queued', owner = NULL, lease_until = NULL, updated = ? WHERE id = ?",
+                        (now, job_id),
+                    )
+                    requeued.append(job_id)
+        if expired:
+            logger.info(f"Reassigning {len(requeued)} jobs with expired leases, "
+                        f"failed {len(expired) - len(requeued)}")
+        return requeued
+
+    def job_metrics(self):
+        """Recorded metrics of finished jobs, as JobMetrics.to_dict() dicts"""
+        with self._lock:
+            rows = self._db.execute("SELECT metrics FROM jobs WHERE metrics IS NOT NULL ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def set_progress(self, job_id, fraction, text):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET progress = COALESCE(?, progress), progress_text = ?, updated = ? WHERE id = ?",
+                (fraction, text, time.time(), job_id),
+            )
+
+    def log(self, job_id, level, message):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO job_logs (job_id, ts, level, message) VALUES (?, ?, ?, ?)",
+                (job_id, time.time(), level, message),
+            )
+            self._db.execute(
+                "DELETE FROM job_logs WHERE job_id = ? AND id <= "
+                "(SELECT id FROM job_logs WHERE job_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (job_id, job_id, MAX_LOG_LINES_PER_JOB),
+            )
+
+    def logs_since(self, last_id=0, limit=1000):
+        """Log lines of all jobs newer than last_id as (id, job_id, ts, level, message)"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, job_id, ts, level, message FROM job_logs WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, limit),
+            ).fetchall()
+
+    def jobs(self, limit=200):
+        """The most recent jobs, newest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, name, output_dir, state, progress, progress_text, output_path, error, created, updated, "
+                "owner, attempts FROM jobs ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [Job(*row) for row in rows]
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def cancel(self, job_id):
+        """Cancel a job that has not started yet; returns True if it was queued"""
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET state = 'cancelled', updated = ? WHERE id = ? AND state = 'queued'",
+                (time.time(), job_id),
+            )
+            return cur.rowcount > 0
+
+    def clear_finished(self):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM job_logs WHERE job_id IN (SELECT id FROM jobs WHERE state NOT IN (?, ?))",
+                ACTIVE_STATES,
+            )
+            self._db.execute("DELETE FROM jobs WHERE state NOT IN (?, ?)", ACTIVE_STATES)
+
+    def requeue_orphans(self):
+        """Queue again any job left running by a process on this host that has exited"""
+        host = socket.gethostname()
+        orphans = []
+        with self._lock:
+            for job_id, owner in self._db.execute("SELECT id, owner FROM jobs WHERE state = 'running'").fetchall():
+                owner_host, _, pid = (owner or "").rpartition(":")
+                if owner_host == host and not _pid_alive(int(pid or 0)):
+                    orphans.append(job_id)
+            self._db.executemany(
+                "UPDATE jobs SET state = 'queued', owner = NULL, updated = ? WHERE id = ?",
+                [(time.time(), job_id) for job_id in orphans],
+            )
+        if orphans:
+            logger.info(f"Requeued {len(orphans)} interrupted jobs")
+        return orphans
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class JobManager:
+    """Worker threads that run queued jobs in the background.
+
+    Metrics of every finished job are kept in self.metrics, and written to
+    metrics_path in Prometheus text format after each job when it is set.
+    With a lease (seconds), jobs are claimed under a lease that a heartbeat
+    thread renews while they run. output_dir, when given, replaces the
+    output directory the jobs were submitted with.
+    """
+
+    def __init__(self, job_queue, workers=2, poll_interval=1.0, metrics_path=DEFAULT_METRICS_PATH, lease=None,
+                 output_dir=None):
+        self.queue = job_queue
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.output_dir = output_dir
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.metrics = MetricsRegistry()
+        self.metrics_path = metrics_path
+        self.pool = ConnectionPool()
+        self._caches = {}
+        self._caches_lock = threading.Lock()
+        self._threads = []
+        self._target = 0
+        self._stop = threading.Event()
+        self.queue.requeue_orphans()
+        self.set_workers(workers)
+
+    def set_workers(self, workers):
+        """Grow or shrink the worker pool; surplus workers exit after their current job"""
+        self._target = max(1, workers)
+        self._threads = [t for t in self._threads if t.is_alive()]
+        for slot in range(len(self._threads), self._target):
+            thread = threading.Thread(target=self._work, args=(slot,), daemon=True, name=f"job-worker-{slot}")
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self.pool.close()
+        for cache in self._caches.values():
+            cache.close()
+
+    def _cache_for(self, options):
+        if options.cache_size_gb <= 0 or options.segment_window <= 1:
+            return None
+        key = (options.cache_dir, options.cache_size_gb)
+        with self._caches_lock:
+            if key not in self._caches:
+                self._caches[key] = SegmentCache(options.cache_dir, max_bytes=int(options.cache_size_gb * 1024 ** 3))
+            return self._caches[key]
+
+    def _work(self, slot):
+        while not self._stop.is_set():
+            if slot >= self._target:
+                return
+            try:
+                claimed = self.queue.claim(self.owner, lease=self.lease)
+            except OSError as e:
+                # A remote queue may be briefly unreachable; keep polling
+                logger.warning(f"Could not claim a job: {e}")
+                claimed = None
+            if claimed is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self._run(*claimed)
+
+    def _heartbeat(self, job_id, done):
+        """Renew the job's lease until done is set"""
+        while not done.wait(self.lease / 3):
+            try:
+                if not self.queue.heartbeat(job_id, self.owner, self.lease):
+                    logger.warning(f"Lost the lease on job #{job_id}; it has been reassigned")
+                    return
+            except OSError as e:
+                logger.warning(f"Heartbeat for job #{job_id} failed: {e}")
+
+    def _run(self, job_id, m3u8_file, output_dir, options):
+        last_error = []
+        last_progress = [0.0]
+        output_dir = self.output_dir or output_dir
+        done = threading.Event()
+        if self.lease:
+            threading.Thread(target=self._heartbeat, args=(job_id, done), daemon=True,
+                             name=f"heartbeat-{job_id}").start()
+
+        def add_log(message, level="INFO", key=None):
+            if key is not None:
+                # Live download lines update the job row instead of growing the log
+                now = time.monotonic()
+                if now - last_progress[0] >= PROGRESS_INTERVAL:
+                    last_progress[0] = now
+                    self.queue.set_progress(job_id, None, message)
+                return
+            if level == "ERROR":
+                last_error.append(message)
+            self.queue.log(job_id, level, message)
+            if level == "ERROR":
+                logger.error(message)
+            elif level == "WARNING":
+                logger.warning(message)
+            else:
+                logger.info(message)
+
+        def on_progress(progress):
+            now = time.monotonic()
+            if progress.done or now - last_progress[0] >= PROGRESS_INTERVAL:
+                last_progress[0] = now
+                self.queue.set_progress(job_id, progress.fraction, progress.describe())
+
+        # ffmpeg progress reaches the job row through on_progress
+        def job_log(message, level="INFO", key=None):
+            if key is None or not key.startswith("progress:"):
+                add_log(message, level, key)
+
+        metrics = JobMetrics(m3u8_file.name, options.quality)
+        # One pool serves every worker thread; the most recently started job's limits apply to all
+        self.pool.scheduler.set_limits(options.host_limits)
+        output_path = None
+        fingerprint = None
+        ok = False
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            output_path, fingerprint, converted = claim_output(m3u8_file, output_dir, options)
+            if converted:
+                add_log(f"Skipping {m3u8_file.name}: already converted to {output_path} with these settings",
+                        "SUCCESS")
+                done.set()
+                self.queue.finish(job_id, True, output_path, owner=self.owner)
+                return
+            ok = convert_m3u8_to_mp4(m3u8_file, output_path, options, add_log=job_log, pool=self.pool,
+                                     cache=self._cache_for(options), on_progress=on_progress, metrics=metrics)
+        except Exception as e:
+            add_log(f"Error in conversion process: {e}", "ERROR")
+        finally:
+            done.set()
+            if fingerprint:
+                output_index(output_dir).release(fingerprint, output_path, ok)
+        self.metrics.record(metrics)
+        add_log(metrics.describe(), "INFO")
+        if self.metrics_path:
+            try:
+                self.metrics.write_prometheus(self.metrics_path)
+            except OSError as e:
+                logger.warning(f"Could not write metrics to {self.metrics_path}: {e}")
+        error = ""
+        if not ok:
+            lines = last_error[-1].strip().splitlines() if last_error else []
+            error = lines[-1] if lines else "Unknown error"
+        if not self.queue.finish(job_id, ok, output_path, error, metrics=metrics.to_dict(), owner=self.owner):
+            logger.warning(f"Job #{job_id} finished after it was reassigned; its result was discarded")
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_path=DEFAULT_DB_PATH, workers=2):
+    """Process-wide JobManager for db_path, created on first use.
+
+    Streamlit reruns the whole script on every interaction; this keeps a
+    single set of worker threads alive across reruns.
+    """
+    with _managers_lock:
+        manager = _managers.get(db_path)
+        if manager is None:
+            manager = _managers[db_path] = JobManager(JobQueue(db_path), workers)
+        else:
+            manager.set_workers(workers)
+        return manager
+
+
+def _pid_alive(pid):
+    if pid <= 0:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,108 @@
+"""On-disk journal of completed segments so interrupted downloads can resume"""
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger("StreamGrab")
+
+JOURNAL_NAME = "journal.jsonl"
+
+
+def job_dir(root, playlist_bytes, output_path):
+    """Stable work directory for a job, derived from the playlist and its output.
+
+    Re-submitting the same playlist for the same output (after a crash, a
+    Streamlit rerun or a restart) lands in the same directory and resumes.
+    """
+    path = job_dir_path(root, playlist_bytes, output_path)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def job_dir_path(root, playlist_bytes, output_path):
+    """Where job_dir puts a job's work directory, without creating it"""
+    digest = hashlib.sha256()
+    digest.update(playlist_bytes)
+    digest.update(b"\0")
+    digest.update(os.path.abspath(output_path).encode("utf-8"))
+    return os.path.join(root, digest.hexdigest()[:16])
+
+
+class SegmentJournal:
+    """Append-only record of segments already written to a work directory.
+
+    Each line holds the segment index, file name, byte size and SHA-256.
+    A segment is journaled only after its file has been fully written and
+    renamed into place, so a crash never leaves a journaled partial file.
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.path = os.path.join(work_dir, JOURNAL_NAME)
+        self.entries = self._load()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn final line from a crash mid-write
+                    continue
+                entries[entry["index"]] = entry
+        return entries
+
+    def completed(self, verify=True):
+        """Return {index: entry} for segments whose files are intact on disk"""
+        intact = {}
+        for idx, entry in self.entries.items():
+            path = os.path.join(self.work_dir, entry["file"])
+            try:
+                if os.path.getsize(path) != entry["size"]:
+                    continue
+                if verify and _sha256_file(path) != entry["sha256"]:
+                    continue
+            except OSError:
+                continue
+            intact[idx] = entry
+        dropped = len(self.entries) - len(intact)
+        if dropped:
+            logger.warning(f"Discarding {dropped} damaged segments from {self.work_dir}")
+        self.entries = intact
+        return intact
+
+    def write(self, idx, name, data):
+        """Write a segment file atomically and journal it"""
+        path = os.path.join(self.work_dir, name)
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        entry = {"index": idx, "file": name, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self.entries[idx] = entry
+
+    def close(self):
+        if not self._file.closed:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
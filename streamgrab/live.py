@@ -0,0 +1,193 @@
+"""Recording of live and event playlists by incremental reloading
+
+A media playlist without EXT-X-ENDLIST is still growing. LivePoller reloads
+it on the schedule RFC 8216 section 6.3.4 asks clients to follow (one
+target duration after a load that brought new segments, half of one after
+an unchanged load) and tracks media sequence numbers, so each segment is
+fetched exactly once even as old ones slide out of the window. LiveFeeder
+writes the new segments into ffmpeg's stdin as they appear.
+"""
+import functools
+import logging
+import threading
+import time
+
+from streamgrab.crypto import KeyStore
+from streamgrab.fetch import FetchError, fetch_segments, fetch_url
+from streamgrab.pipeline import streamable_playlist
+from streamgrab.playlist import is_remote, parse_playlist
+
+logger = logging.getLogger("StreamGrab")
+
+# Consecutive failed reloads tolerated before the recording is abandoned
+MAX_RELOAD_ERRORS = 10
+
+# Stop when the playlist brings no new segment for this many target durations
+STALL_TARGET_DURATIONS = 10
+
+# Reload interval used when the playlist gives no usable EXT-X-TARGETDURATION
+DEFAULT_TARGET_DURATION = 6.0
+
+
+def live_playlist(playlist_bytes, url):
+    """Return the parsed playlist if it is a live/event playlist that can be recorded, else None.
+
+    Recording needs the playlist's own URL to reload it, and MPEG-TS
+    segments that can be concatenated into ffmpeg's stdin.
+    """
+    if not url or not is_remote(url):
+        return None
+    playlist = streamable_playlist(playlist_bytes, url)
+    if playlist is None or playlist.endlist:
+        return None
+    return playlist
+
+
+class LivePoller:
+    """Reloads a live media playlist and yields batches of segments not seen before.
+
+    stop_after limits the recording to that many seconds of media (by
+    EXTINF); 0 records until EXT-X-ENDLIST. Reload failures are retried
+    with backoff; segments that slid out of the window while the playlist
+    could not be loaded are counted in `skipped`.
+    """
+
+    def __init__(self, url, pool, stop_after=0.0, stop_event=None, on_warning=None,
+                 max_reload_errors=MAX_RELOAD_ERRORS, metrics=None):
+        self.url = url
+        self.pool = pool
+        self.stop_after = stop_after
+        self.stop_event = stop_event or threading.Event()
+        self.on_warning = on_warning or logger.warning
+        self.max_reload_errors = max_reload_errors
+        self.metrics = metrics
+        self.recorded = 0.0
+        self.segments = 0
+        self.skipped = 0
+        self.reloads = 0
+        self.ended = False
+
+    def _load(self):
+        data = fetch_url(self.pool, self.url, metrics=self.metrics)
+        self.reloads += 1
+        return parse_playlist(data.decode("utf-8-sig"), self.url)
+
+    def _wait(self, seconds):
+        """Sleep up to seconds; True if the recording was stopped meanwhile"""
+        return self.stop_event.wait(max(0.0, seconds))
+
+    def poll(self, first=None):
+        """Yield lists of new segments until the stream ends, stop_after is reached or stop() is called"""
+        playlist = first
+        next_seq = None
+        errors = 0
+        target = DEFAULT_TARGET_DURATION
+        last_new = time.monotonic()
+
+        while not self.stop_event.is_set():
+            loaded_at = time.monotonic()
+            if playlist is None:
+                try:
+                    playlist = self._load()
+                except (FetchError, UnicodeDecodeError, ValueError) as e:
+                    errors += 1
+                    if errors > self.max_reload_errors:
+                        raise FetchError(f"Giving up after {errors} failed reloads of {self.url}: {e}")
+                    self.on_warning(f"Reloading live playlist failed ({errors}/{self.max_reload_errors}), "
+                                    f"retrying: {e}")
+                    if self._wait(min(target * errors, 30.0)):
+                        return
+                    continue
+                errors = 0
+            if playlist.is_master:
+                raise ValueError(f"{self.url} turned into a master playlist")
+            if playlist.target_duration > 0:
+                target = playlist.target_duration
+
+            first_seq = playlist.media_sequence
+            if next_seq is None:
+                next_seq = first_seq
+            elif first_seq > next_seq:
+                # The window slid past segments we never saw (slow reloads or errors)
+                self.skipped += first_seq - next_seq
+                self.on_warning(f"Missed {first_seq - next_seq} live segments that left the playlist window")
+                next_seq = first_seq
+            new = playlist.segments[next_seq - first_seq:]
+            next_seq += len(new)
+
+            if self.stop_after:
+                kept = []
+                for seg in new:
+                    if self.recorded >= self.stop_after:
+                        break
+                    kept.append(seg)
+                    self.recorded += seg.duration
+                new = kept
+            else:
+                self.recorded += sum(seg.duration for seg in new)
+
+            if new:
+                last_new = time.monotonic()
+                self.segments += len(new)
+                yield new
+            if playlist.endlist or (self.stop_after and self.recorded >= self.stop_after):
+                self.ended = playlist.endlist
+                return
+            if time.monotonic() - last_new > STALL_TARGET_DURATIONS * target:
+                self.on_warning(f"No new live segments for {STALL_TARGET_DURATIONS * target:.0f}s, "
+                                f"ending the recording")
+                return
+
+            # RFC 8216 6.3.4: reload after one target duration, or half of one if nothing changed
+            delay = target if new else target / 2
+            if self._wait(loaded_at + delay - time.monotonic()):
+                return
+            playlist = None
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class LiveFeeder(threading.Thread):
+    """Writes the segments of a live playlist into a process's stdin as they are published.
+
+    Same contract as pipeline.StdinFeeder: `error` is set when fetching
+    fails, and stdin is closed when the recording ends so ffmpeg can
+    finalize the output.
+    """
+
+    def __init__(self, stdin, poller, first, pool, window=8, on_segment=None, metrics=None):
+        super().__init__(daemon=True, name="live-feeder")
+        self.stdin = stdin
+        self.poller = poller
+        self.first = first
+        self.pool = pool
+        self.window = window
+        self.on_segment = on_segment
+        self.metrics = metrics
+        # Keys are fetched once for the whole recording, not once per reload
+        self.keys = KeyStore(functools.partial(fetch_url, pool))
+        self.error = None
+        self.bytes_written = 0
+
+    def run(self):
+        try:
+            for segments in self.poller.poll(self.first):
+                for _, data in fetch_segments(segments, self.pool, window=self.window, metrics=self.metrics,
+                                              keys=self.keys):
+                    self.stdin.write(data)
+                    self.bytes_written += len(data)
+                if self.on_segment:
+                    self.on_segment(self.poller.segments, self.poller.recorded)
+        except BrokenPipeError:
+            # ffmpeg exited early; its own error output explains why
+            pass
+        except Exception as e:
+            self.error = e
+            logger.error(f"Live recording failed: {e}")
+        finally:
+            self.poller.stop()
+            try:
+                self.stdin.close()
+            except OSError:
+                pass
@@ -0,0 +1,122 @@
+"""Bounded, coalescing log store for the Streamlit log panel"""
+import logging
+import logging.handlers
+import os
+import threading
+from collections import deque
+from itertools import islice
+
+
+class LogBuffer:
+    """Ring buffer of (level, text) log entries.
+
+    Holds at most `capacity` entries; the oldest are dropped first. Entries
+    added with a coalescing key replace the previous entry with the same key
+    in place, so a stream of progress updates for one file occupies a single
+    live line instead of thousands.
+    """
+
+    def __init__(self, capacity=1000):
+        self._entries = deque(maxlen=capacity)
+        self._live = {}
+        self._lock = threading.Lock()
+        self.total = 0
+
+    @property
+    def capacity(self):
+        return self._entries.maxlen
+
+    def resize(self, capacity):
+        with self._lock:
+            if capacity != self._entries.maxlen:
+                self._entries = deque(self._entries, maxlen=capacity)
+                self._live = {entry[2]: entry for entry in self._entries if entry[2] is not None}
+
+    def add(self, level, text, key=None):
+        with self._lock:
+            if key is not None:
+                entry = self._live.get(key)
+                if entry is not None and entry[2] is not None:
+                    entry[0], entry[1] = level, text
+                    return
+            entry = [level, text, key]
+            if len(self._entries) == self._entries.maxlen:
+                evicted = self._entries[0]
+                if evicted[2] is not None and self._live.get(evicted[2]) is evicted:
+                    del self._live[evicted[2]]
+                evicted[2] = None
+            self._entries.append(entry)
+            if key is not None:
+                self._live[key] = entry
+            self.total += 1
+
+    def close_key(self, key):
+        """Stop coalescing into the live entry for key; it stays in the log"""
+        with self._lock:
+            entry = self._live.pop(key, None)
+            if entry is not None:
+                entry[2] = None
+
+    def window(self, size):
+        """The newest `size` entries as (level, text), oldest first"""
+        with self._lock:
+            start = max(0, len(self._entries) - size)
+            return [(level, text) for level, text, _ in islice(self._entries, start, None)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._live.clear()
+            self.total = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Open rotating file handlers by path, with the number of LogFiles writing to each
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+
+class LogFile:
+    """A rotating log file written by one session, apart from the process-wide logger.
+
+    LogFiles for the same path share one handler, so rotation never races;
+    it is closed with the last of them. Entries below INFO, such as live
+    progress lines, are not written.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 ** 2, backup_count=5):
+        self.path = os.path.abspath(path)
+        with _handlers_lock:
+            entry = _handlers.get(self.path)
+            if entry is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=max_bytes,
+                                                               backupCount=backup_count, encoding="utf-8")
+                handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+                entry = _handlers[self.path] = [handler, 0]
+            entry[1] += 1
+        self._handler = entry[0]
+        self._closed = False
+
+    def write(self, level, message):
+        """Append message; level is a logging level name, or SUCCESS (written as INFO)"""
+        levelno = logging.getLevelName(level)
+        if not isinstance(levelno, int):
+            levelno = logging.INFO
+        if self._closed or levelno < logging.INFO:
+            return
+        self._handler.handle(logging.makeLogRecord(
+            {"name": "StreamGrab", "levelno": levelno, "levelname": level, "msg": message}))
+
+    def close(self):
+        with _handlers_lock:
+            if self._closed:
+                return
+            self._closed = True
+            entry = _handlers[self.path]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _handlers[self.path]
+                entry[0].close()
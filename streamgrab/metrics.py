@@ -0,0 +1,400 @@
+"""Per-job performance metrics with JSON and Prometheus text exports
+
+Every conversion records a JobMetrics: segment fetch latencies, bytes
+moved, retries, ffmpeg speed and the time spent in each phase. A
+MetricsRegistry collects them for a batch (or for the lifetime of a job
+manager) and renders totals as a JSON summary or in the Prometheus text
+exposition format, labelled by origin host and quality so slow CDNs and
+presets stand out.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the segment fetch latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PHASES = ("fetch", "mux", "encode")
+
+# Prometheus textfile kept up to date by the background job manager
+DEFAULT_METRICS_PATH = os.path.join(os.path.expanduser("~"), ".cache", "streamgrab", "metrics.prom")
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def cumulative(self):
+        """(upper bound, cumulative count) pairs ending with +Inf"""
+        total = 0
+        pairs = []
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (capped at the largest
+        observation), or None when empty"""
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return min(bound, round(self.max, 4))
+        return None
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a histogram from to_dict() output"""
+        histogram = cls()
+        previous = 0
+        for i, total in enumerate(data.get("buckets", {}).values()):
+            if i < len(histogram.counts):
+                histogram.counts[i] = total - previous
+            previous = total
+        histogram.sum = data.get("sum", 0.0)
+        histogram.count = data.get("count", 0)
+        histogram.max = data.get("max", 0.0)
+        return histogram
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "mean": round(self.sum / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 4),
+            "buckets": {_format_bound(bound): total for bound, total in self.cumulative()},
+        }
+
+
+class JobMetrics:
+    """Measurements for one conversion, safe to update from fetch threads"""
+
+    def __init__(self, name="", quality="Original"):
+        self.name = name
+        self.quality = quality
+        self.host = ""
+        self.ok = None
+        self.encode_path = ""
+        self.jobs = 0
+        self.failed = 0
+        self.segments = 0
+        self.cache_hits = 0
+        self.bytes_downloaded = 0
+        self.bytes_from_cache = 0
+        self.bytes_written = 0
+        self.retries = 0
+        self.fetch_latency = Histogram()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.media_seconds = 0.0
+        self.frames = 0
+        self.fps = 0.0
+        self.speed = 0.0
+        self.wall = 0.0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a finished job's metrics from to_dict() output, e.g. as reported by a remote worker"""
+        job = cls(data.get("name", ""), data.get("quality", "Original"))
+        for attr in ("host", "encode_path", "segments", "cache_hits", "bytes_downloaded", "bytes_from_cache",
+                     "bytes_written", "retries", "media_seconds", "frames", "wall"):
+            if data.get(attr) is not None:
+                setattr(job, attr, data[attr])
+        job.ok = data.get("ok")
+        job.jobs = 1
+        job.failed = 0 if job.ok else 1
+        job.fps = data.get("fps") or 0.0
+        job.speed = data.get("speed") or 0.0
+        job.phases.update(data.get("phases", {}))
+        job.fetch_latency = Histogram.from_dict(data.get("fetch_latency", {}))
+        return job
+
+    @property
+    def cache_misses(self):
+        return self.segments - self.cache_hits
+
+    def observe_fetch(self, uri, seconds, nbytes, cache_hit=False, segments=1):
+        """Record one request for segments, fetched over the network or served from the cache"""
+        with self._lock:
+            if not self.host and "://" in uri:
+                self.host = uri.split("://", 1)[1].split("/", 1)[0]
+            self.segments += segments
+            if cache_hit:
+                self.cache_hits += segments
+                self.bytes_from_cache += nbytes
+            else:
+                self.bytes_downloaded += nbytes
+                self.fetch_latency.observe(seconds)
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in the with-block to phase `name`"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def observe_progress(self, progress):
+        """Keep the latest ffmpeg progress snapshot; its fps and speed are run averages"""
+        self.media_seconds = progress.out_time
+        self.frames = progress.frame
+        self.fps = progress.fps
+        self.speed = progress.speed
+
+    def finish(self, ok, output_paths=()):
+        """Close the job; bytes_written is the total size of output_paths, one per rendition"""
+        self.ok = ok
+        self.jobs = 1
+        self.failed = 0 if ok else 1
+        self.wall = time.monotonic() - self._started
+        if ok:
+            self.bytes_written = sum(os.path.getsize(path) for path in output_paths if os.path.exists(path))
+
+    def describe(self):
+        """One-line summary for the job log"""
+        parts = []
+        if self.segments:
+            fetched = f"{self.segments} segments, {self.bytes_downloaded / 1024 ** 2:.1f} MB downloaded"
+            if self.cache_hits:
+                fetched += f" ({self.cache_hits} from cache)"
+            if self.fetch_latency.count:
+                fetched += f", fetch p95 <= {self.fetch_latency.quantile(0.95)}s"
+            parts.append(fetched)
+        if self.retries:
+            parts.append(f"{self.retries} retries")
+        parts.append(" / ".join(f"{name} {seconds:.1f}s" for name, seconds in self.phases.items() if seconds))
+        if self.fps or self.speed:
+            parts.append(f"{self.fps:.0f} fps, {self.speed:.1f}x realtime")
+        if self.bytes_written:
+            parts.append(f"{self.bytes_written / 1024 ** 2:.1f} MB written")
+        return "Metrics: " + ", ".join(p for p in parts if p)
+
+    def merge(self, other):
+        """Add another job's counters into this one (used for totals)"""
+        with self._lock:
+            self.jobs += other.jobs
+            self.failed += other.failed
+            self.segments += other.segments
+            self.cache_hits += other.cache_hits
+            self.bytes_downloaded += other.bytes_downloaded
+            self.bytes_from_cache += other.bytes_from_cache
+            self.bytes_written += other.bytes_written
+            self.retries += other.retries
+            self.fetch_latency.merge(other.fetch_latency)
+            for name, seconds in other.phases.items():
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self.media_seconds += other.media_seconds
+            self.frames += other.frames
+            self.wall += other.wall
+
+    def to_dict(self):
+        fetch_time = self.phases.get("fetch", 0.0)
+        encode_time = self.phases.get("encode", 0.0) + self.phases.get("mux", 0.0)
+        data = {
+            "name": self.name,
+            "quality": self.quality,
+            "host": self.host,
+            "segments": self.segments,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_from_cache": self.bytes_from_cache,
+            "bytes_written": self.bytes_written,
+            "retries": self.retries,
+            "fetch_latency": self.fetch_latency.to_dict(),
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "download_mb_per_sec": round(self.bytes_downloaded / 1024 ** 2 / fetch_time, 2) if fetch_time else None,
+            "media_seconds": round(self.media_seconds, 3),
+            "frames": self.frames,
+            "wall": round(self.wall, 3),
+        }
+        if self.jobs > 1 or self.ok is None:
+            # Totals: averages are derived from the summed counters
+            data["jobs"] = self.jobs
+            data["failed"] = self.failed
+            data["fps"] = round(self.frames / encode_time, 2) if encode_time else None
+            data["speed"] = round(self.media_seconds / encode_time, 2) if encode_time else None
+        else:
+            data["ok"] = self.ok
+            data["encode_path"] = self.encode_path
+            data["fps"] = self.fps
+            data["speed"] = self.speed
+        return data
+
+
+class MetricsRegistry:
+    """Collects finished jobs and keeps totals per (host, quality).
+
+    Per-job details are kept for the most recent `keep_jobs` jobs only, so
+    a long-running manager does not grow without bound.
+    """
+
+    def __init__(self, keep_jobs=1000):
+        self.started = time.time()
+        self._jobs = deque(maxlen=keep_jobs)
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, job):
+        with self._lock:
+            self._jobs.append(job.to_dict())
+            key = (job.host or "local", job.quality)
+            if key not in self._totals:
+                self._totals[key] = JobMetrics(quality=job.quality)
+                self._totals[key].host = key[0]
+            self._totals[key].merge(job)
+
+    def totals(self):
+        """Counters summed over every recorded job"""
+        total = JobMetrics(name="total")
+        with self._lock:
+            for aggregate in self._totals.values():
+                total.merge(aggregate)
+        return total
+
+    def summary(self):
+        """JSON-serialisable batch summary: per-job metrics plus totals"""
+        with self._lock:
+            jobs = list(self._jobs)
+            by_origin = [agg.to_dict() for agg in self._totals.values()]
+        return {
+            "started": self.started,
+            "elapsed": round(time.time() - self.started, 3),
+            "totals": self.totals().to_dict(),
+            "by_origin": by_origin,
+            "jobs": jobs,
+        }
+
+    def describe(self):
+        """One-line batch summary for the log"""
+        total = self.totals()
+        data = total.to_dict()
+        parts = [f"{total.jobs} jobs ({total.failed} failed)",
+                 f"{total.bytes_downloaded / 1024 ** 2:.1f} MB downloaded",
+                 f"{total.bytes_written / 1024 ** 2:.1f} MB written"]
+        if total.retries:
+            parts.append(f"{total.retries} retries")
+        if data["fetch_latency"]["p95"] is not None:
+            parts.append(f"fetch p95 <= {data['fetch_latency']['p95']}s")
+        parts.append(" / ".join(f"{name} {seconds:.1f}s" for name, seconds in total.phases.items() if seconds))
+        return "Batch metrics: " + ", ".join(p for p in parts if p)
+
+    def prometheus(self):
+        """Totals in the Prometheus text exposition format"""
+        with self._lock:
+            totals = sorted(self._totals.items())
+        out = []
+
+        def family(name, kind, help_text, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                out.append(f"{name}{suffix}{_labels(labels)} {_format_value(value)}")
+
+        def per_origin(attr):
+            return [("", {"host": host, "quality": quality}, getattr(agg, attr))
+                    for (host, quality), agg in totals]
+
+        jobs = []
+        for (host, quality), agg in totals:
+            jobs.append(("", {"host": host, "quality": quality, "status": "ok"}, agg.jobs - agg.failed))
+            jobs.append(("", {"host": host, "quality": quality, "status": "failed"}, agg.failed))
+        family("streamgrab_jobs_total", "counter", "Finished conversions", jobs)
+
+        latency = []
+        for (host, quality), agg in totals:
+            labels = {"host": host, "quality": quality}
+            for bound, count in agg.fetch_latency.cumulative():
+                latency.append(("_bucket", {**labels, "le": _format_bound(bound)}, count))
+            latency.append(("_sum", labels, agg.fetch_latency.sum))
+            latency.append(("_count", labels, agg.fetch_latency.count))
+        family("streamgrab_segment_fetch_seconds", "histogram", "Latency of segment fetches over the network",
+               latency)
+
+        family("streamgrab_segment_cache_hits_total", "counter", "Segments served from the segment cache",
+               per_origin("cache_hits"))
+        family("streamgrab_downloaded_bytes_total", "counter", "Segment bytes fetched over the network",
+               per_origin("bytes_downloaded"))
+        family("streamgrab_cache_bytes_total", "counter", "Segment bytes served from the segment cache",
+               per_origin("bytes_from_cache"))
+        family("streamgrab_written_bytes_total", "counter", "Bytes of MP4 output written",
+               per_origin("bytes_written"))
+        family("streamgrab_fetch_retries_total", "counter", "Retried playlist and segment requests",
+               per_origin("retries"))
+        family("streamgrab_phase_seconds_total", "counter", "Time spent per conversion phase",
+               [("", {"host": host, "quality": quality, "phase": name}, seconds)
+                for (host, quality), agg in totals for name, seconds in agg.phases.items()])
+        family("streamgrab_media_seconds_total", "counter", "Seconds of media converted",
+               per_origin("media_seconds"))
+        family("streamgrab_frames_total", "counter", "Video frames processed by ffmpeg",
+               per_origin("frames"))
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the Prometheus text atomically, e.g. for node_exporter's textfile collector"""
+        write_atomic(path, self.prometheus())
+
+
+def write_atomic(path, text):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else f"{bound:g}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
@@ -0,0 +1,152 @@
+"""Index of converted outputs, keyed by playlist fingerprint and settings
+
+Each output directory keeps an SQLite index in .streamgrab/outputs.sqlite
+mapping the fingerprint of a source (its normalized segment URI list plus
+the settings that change the output) to the file it produced, with its
+size, modification time and SHA-256. Re-running a batch skips jobs whose
+output is still on disk unchanged, and a different source that would land
+on a file name already taken gets a distinct name instead of overwriting it.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from streamgrab.journal import _sha256_file
+from streamgrab.playlist import is_remote, parse_playlist
+from streamgrab.probe import playlist_fingerprint
+
+logger = logging.getLogger("StreamGrab")
+
+INDEX_NAME = "outputs.sqlite"
+
+# Bumped when the fingerprint inputs change, so old entries stop matching
+FINGERPRINT_VERSION = 1
+
+
+def output_fingerprint(m3u8_file, options):
+    """Fingerprint of the output m3u8_file converts to under options, or None if it cannot be reused.
+
+    Live playlists are never reused: the same URL yields new media later.
+    """
+    playlist_bytes = m3u8_file.getvalue()
+    url = getattr(m3u8_file, "url", None)
+    try:
+        playlist = parse_playlist(playlist_bytes.decode("utf-8-sig"), url)
+    except (UnicodeDecodeError, ValueError):
+        uris = [hashlib.sha256(playlist_bytes).hexdigest()]
+    else:
+        if not playlist.is_master and not playlist.endlist and url and is_remote(url):
+            return None
+        if playlist.is_master:
+            uris = [variant.uri for variant in playlist.variants]
+        else:
+            uris = [seg.uri for seg in playlist.segments]
+    settings = f"#v{FINGERPRINT_VERSION} quality={options.quality} hwaccel={int(options.use_hw_accel)}"
+    if len(options.qualities) > 1:
+        settings += f" extra={','.join(options.qualities[1:])}"
+    if options.clip_start or options.clip_end:
+        settings += f" clip={options.clip_start:g}-{options.clip_end:g} exact={int(options.frame_accurate)}"
+    return playlist_fingerprint([*uris, settings])
+
+
+class OutputIndex:
+    """The output index of one directory.
+
+    claim() picks the output path for a fingerprint and reports whether a
+    matching output already exists; release() records the result. The
+    path is reserved for the fingerprint from the first claim on, so a
+    conversion that failed or was interrupted gets the same path (and its
+    resumable work dir) when it is run again. A second claim of a
+    fingerprint that is still being converted in this process waits for
+    the first one, so duplicates within a batch are converted once.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = os.path.abspath(output_dir)
+        index_dir = os.path.join(self.output_dir, ".streamgrab")
+        os.makedirs(index_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._in_flight = set()
+        self._db = sqlite3.connect(os.path.join(index_dir, INDEX_NAME), check_same_thread=False,
+                                   isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # size, mtime_ns and sha256 stay NULL until the output has been written
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outputs ("
+            "fingerprint TEXT PRIMARY KEY, name TEXT NOT NULL, file TEXT NOT NULL UNIQUE, "
+            "size INTEGER, mtime_ns INTEGER, sha256 TEXT, created REAL NOT NULL)"
+        )
+
+    def claim(self, fingerprint, name, reuse=True):
+        """Return (output path, True if an intact output for fingerprint exists and reuse is set)"""
+        with self._lock:
+            while fingerprint in self._in_flight:
+                self._released.wait()
+            row = self._db.execute("SELECT file, size, mtime_ns FROM outputs WHERE fingerprint = ?",
+                                   (fingerprint,)).fetchone()
+            if row is None:
+                file = self._free_name(fingerprint, name)
+                self._db.execute("INSERT INTO outputs (fingerprint, name, file, created) VALUES (?, ?, ?, ?)",
+                                 (fingerprint, name, file, time.time()))
+            else:
+                file, size, mtime_ns = row
+                if reuse and size is not None and _unchanged(os.path.join(self.output_dir, file), size, mtime_ns):
+                    return os.path.join(self.output_dir, file), True
+            self._in_flight.add(fingerprint)
+            return os.path.join(self.output_dir, file), False
+
+    def _free_name(self, fingerprint, name):
+        base = os.path.splitext(os.path.basename(name))[0]
+        file = f"{base}.mp4"
+        taken = self._db.execute("SELECT 1 FROM outputs WHERE file = ?", (file,)).fetchone()
+        if taken or os.path.exists(os.path.join(self.output_dir, file)):
+            # Another source already owns this name; never overwrite it
+            file = f"{base}-{fingerprint[:8]}.mp4"
+        return file
+
+    def release(self, fingerprint, output_path, ok):
+        """Record the outcome of a claimed conversion and wake claims waiting for it"""
+        entry = None
+        if ok:
+            try:
+                stat = os.stat(output_path)
+                entry = (stat.st_size, stat.st_mtime_ns, _sha256_file(output_path))
+            except OSError as e:
+                logger.warning(f"Could not index {output_path}: {e}")
+        with self._lock:
+            if entry is not None:
+                self._db.execute("UPDATE outputs SET size = ?, mtime_ns = ?, sha256 = ? WHERE fingerprint = ?",
+                                 (*entry, fingerprint))
+            self._in_flight.discard(fingerprint)
+            self._released.notify_all()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def output_index(output_dir):
+    """Process-wide OutputIndex for output_dir, so concurrent batches share in-flight claims"""
+    key = os.path.abspath(output_dir)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = OutputIndex(key)
+        return index
+
+
+def _unchanged(path, size, mtime_ns):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_size == size and stat.st_mtime_ns == mtime_ns
+
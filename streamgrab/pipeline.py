@@ -0,0 +1,102 @@
+"""Disk-free streaming of fetched segments into ffmpeg's stdin"""
+import logging
+import os
+import threading
+from urllib.parse import urlsplit
+
+from streamgrab.crypto import can_decrypt
+from streamgrab.fetch import DEFAULT_MAX_SPAN, fetch_segments
+from streamgrab.playlist import is_remote, parse_playlist
+
+logger = logging.getLogger("StreamGrab")
+
+# Segment containers that can be concatenated byte-for-byte into one stream
+STREAMABLE_EXTENSIONS = {"", ".ts", ".m2ts", ".mts"}
+
+
+def streamable_playlist(playlist_bytes, base_url=None):
+    """Parse playlist_bytes and return it if its segments can be piped, else None.
+
+    Only MPEG-TS media playlists with absolute segment URIs and no
+    discontinuities qualify: their segments form one valid stream when
+    simply concatenated. That includes byte ranges of a single TS file, but
+    not fMP4 segments with an EXT-X-MAP section. Encrypted segments must be
+    decryptable in-process.
+    """
+    try:
+        playlist = parse_playlist(playlist_bytes.decode("utf-8-sig"), base_url)
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if playlist.is_master or not playlist.segments or not can_decrypt(playlist):
+        return None
+    for seg in playlist.segments:
+        if seg.discontinuity or seg.init is not None or not is_remote(seg.uri):
+            return None
+        if os.path.splitext(urlsplit(seg.uri).path)[1].lower() not in STREAMABLE_EXTENSIONS:
+            return None
+    return playlist
+
+
+class StdinFeeder(threading.Thread):
+    """Writes segment bytes into a process's stdin in playlist order.
+
+    Segments come from fetch_segments, which keeps at most `window` of them
+    in memory. A blocking write to a full pipe stalls the fetcher in turn,
+    so peak memory stays flat however long the stream is.
+    """
+
+    def __init__(self, stdin, segments, pool, window=8, cache=None, on_segment=None, metrics=None,
+                 max_span=DEFAULT_MAX_SPAN):
+        super().__init__(daemon=True, name="stdin-feeder")
+        self.stdin = stdin
+        self.segments = segments
+        self.pool = pool
+        self.window = window
+        self.cache = cache
+        self.on_segment = on_segment
+        self.metrics = metrics
+        self.max_span = max_span
+        self.error = None
+        self.bytes_written = 0
+
+    def run(self):
+        total = len(self.segments)
+        try:
+            for idx, data in fetch_segments(self.segments, self.pool, window=self.window, cache=self.cache,
+                                             metrics=self.metrics, max_span=self.max_span):
+                self.stdin.write(data)
+                self.bytes_written += len(data)
+                if self.on_segment:
+                    self.on_segment(idx + 1, total)
+        except BrokenPipeError:
+            # ffmpeg exited early; its own error output explains why
+            pass
+        except Exception as e:
+            self.error = e
+            logger.error(f"Segment streaming failed: {e}")
+        finally:
+            try:
+                self.stdin.close()
+            except OSError:
+                pass
+
+
+class BytesFeeder(threading.Thread):
+    """Writes a single in-memory buffer (e.g. a playlist) to a process's stdin"""
+
+    def __init__(self, stdin, data):
+        super().__init__(daemon=True, name="stdin-feeder")
+        self.stdin = stdin
+        self.data = data
+        self.error = None
+
+    def run(self):
+        try:
+            self.stdin.write(self.data)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                self.stdin.close()
+            except OSError:
+                pass
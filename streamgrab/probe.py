@@ -0,0 +1,118 @@
+"""ffprobe stream metadata, cached per playlist fingerprint"""
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+from dataclasses import dataclass
+
+logger = logging.getLogger("StreamGrab")
+
+DEFAULT_PROBE_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "streamgrab", "probe-cache.json")
+
+# Codecs that can be stream-copied into an MP4 container as-is
+MP4_VIDEO_CODECS = {"h264", "hevc", "av1", "mpeg4", "vp9"}
+MP4_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "opus", "alac", "flac"}
+
+_lock = threading.Lock()
+
+
+@dataclass
+class StreamInfo:
+    """Codec, resolution and bitrate of a source"""
+    video_codec: str = ""
+    width: int = 0
+    height: int = 0
+    bitrate: int = 0
+    audio_codec: str = ""
+
+    @property
+    def resolution(self):
+        return f"{self.width}x{self.height}" if self.width else "unknown resolution"
+
+    def mp4_compatible(self):
+        video_ok = self.video_codec in MP4_VIDEO_CODECS
+        audio_ok = not self.audio_codec or self.audio_codec in MP4_AUDIO_CODECS
+        return video_ok and audio_ok
+
+
+def playlist_fingerprint(segment_uris):
+    """Stable fingerprint of a playlist from its normalized segment URI list"""
+    digest = hashlib.sha256()
+    for uri in segment_uris:
+        digest.update(uri.strip().encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def ffprobe_for(ffmpeg):
+    """The ffprobe that sits next to the given ffmpeg executable"""
+    head, tail = os.path.split(ffmpeg)
+    return os.path.join(head, tail.replace("ffmpeg", "ffprobe")) if "ffmpeg" in tail else "ffprobe"
+
+
+def probe_stream(source, fingerprint, ffprobe="ffprobe", cache_path=DEFAULT_PROBE_CACHE):
+    """Return the StreamInfo for source, using the cached result for fingerprint if present.
+
+    Returns None when ffprobe is missing or cannot read the source.
+    """
+    with _lock:
+        cached = _load(cache_path).get(fingerprint)
+    if cached is not None:
+        return StreamInfo(**cached)
+
+    cmd = [
+        ffprobe, "-v", "error",
+        "-protocol_whitelist", "file,http,https,tcp,tls",
+        "-show_entries", "stream=codec_type,codec_name,width,height,bit_rate:format=bit_rate",
+        "-of", "json", source,
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        data = json.loads(result.stdout or "{}")
+    except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+        logger.warning(f"ffprobe failed on {source}: {e}")
+        return None
+    if result.returncode != 0:
+        logger.warning(f"ffprobe failed on {source}: {result.stderr.strip()}")
+        return None
+
+    info = StreamInfo(bitrate=_int(data.get("format", {}).get("bit_rate")))
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and not info.video_codec:
+            info.video_codec = stream.get("codec_name", "")
+            info.width = _int(stream.get("width"))
+            info.height = _int(stream.get("height"))
+            info.bitrate = info.bitrate or _int(stream.get("bit_rate"))
+        elif stream.get("codec_type") == "audio" and not info.audio_codec:
+            info.audio_codec = stream.get("codec_name", "")
+
+    with _lock:
+        cache = _load(cache_path)
+        cache[fingerprint] = vars(info)
+        _save(cache_path, cache)
+    return info
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,124 @@
+"""Parsing of ffmpeg's machine-readable -progress stream"""
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+
+@dataclass
+class Progress:
+    """Snapshot of a running ffmpeg job"""
+    out_time: float = 0.0
+    total_duration: float = 0.0
+    total_size: int = 0
+    speed: float = 0.0
+    frame: int = 0
+    fps: float = 0.0
+    elapsed: float = 0.0
+    done: bool = False
+
+    @property
+    def fraction(self):
+        """Completed fraction in [0, 1], or None when the duration is unknown"""
+        if self.done:
+            return 1.0
+        if self.total_duration <= 0:
+            return None
+        return min(1.0, self.out_time / self.total_duration)
+
+    @property
+    def mb_per_sec(self):
+        return self.total_size / 1024 ** 2 / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Seconds remaining at the current speed, or None when unknown"""
+        if self.total_duration <= 0 or self.speed <= 0:
+            return None
+        return max(0.0, (self.total_duration - self.out_time) / self.speed)
+
+    def describe(self):
+        parts = []
+        if self.fraction is not None:
+            parts.append(f"{self.fraction * 100:.0f}%")
+        parts.append(format_seconds(self.out_time))
+        if self.speed:
+            parts.append(f"{self.speed:.1f}x realtime")
+        parts.append(f"{self.mb_per_sec:.1f} MB/s")
+        if self.eta is not None and not self.done:
+            parts.append(f"ETA {format_seconds(self.eta)}")
+        return " | ".join(parts)
+
+
+class ProgressParser:
+    """Accumulates `key=value` lines from `ffmpeg -progress pipe:1`.
+
+    feed() returns a Progress snapshot at the end of each block (the
+    `progress=continue` / `progress=end` line) and None otherwise.
+    """
+
+    def __init__(self, total_duration=0.0):
+        self.total_duration = total_duration
+        self.started = time.monotonic()
+        self._fields = {}
+
+    def feed(self, line):
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        if key != "progress":
+            self._fields[key] = value
+            return None
+
+        fields, self._fields = self._fields, {}
+        out_us = fields.get("out_time_us") or fields.get("out_time_ms")
+        speed = fields.get("speed", "").rstrip("x").strip()
+        return Progress(
+            out_time=_to_float(out_us) / 1_000_000,
+            total_duration=self.total_duration,
+            total_size=int(_to_float(fields.get("total_size"))),
+            speed=_to_float(speed),
+            frame=int(_to_float(fields.get("frame"))),
+            fps=_to_float(fields.get("fps")),
+            elapsed=time.monotonic() - self.started,
+            done=value == "end",
+        )
+
+
+class StderrDrain(threading.Thread):
+    """Continuously reads a pipe so a chatty ffmpeg can never block on it.
+
+    Keeps only the last `keep` lines for error reporting; error lines are
+    also passed to on_error as they arrive.
+    """
+
+    def __init__(self, pipe, keep=50, on_error=None):
+        super().__init__(daemon=True, name="ffmpeg-stderr")
+        self.pipe = pipe
+        self.lines = deque(maxlen=keep)
+        self.on_error = on_error
+
+    def run(self):
+        for line in self.pipe:
+            line = line.strip()
+            if not line:
+                continue
+            self.lines.append(line)
+            if self.on_error and line.lower().startswith("error"):
+                self.on_error(line)
+
+    def tail(self):
+        self.join(timeout=5)
+        return "\n".join(self.lines)
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
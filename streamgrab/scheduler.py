@@ -0,0 +1,167 @@
+"""Per-host scheduling of HTTP requests shared by every job
+
+All playlist, key and segment requests of a ConnectionPool pass through
+its FetchScheduler. Per origin host it bounds the number of requests in
+flight and, optionally, the bandwidth, and it backs off with jitter when
+the host answers 429/5xx or drops connections. When jobs compete for a
+host, a freed slot goes to the waiting job with the fewest requests in
+flight there, so a stream fetched with a wide window cannot starve the
+others; bandwidth is paced per chunk across all connections, which shares
+it in proportion to those slots.
+"""
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+logger = logging.getLogger("StreamGrab")
+
+# Backoff before retry n is drawn from [d/2, d] with d = BASE_BACKOFF * 2**n, capped at MAX_BACKOFF
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+# Consecutive failures after which a host is paused for every job, not just the failing request
+HOST_FAILURE_THRESHOLD = 3
+
+# Bytes read between bandwidth pacing decisions
+PACING_CHUNK = 64 * 1024
+
+
+@dataclass
+class HostLimits:
+    """Limits applied to each origin host; 0 means unlimited"""
+    max_connections: int = 16
+    max_bytes_per_second: float = 0.0
+
+
+class _HostState:
+    def __init__(self):
+        self.active = 0
+        self.by_job = Counter()
+        # (job, ticket) of requests waiting for a slot, in arrival order
+        self.waiting = []
+        self.failures = 0
+        self.paused_until = 0.0
+        self.paced_until = 0.0
+
+
+class FetchScheduler:
+    """Admission control, pacing and backoff per origin host"""
+
+    def __init__(self, limits=None):
+        self.limits = limits or HostLimits()
+        self._hosts = {}
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+        self._rng = random.Random()
+
+    def set_limits(self, limits):
+        with self._cond:
+            self.limits = limits
+            self._cond.notify_all()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState()
+        return state
+
+    @contextmanager
+    def slot(self, host, job=None):
+        """Hold one of host's request slots for the duration of the block.
+
+        job is any hashable identifying the requesting job, for fair sharing.
+        """
+        with self._cond:
+            state = self._state(host)
+            entry = (job, next(self._tickets))
+            state.waiting.append(entry)
+            try:
+                while True:
+                    timeout = self._admit(state, entry)
+                    if timeout == 0:
+                        break
+                    self._cond.wait(timeout)
+            finally:
+                state.waiting.remove(entry)
+            state.active += 1
+            state.by_job[job] += 1
+            if state.waiting:
+                # A slot may still be free for the next waiter
+                self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                state.active -= 1
+                state.by_job[job] -= 1
+                if not state.by_job[job]:
+                    del state.by_job[job]
+                self._cond.notify_all()
+
+    def _admit(self, state, entry):
+        """0 if entry may start now, else how long to wait (None: until notified)"""
+        pause = state.paused_until - time.monotonic()
+        if pause > 0:
+            return pause
+        limit = self.limits.max_connections
+        if limit and state.active >= limit:
+            return None
+        # Fewest requests in flight first, then arrival order
+        best = min(state.waiting, key=lambda waiting: (state.by_job[waiting[0]], waiting[1]))
+        return 0 if best is entry else None
+
+    def pace(self, host, nbytes):
+        """Block until host's bandwidth budget allows nbytes more"""
+        rate = self.limits.max_bytes_per_second
+        if not rate:
+            return
+        with self._cond:
+            state = self._state(host)
+            now = time.monotonic()
+            start = max(now, state.paced_until)
+            state.paced_until = start + nbytes / rate
+        if start > now:
+            time.sleep(start - now)
+
+    @property
+    def pacing(self):
+        return bool(self.limits.max_bytes_per_second)
+
+    def backoff(self, host, attempt, retry_after=None):
+        """Record a failed request to host and return how long to wait before retrying it.
+
+        After HOST_FAILURE_THRESHOLD consecutive failures, or when the host
+        sent Retry-After, new requests to it wait out the delay as well.
+        """
+        ceiling = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+        with self._cond:
+            delay = ceiling / 2 + self._rng.uniform(0, ceiling / 2)
+            if retry_after:
+                delay = max(delay, min(retry_after, MAX_BACKOFF))
+            state = self._state(host)
+            state.failures += 1
+            if retry_after or state.failures >= HOST_FAILURE_THRESHOLD:
+                until = time.monotonic() + delay
+                if until > state.paused_until:
+                    logger.warning(f"Backing off {host} for {delay:.1f}s after {state.failures} failed requests")
+                    state.paused_until = until
+        return delay
+
+    def succeeded(self, host):
+        with self._cond:
+            state = self._hosts.get(host)
+            if state is not None:
+                state.failures = 0
+
+
+def retry_after_seconds(value):
+    """Seconds from a Retry-After header given in seconds, or None (HTTP dates are ignored)"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,146 @@
+"""Shared fixtures: a local HTTP origin with scripted failures, and a stub ffmpeg"""
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# The default caches (~/.cache/streamgrab) are resolved at import time; keep them out of the real home
+os.environ["HOME"] = tempfile.mkdtemp(prefix="streamgrab-test-home-")
+
+from streamgrab import scheduler  # noqa: E402
+
+
+class Origin:
+    """What the test origin serves, and what it was asked for.
+
+    files maps paths to bytes, or to a list of bytes served one per
+    request with the last one repeated (a live playlist). failures maps a
+    path to statuses answered, in order, before the file is served. With
+    honor_range off, Range headers are ignored and the whole file is sent,
+    like a plain static server. requests records (method, path, Range) per
+    request and connections counts accepted TCP connections.
+    """
+
+    def __init__(self, port):
+        self.url = f"http://127.0.0.1:{port}"
+        self.files = {}
+        self.failures = {}
+        self.honor_range = True
+        self.requests = []
+        self.connections = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.origin.connections += 1
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def _serve(self, body):
+        origin = self.server.origin
+        path = self.path.split("?", 1)[0]
+        byte_range = self.headers.get("Range")
+        origin.requests.append((self.command, path, byte_range))
+        failures = origin.failures.get(path)
+        if failures:
+            return self._reply(failures.pop(0), b"", body)
+        data = origin.files.get(path)
+        if isinstance(data, list):
+            data = data.pop(0) if len(data) > 1 else data[0]
+        if data is None:
+            return self._reply(404, b"", body)
+        if byte_range and origin.honor_range:
+            start, end = (int(n) for n in byte_range.removeprefix("bytes=").split("-"))
+            return self._reply(206, data[start:end + 1], body,
+                               {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+        self._reply(200, data, body)
+
+    def _reply(self, status, data, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.origin = Origin(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.origin
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    """Retries back off for milliseconds instead of seconds"""
+    monkeypatch.setattr(scheduler, "BASE_BACKOFF", 0.001)
+
+
+STUB_FFMPEG = """\
+#!{python}
+# Stub ffmpeg: answers the capability probe, drains a pipe:0 input, waits delay seconds, prints a finished
+# -progress block and writes its arguments to every output file; fails with fail_stderr when an argument is in fail_on
+import sys
+import time
+args = sys.argv[1:]
+if args == ["-version"]:
+    print("ffmpeg version 6.1-stub")
+    sys.exit()
+if "-hwaccels" in args:
+    print("Hardware acceleration methods:")
+    print("\\n".join({hwaccels!r}))
+    sys.exit()
+if "-encoders" in args:
+    print("Encoders:\\n ------")
+    print("\\n".join(" V....D " + name for name in {encoders!r}))
+    sys.exit()
+with open({log!r}, "a") as log:
+    log.write(" ".join(args) + "\\n")
+if "pipe:0" in args:
+    sys.stdin.buffer.read()
+time.sleep({delay!r})
+print("out_time_us=1000000\\nprogress=end", flush=True)
+for idx, arg in enumerate(args):
+    if arg.endswith((".mp4", ".ts")) and args[idx - 1] != "-i":
+        with open(arg, "w") as f:
+            f.write(" ".join(args))
+if set(args) & set({fail_on!r}):
+    sys.stderr.write({fail_stderr!r})
+    sys.exit(1)
+sys.exit({status})
+"""
+
+
+@pytest.fixture
+def stub_ffmpeg(tmp_path):
+    """Factory for stub ffmpeg executables; returns (path, log of the command lines it ran)"""
+    def make(status=0, name="ffmpeg", hwaccels=(), encoders=("libx264", "aac"), fail_on=(), fail_stderr="",
+             delay=0):
+        path = tmp_path / name
+        log = tmp_path / f"{name}.log"
+        path.write_text(STUB_FFMPEG.format(python=sys.executable, log=str(log), status=status,
+                                           hwaccels=list(hwaccels), encoders=list(encoders),
+                                           fail_on=list(fail_on), fail_stderr=fail_stderr, delay=delay))
+        os.chmod(path, 0o755)
+        return str(path), log
+    return make
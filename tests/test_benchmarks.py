@@ -0,0 +1,19 @@
+from benchmarks.run import run_scenario
+
+
+def test_every_copy_of_a_batch_is_converted(origin, stub_ffmpeg, tmp_path):
+    ffmpeg, log = stub_ffmpeg()
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2"]
+    for idx in range(2):
+        origin.files[f"/s{idx}.ts"] = b"\x47" * 188
+        lines += ["#EXTINF:2.0,", f"{origin.url}/s{idx}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    playlist_path = tmp_path / "short.m3u8"
+    playlist_path.write_text("\n".join(lines) + "\n")
+
+    measured = run_scenario({"fixture": "short", "playlist_path": str(playlist_path), "mode": "Original",
+                             "segment_window": 4, "batch_size": 4, "jobs": 2, "pipeline": False,
+                             "ffmpeg": ffmpeg})
+    assert measured["failed"] == 0
+    assert len([line for line in log.read_text().splitlines() if "-c copy" in line]) == 4
+    assert sum(1 for method, path, _ in origin.requests if method == "GET" and path.startswith("/s1.ts")) == 4
@@ -0,0 +1,35 @@
+from streamgrab.chunked import encode_chunks, plan_chunks
+from streamgrab.fetch import download_playlist
+from streamgrab.hwaccel import EncodePlan
+from streamgrab.playlist import parse_playlist
+
+
+def test_plan_chunks_covers_every_segment_once():
+    chunks = plan_chunks([4.0] * 30, workers=2, min_seconds=10.0)
+    assert chunks[0][0] == 0 and chunks[-1][1] == 30
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+    assert len(chunks) == 4
+
+
+def test_fmp4_chunks_keep_their_init_section(origin, tmp_path, stub_ffmpeg):
+    origin.files["/init.mp4"] = b"ftypmoov"
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-TARGETDURATION:6", '#EXT-X-MAP:URI="init.mp4"']
+    for idx in range(12):
+        origin.files[f"/s{idx}.m4s"] = b"moof" + bytes([idx]) * 100
+        lines += ["#EXTINF:6.0,", f"s{idx}.m4s"]
+    lines.append("#EXT-X-ENDLIST")
+    playlist = parse_playlist("\n".join(lines), f"{origin.url}/index.m3u8")
+    local = download_playlist(playlist, str(tmp_path / "work"))
+
+    ffmpeg, log = stub_ffmpeg()
+    plan = EncodePlan("libx264", [], ["-c:v", "libx264"])
+    concat_list, count = encode_chunks(ffmpeg, local, plan, workers=2)
+
+    assert count > 1
+    assert len(log.read_text().splitlines()) == count
+    for idx in range(count):
+        chunk = (tmp_path / "work" / f"chunk_{idx:03d}.m3u8").read_text()
+        assert '#EXT-X-MAP:URI="init_0.mp4"' in chunk
+        assert (tmp_path / "work" / f"chunk_{idx:03d}.mp4").exists()
+    assert (tmp_path / "work" / "init_0.mp4").read_bytes() == b"ftypmoov"
+    assert open(concat_list).read().count("file ") == count
@@ -0,0 +1,20 @@
+from streamgrab.clip import edge_encode_args
+
+
+def test_h264_edges_match_the_source_and_repeat_headers():
+    args = edge_encode_args("libx264", {"profile": "High", "level": 41, "pix_fmt": "yuv420p"})
+    assert args[args.index("-profile:v") + 1] == "high"
+    assert args[args.index("-level:v") + 1] == "4.1"
+    assert args[args.index("-pix_fmt") + 1] == "yuv420p"
+    assert args[args.index("-x264-params") + 1] == "repeat-headers=1"
+
+
+def test_hevc_edges_carry_level_in_x265_params():
+    args = edge_encode_args("libx265", {"profile": "Main 10", "level": 120, "pix_fmt": "yuv420p10le"})
+    assert args[args.index("-profile:v") + 1] == "main10"
+    assert args[args.index("-pix_fmt") + 1] == "yuv420p10le"
+    assert args[args.index("-x265-params") + 1] == "repeat-headers=1:level-idc=4.0"
+
+
+def test_profile_without_an_encoder_counterpart_is_refused():
+    assert edge_encode_args("libx265", {"profile": "Rext", "level": 153, "pix_fmt": "yuv444p"}) is None
@@ -0,0 +1,194 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from streamgrab.cluster import Coordinator, RemoteQueue, _decode_options, _encode_options, main
+from streamgrab.convert import ConvertOptions, PlaylistFile
+from streamgrab.jobs import MAX_ATTEMPTS, JobQueue
+
+
+@pytest.fixture
+def coordinator(tmp_path):
+    coordinator = Coordinator(JobQueue(str(tmp_path / "jobs.sqlite")), "127.0.0.1", 0, reap_interval=0.1)
+    thread = threading.Thread(target=coordinator.serve_forever, daemon=True)
+    thread.start()
+    yield coordinator
+    coordinator.shutdown()
+    thread.join()
+    coordinator.queue.close()
+
+
+def test_playlist_url_reaches_the_worker(coordinator):
+    queue = RemoteQueue(coordinator.url)
+    playlist = PlaylistFile("live.m3u8", b"#EXTM3U\n", url="https://example.com/live/index.m3u8")
+    queue.submit(playlist, "/videos", ConvertOptions(quality="Low"))
+    job_id, claimed, output_dir, options = queue.claim("worker:1")
+    assert (claimed.name, claimed.getvalue(), claimed.url) == ("live.m3u8", b"#EXTM3U\n", playlist.url)
+    assert (output_dir, options.quality) == ("/videos", "Low")
+
+
+def test_url_column_is_added_to_an_existing_database(tmp_path):
+    path = str(tmp_path / "old.sqlite")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, playlist BLOB NOT NULL, "
+               "output_dir TEXT NOT NULL, options TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'queued', owner TEXT, "
+               "progress REAL, progress_text TEXT, output_path TEXT, error TEXT, created REAL NOT NULL, "
+               "updated REAL NOT NULL)")
+    db.commit()
+    db.close()
+    queue = JobQueue(path)
+    try:
+        queue.submit(PlaylistFile("a.m3u8", b"#EXTM3U\n", url="http://h/a.m3u8"), "/out", ConvertOptions())
+        assert queue.claim("me")[1].url == "http://h/a.m3u8"
+    finally:
+        queue.close()
+
+
+def test_host_local_options_are_not_sent_or_taken():
+    options = ConvertOptions(quality="Low", ffmpeg="/opt/evil", cache_dir="/etc")
+    encoded = _encode_options(options)
+    assert "ffmpeg" not in encoded and "cache_dir" not in encoded
+    decoded = _decode_options({**encoded, "ffmpeg": "/opt/evil", "cache_dir": "/etc"})
+    assert decoded.quality == "Low"
+    assert (decoded.ffmpeg, decoded.cache_dir) == (ConvertOptions().ffmpeg, ConvertOptions().cache_dir)
+
+
+def test_coordinator_refuses_a_public_address_without_a_token(tmp_path, monkeypatch, capsys):
+    monkeypatch.delenv("STREAMGRAB_TOKEN", raising=False)
+    assert main(["coordinator", "--db", str(tmp_path / "jobs.sqlite"), "--host", "0.0.0.0"]) == 2
+    assert "without --token" in capsys.readouterr().err
+
+
+def test_submit_reports_unreadable_inputs(coordinator, tmp_path, capsys):
+    missing = str(tmp_path / "missing.json")
+    assert main(["submit", "-c", coordinator.url, "-o", str(tmp_path), "-m", missing]) == 2
+    assert "cannot read manifest" in capsys.readouterr().err
+    unreadable = tmp_path / "dir.m3u8"
+    unreadable.mkdir()
+    bad = tmp_path / "list.json"
+    bad.write_text(f'["{unreadable}"]')
+    assert main(["submit", "-c", coordinator.url, "-o", str(tmp_path), "-m", str(bad)]) == 2
+    assert "streamgrab-cluster:" in capsys.readouterr().err
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    yield queue
+    queue.close()
+
+
+def job_state(queue, job_id):
+    return next(job for job in queue.jobs() if job.id == job_id)
+
+
+def test_expired_lease_goes_to_the_next_owner(queue):
+    job_id = queue.submit(PlaylistFile("a.m3u8", b"#EXTM3U\n"), "/out", ConvertOptions())
+    assert queue.claim("first", lease=0.05)[0] == job_id
+    assert queue.requeue_expired() == []
+    time.sleep(0.1)
+    assert queue.requeue_expired() == [job_id]
+    assert queue.claim("second", lease=10)[0] == job_id
+
+    assert not queue.heartbeat(job_id, "first", 10)
+    assert not queue.finish(job_id, True, "/out/a.mp4", owner="first")
+    assert job_state(queue, job_id).state == "running"
+    assert queue.finish(job_id, True, "/out/a.mp4", owner="second")
+    assert job_state(queue, job_id).state == "done"
+
+
+def test_heartbeats_keep_the_lease(queue):
+    job_id = queue.submit(PlaylistFile("a.m3u8", b"#EXTM3U\n"), "/out", ConvertOptions())
+    queue.claim("worker", lease=0.2)
+    for _ in range(4):
+        time.sleep(0.1)
+        assert queue.heartbeat(job_id, "worker", 0.2)
+        assert queue.requeue_expired() == []
+    assert job_state(queue, job_id).owner == "worker"
+
+
+def test_job_fails_after_max_attempts(queue):
+    job_id = queue.submit(PlaylistFile("a.m3u8", b"#EXTM3U\n"), "/out", ConvertOptions())
+    for attempt in range(MAX_ATTEMPTS):
+        assert queue.claim(f"worker-{attempt}", lease=0.01)[0] == job_id
+        time.sleep(0.02)
+        queue.requeue_expired()
+    job = job_state(queue, job_id)
+    assert (job.state, job.attempts) == ("failed", MAX_ATTEMPTS)
+    assert "worker-2" in job.error
+    assert queue.claim("late") is None
+
+
+def talk_playlist(origin, name):
+    origin.files[f"/{name}.ts"] = b"\x47" * 188
+    body = f"#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXTINF:2.0,\n{name}.ts\n#EXT-X-ENDLIST\n".encode()
+    return PlaylistFile(f"{name}.m3u8", body, url=f"{origin.url}/{name}.m3u8")
+
+
+def start_worker(coordinator, ffmpeg, tmp_path, *args):
+    env = {**os.environ, "HOME": str(tmp_path / "home"), "PYTHONPATH": os.getcwd()}
+    return subprocess.Popen([sys.executable, "-m", "streamgrab.cluster", "worker", "-c", coordinator.url,
+                             "--ffmpeg", ffmpeg, "--min-free", "0", *args], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def stop_worker(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def wait_for(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_two_worker_processes_drain_the_queue(coordinator, origin, stub_ffmpeg, tmp_path):
+    ffmpeg, log = stub_ffmpeg(delay=0.3)
+    queue = RemoteQueue(coordinator.url)
+    ids = [queue.submit(talk_playlist(origin, f"talk{idx}"), str(tmp_path / "out"), ConvertOptions())
+           for idx in range(4)]
+    workers = [start_worker(coordinator, ffmpeg, tmp_path) for _ in range(2)]
+    try:
+        assert wait_for(lambda: all(job_state(coordinator.queue, job_id).state == "done" for job_id in ids))
+    finally:
+        for worker in workers:
+            stop_worker(worker)
+    assert sorted(name for name in os.listdir(tmp_path / "out") if name.endswith(".mp4")) == \
+        [f"talk{idx}.mp4" for idx in range(4)]
+    assert len(log.read_text().splitlines()) == 4
+
+
+def test_job_of_a_killed_worker_is_taken_over(coordinator, origin, stub_ffmpeg, tmp_path):
+    hanging, _ = stub_ffmpeg(name="ffmpeg-hang", delay=600)
+    ffmpeg, _ = stub_ffmpeg()
+    job_id = RemoteQueue(coordinator.url).submit(talk_playlist(origin, "talk"), str(tmp_path / "out"),
+                                                 ConvertOptions())
+    first = start_worker(coordinator, hanging, tmp_path, "--lease", "1")
+    try:
+        assert wait_for(lambda: job_state(coordinator.queue, job_id).state == "running")
+        assert job_state(coordinator.queue, job_id).owner.endswith(f":{first.pid}")
+    finally:
+        # Kill the worker together with its ffmpeg, as a crashed host would lose both
+        os.killpg(first.pid, signal.SIGKILL)
+        first.wait()
+    second = start_worker(coordinator, ffmpeg, tmp_path, "--lease", "1")
+    try:
+        assert wait_for(lambda: job_state(coordinator.queue, job_id).state == "done")
+    finally:
+        stop_worker(second)
+    assert job_state(coordinator.queue, job_id).attempts == 2
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from streamgrab.crypto import DecryptError, can_decrypt
+from streamgrab.fetch import ConnectionPool, fetch_segments
+from streamgrab.playlist import parse_playlist
+
+pytest.importorskip("cryptography")
+from cryptography.hazmat.primitives import padding  # noqa: E402
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes  # noqa: E402
+
+KEY = os.urandom(16)
+EXPLICIT_IV = os.urandom(16)
+
+
+def encrypt(data, key, iv):
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+
+def encrypted_playlist(origin, key=KEY, first_sequence=7):
+    """Segments 0-2 use the IV derived from their media sequence number, 3-4 an explicit IV"""
+    origin.files["/key.bin"] = key
+    clear = [os.urandom(1000 + idx) for idx in range(5)]
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2", f"#EXT-X-MEDIA-SEQUENCE:{first_sequence}",
+             '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"']
+    for idx, data in enumerate(clear):
+        if idx == 3:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x{EXPLICIT_IV.hex()}')
+        iv = EXPLICIT_IV if idx >= 3 else (first_sequence + idx).to_bytes(16, "big")
+        origin.files[f"/s{idx}.ts"] = encrypt(data, KEY, iv)
+        lines += ["#EXTINF:2.0,", f"s{idx}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    return parse_playlist("\n".join(lines), f"{origin.url}/index.m3u8"), clear
+
+
+def fetch_all(playlist):
+    pool = ConnectionPool()
+    try:
+        return [data for _, data in fetch_segments(playlist.segments, pool, window=3)]
+    finally:
+        pool.close()
+
+
+def test_segments_are_decrypted_with_sequence_and_explicit_ivs(origin):
+    playlist, clear = encrypted_playlist(origin)
+    assert can_decrypt(playlist)
+    assert fetch_all(playlist) == clear
+    # One key fetch for the whole playlist
+    assert [path for _, path, _ in origin.requests].count("/key.bin") == 1
+
+
+def test_wrong_key_is_reported(origin):
+    playlist, _ = encrypted_playlist(origin, key=os.urandom(16))
+    with pytest.raises(DecryptError):
+        fetch_all(playlist)
+
+
+def test_sample_aes_is_left_to_ffmpeg(origin):
+    text = "\n".join(["#EXTM3U", "#EXT-X-TARGETDURATION:2", '#EXT-X-KEY:METHOD=SAMPLE-AES,URI="key.bin"',
+                      "#EXTINF:2.0,", "s0.ts", "#EXT-X-ENDLIST"])
+    assert not can_decrypt(parse_playlist(text, f"{origin.url}/index.m3u8"))
@@ -0,0 +1,61 @@
+import shutil
+import threading
+
+import pytest
+
+from streamgrab import diskspace
+from streamgrab.convert import ESTIMATE_MARGIN, ConvertOptions, partial_path, reserve_live_space
+from streamgrab.diskspace import DiskAdmission, DiskSpaceError
+
+
+def test_running_jobs_are_measured_without_the_lock(tmp_path, monkeypatch):
+    admission = DiskAdmission()
+    running = admission.admit("running", {str(tmp_path): 1024})
+    running.track(str(tmp_path))
+    held = []
+
+    def try_lock():
+        acquired = admission._cond.acquire(timeout=1)
+        held.append(not acquired)
+        if acquired:
+            admission._cond.release()
+
+    def size(path):
+        # Probe from another thread, since the condition's lock is reentrant
+        probe = threading.Thread(target=try_lock)
+        probe.start()
+        probe.join()
+        return 0
+
+    monkeypatch.setattr(diskspace, "_size", size)
+    admission.admit("next", {str(tmp_path): 1024})
+    assert held == [False]
+
+
+def test_admission_counts_running_jobs_and_rejects_what_never_fits(tmp_path, monkeypatch):
+    free = shutil.disk_usage(str(tmp_path)).free
+    admission = DiskAdmission()
+    with pytest.raises(DiskSpaceError):
+        admission.admit("huge", {str(tmp_path): free * 2})
+
+    monkeypatch.setattr(diskspace, "RECHECK_INTERVAL", 0.05)
+    first = admission.admit("first", {str(tmp_path): free // 2 + free // 4})
+    admitted = threading.Event()
+    waiter = threading.Thread(target=lambda: (admission.admit("second", {str(tmp_path): free // 2}),
+                                              admitted.set()))
+    waiter.start()
+    assert not admitted.wait(0.3)
+    admission.release(first)
+    waiter.join(5)
+    assert admitted.is_set()
+
+
+def test_bounded_live_recording_reserves_its_bitrate(tmp_path):
+    output = str(tmp_path / "live.mp4")
+    options = ConvertOptions(live_stop_after=600, min_free_gb=0)
+    reservation = reserve_live_space("live.m3u8", 2_000_000, False, output, options, lambda *args: None)
+    try:
+        assert list(reservation.needs.values()) == [int(2_000_000 * 600 / 8 * ESTIMATE_MARGIN)]
+        assert reservation.paths[0][1] == partial_path(output)
+    finally:
+        diskspace.disk_admission().release(reservation)
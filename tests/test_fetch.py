@@ -0,0 +1,59 @@
+import pytest
+
+from streamgrab.fetch import ConnectionPool, FetchError, fetch_segments, fetch_url
+from streamgrab.metrics import JobMetrics
+from streamgrab.playlist import Segment
+
+
+def segments(origin, count):
+    for idx in range(count):
+        origin.files[f"/s{idx}.ts"] = bytes([idx]) * (1000 + idx)
+    return [Segment(f"{origin.url}/s{idx}.ts", 2.0) for idx in range(count)]
+
+
+def test_segments_yielded_in_playlist_order_over_reused_connections(origin):
+    segs = segments(origin, 20)
+    pool = ConnectionPool(max_idle_per_host=4)
+    try:
+        fetched = list(fetch_segments(segs, pool, window=4))
+    finally:
+        pool.close()
+    assert [idx for idx, _ in fetched] == list(range(20))
+    assert all(data == origin.files[f"/s{idx}.ts"] for idx, data in fetched)
+    # Keep-alive connections are reused: no more than one per request slot
+    assert origin.connections <= 4
+
+
+def test_transient_errors_are_retried(origin):
+    origin.files["/flaky.ts"] = b"payload"
+    origin.failures["/flaky.ts"] = [503, 429]
+    metrics = JobMetrics("job")
+    pool = ConnectionPool()
+    try:
+        assert fetch_url(pool, f"{origin.url}/flaky.ts", metrics=metrics) == b"payload"
+    finally:
+        pool.close()
+    assert metrics.retries == 2
+    assert len(origin.requests) == 3
+
+
+def test_client_errors_are_not_retried(origin):
+    pool = ConnectionPool()
+    try:
+        with pytest.raises(FetchError, match="HTTP 404"):
+            fetch_url(pool, f"{origin.url}/missing.ts")
+    finally:
+        pool.close()
+    assert len(origin.requests) == 1
+
+
+def test_retries_give_up(origin):
+    origin.files["/down.ts"] = b"payload"
+    origin.failures["/down.ts"] = [500] * 3
+    pool = ConnectionPool()
+    try:
+        with pytest.raises(FetchError, match="HTTP 500"):
+            fetch_url(pool, f"{origin.url}/down.ts", retries=2)
+    finally:
+        pool.close()
+    assert len(origin.requests) == 3
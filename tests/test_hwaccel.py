@@ -0,0 +1,75 @@
+import os
+
+from streamgrab import hwaccel
+from streamgrab.convert import ConvertOptions, PlaylistFile, convert_m3u8_to_mp4
+from streamgrab.hwaccel import Capabilities, encode_plans, mark_broken, probe
+
+
+def test_probe_parses_capabilities_and_caches_them(stub_ffmpeg, tmp_path, monkeypatch):
+    ffmpeg, _ = stub_ffmpeg(hwaccels=["cuda", "vaapi"], encoders=["libx264", "h264_nvenc", "aac"])
+    cache_path = str(tmp_path / "caps.json")
+    caps = probe(ffmpeg, cache_path=cache_path)
+    assert caps.version == "ffmpeg version 6.1-stub"
+    assert caps.hwaccels == ["cuda", "vaapi"]
+    assert "h264_nvenc" in caps.encoders
+
+    def no_run(*args):
+        raise AssertionError("ffmpeg probed again")
+
+    monkeypatch.setattr(hwaccel, "_run", no_run)
+    assert probe(ffmpeg, cache_path=cache_path) == caps
+
+
+def test_hardware_plans_come_first_and_broken_ones_are_skipped(stub_ffmpeg, tmp_path):
+    caps = Capabilities("ffmpeg", hwaccels=["cuda", "vaapi"], encoders=["libx264", "h264_nvenc", "h264_vaapi"])
+    names = [plan.name for plan in encode_plans(caps, "Low", "640:-1", True, system="Linux")]
+    assert names == ["cuda+h264_nvenc", "vaapi+h264_vaapi", "libx264"]
+    assert [plan.name for plan in encode_plans(caps, "Low", "640:-1", False, system="Linux")] == ["libx264"]
+
+    ffmpeg, _ = stub_ffmpeg(hwaccels=["cuda"], encoders=["libx264", "h264_nvenc"])
+    cache_path = str(tmp_path / "caps.json")
+    mark_broken(probe(ffmpeg, cache_path=cache_path), "cuda+h264_nvenc", cache_path=cache_path)
+    caps = probe(ffmpeg, cache_path=cache_path)
+    assert caps.broken == ["cuda+h264_nvenc"]
+    assert [plan.name for plan in encode_plans(caps, "Low", "640:-1", True, system="Linux")] == ["libx264"]
+
+
+def talk_playlist(origin):
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2"]
+    for idx in range(3):
+        origin.files[f"/s{idx}.ts"] = b"\x47" * 188
+        lines += ["#EXTINF:2.0,", f"s{idx}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    return PlaylistFile("talk.m3u8", "\n".join(lines).encode(), url=f"{origin.url}/talk.m3u8")
+
+
+def test_failing_hardware_encode_falls_back_to_libx264(origin, stub_ffmpeg, tmp_path):
+    ffmpeg, log = stub_ffmpeg(hwaccels=["cuda"], encoders=["libx264", "h264_nvenc", "aac"], fail_on=["h264_nvenc"])
+    playlist = talk_playlist(origin)
+    output = str(tmp_path / "talk.mp4")
+    options = ConvertOptions(quality="Low", use_hw_accel=True, ffmpeg=ffmpeg, cache_size_gb=0, min_free_gb=0)
+
+    assert convert_m3u8_to_mp4(playlist, output, options)
+    commands = log.read_text().splitlines()
+    assert "h264_nvenc" in commands[0] and "libx264" in commands[-1]
+    assert os.path.exists(output)
+    assert probe(ffmpeg).broken == ["cuda+h264_nvenc"]
+
+
+def test_bad_input_does_not_mark_the_hardware_path_broken(origin, stub_ffmpeg, tmp_path):
+    ffmpeg, log = stub_ffmpeg(hwaccels=["cuda"], encoders=["libx264", "h264_nvenc", "aac"],
+                              fail_on=["h264_nvenc", "libx264"], fail_stderr="Invalid data found when processing input")
+    options = ConvertOptions(quality="Low", use_hw_accel=True, ffmpeg=ffmpeg, cache_size_gb=0, min_free_gb=0)
+
+    assert not convert_m3u8_to_mp4(talk_playlist(origin), str(tmp_path / "talk.mp4"), options)
+    assert len(log.read_text().splitlines()) == 2
+    assert probe(ffmpeg).broken == []
+
+
+def test_device_error_marks_the_hardware_path_broken(origin, stub_ffmpeg, tmp_path):
+    ffmpeg, _ = stub_ffmpeg(hwaccels=["cuda"], encoders=["libx264", "h264_nvenc", "aac"],
+                            fail_on=["h264_nvenc", "libx264"], fail_stderr="Device creation failed: -542398533.")
+    options = ConvertOptions(quality="Low", use_hw_accel=True, ffmpeg=ffmpeg, cache_size_gb=0, min_free_gb=0)
+
+    assert not convert_m3u8_to_mp4(talk_playlist(origin), str(tmp_path / "talk.mp4"), options)
+    assert probe(ffmpeg).broken == ["cuda+h264_nvenc"]
@@ -0,0 +1,110 @@
+import io
+import os
+
+import pytest
+
+from streamgrab.convert import ConvertOptions, PlaylistFile, convert_m3u8_to_mp4, partial_path
+from streamgrab.fetch import ConnectionPool
+from streamgrab.live import LiveFeeder, LivePoller, live_playlist
+
+
+@pytest.fixture(autouse=True)
+def no_reload_delay(monkeypatch):
+    monkeypatch.setattr(LivePoller, "_wait", lambda self, seconds: self.stop_event.is_set())
+
+
+def window(first, count, end=False):
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2", f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+    for seq in range(first, first + count):
+        lines += ["#EXTINF:2.0,", f"s{seq}.ts"]
+    if end:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines).encode()
+
+
+def serve_live(origin, windows, segments=10):
+    for seq in range(segments):
+        origin.files[f"/s{seq}.ts"] = bytes([seq]) * 188
+    origin.files["/live.m3u8"] = list(windows)
+    return f"{origin.url}/live.m3u8"
+
+
+def poll(url, **kwargs):
+    pool = ConnectionPool()
+    try:
+        poller = LivePoller(url, pool, **kwargs)
+        batches = [[seg.sequence for seg in batch] for batch in poller.poll()]
+    finally:
+        pool.close()
+    return poller, batches
+
+
+def test_sliding_window_yields_each_segment_once(origin):
+    url = serve_live(origin, [window(0, 3), window(1, 3), window(1, 3), window(2, 3, end=True)])
+    poller, batches = poll(url)
+    assert batches == [[0, 1, 2], [3], [4]]
+    assert (poller.segments, poller.skipped, poller.reloads, poller.ended) == (5, 0, 4, True)
+    assert poller.recorded == 10.0
+
+
+def test_segments_that_left_the_window_are_counted_as_skipped(origin):
+    warnings = []
+    url = serve_live(origin, [window(0, 2), window(5, 2, end=True)])
+    poller, batches = poll(url, on_warning=warnings.append)
+    assert batches == [[0, 1], [5, 6]]
+    assert poller.skipped == 3
+    assert "Missed 3 live segments" in warnings[0]
+
+
+def test_stop_after_limits_the_recorded_media(origin):
+    url = serve_live(origin, [window(0, 2), window(1, 3), window(2, 3)])
+    poller, batches = poll(url, stop_after=7.0)
+    assert batches == [[0, 1], [2, 3]]
+    assert poller.recorded == 8.0 and not poller.ended
+
+
+def test_live_playlist_needs_a_url_and_no_endlist(origin):
+    assert live_playlist(window(0, 3), f"{origin.url}/live.m3u8") is not None
+    assert live_playlist(window(0, 3, end=True), f"{origin.url}/live.m3u8") is None
+    assert live_playlist(window(0, 3), None) is None
+
+
+class Stdin(io.BytesIO):
+    def close(self):
+        self.written = self.getvalue()
+        super().close()
+
+
+def test_feeder_writes_new_segments_in_order_and_closes_stdin(origin):
+    url = serve_live(origin, [window(0, 3), window(2, 3), window(3, 3, end=True)])
+    pool = ConnectionPool()
+    try:
+        poller = LivePoller(url, pool)
+        stdin = Stdin()
+        feeder = LiveFeeder(stdin, poller, first=None, pool=pool, window=2)
+        feeder.run()
+    finally:
+        pool.close()
+    assert feeder.error is None
+    assert stdin.written == b"".join(bytes([seq]) * 188 for seq in range(6))
+
+
+def record(origin, stub_ffmpeg, tmp_path, windows, **stub):
+    ffmpeg, _ = stub_ffmpeg(**stub)
+    url = serve_live(origin, windows)
+    output = str(tmp_path / "live.mp4")
+    options = ConvertOptions(ffmpeg=ffmpeg, cache_size_gb=0, min_free_gb=0)
+    ok = convert_m3u8_to_mp4(PlaylistFile("live.m3u8", windows[0], url=url), output, options)
+    return ok, output
+
+
+def test_finished_recording_is_renamed_into_place(origin, stub_ffmpeg, tmp_path):
+    ok, output = record(origin, stub_ffmpeg, tmp_path, [window(0, 3), window(1, 3, end=True)])
+    assert ok
+    assert os.path.exists(output) and not os.path.exists(partial_path(output))
+
+
+def test_interrupted_recording_keeps_only_its_partial_file(origin, stub_ffmpeg, tmp_path):
+    ok, output = record(origin, stub_ffmpeg, tmp_path, [window(0, 3), window(1, 3, end=True)], status=1)
+    assert not ok
+    assert os.path.exists(partial_path(output)) and not os.path.exists(output)
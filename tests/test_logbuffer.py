@@ -0,0 +1,38 @@
+from streamgrab.logbuffer import LogBuffer, LogFile
+
+
+def test_keyed_entries_coalesce_into_one_line():
+    logs = LogBuffer(capacity=10)
+    for done in range(5):
+        logs.add("INFO", f"Downloading a.m3u8 - Segments: {done}/4", key="download:a")
+    logs.add("INFO", "Finished a.m3u8")
+    assert logs.window(10) == [("INFO", "Downloading a.m3u8 - Segments: 4/4"), ("INFO", "Finished a.m3u8")]
+
+
+def test_log_files_share_a_handler_per_path_and_close_with_the_last(tmp_path):
+    path = tmp_path / ".streamgrab" / "streamgrab.log"
+    first = LogFile(str(path))
+    second = LogFile(str(path))
+    assert first._handler is second._handler
+    first.write("INFO", "from the first session")
+    first.write("DEBUG", "Converting a.m3u8 - 12%")
+    first.close()
+    second.write("SUCCESS", "from the second session")
+    second.close()
+    first.write("ERROR", "after close")
+
+    lines = path.read_text().splitlines()
+    assert [line.split(" - ", 1)[1] for line in lines] == ["INFO - from the first session",
+                                                           "SUCCESS - from the second session"]
+    assert first._handler.stream is None
+
+
+def test_switching_files_stops_writing_the_old_one(tmp_path):
+    old = LogFile(str(tmp_path / "a" / "streamgrab.log"))
+    old.write("INFO", "one")
+    old.close()
+    new = LogFile(str(tmp_path / "b" / "streamgrab.log"))
+    new.write("INFO", "two")
+    new.close()
+    assert "two" not in (tmp_path / "a" / "streamgrab.log").read_text()
+    assert "one" not in (tmp_path / "b" / "streamgrab.log").read_text()
@@ -0,0 +1,45 @@
+import os
+
+from streamgrab.cache import SegmentCache
+from streamgrab.convert import ConvertOptions, PlaylistFile, convert_m3u8_to_mp4
+from streamgrab.fetch import ConnectionPool, coalesce_ranges, fetch_range
+from streamgrab.metrics import JobMetrics
+from streamgrab.playlist import Segment
+
+
+def test_coalesced_cache_hits_are_counted_per_segment(origin, tmp_path):
+    origin.files["/all.mp4"] = bytes(range(256)) * 40
+    uri = f"{origin.url}/all.mp4"
+    segments = [Segment(uri, 2.0, byte_range=(1000, idx * 1000)) for idx in range(8)]
+    (request,) = coalesce_ranges(segments)
+    cache = SegmentCache(str(tmp_path / "cache"), max_bytes=1024 ** 2)
+    pool = ConnectionPool()
+    try:
+        cold = JobMetrics("cold")
+        fetch_range(pool, request, segments, cache=cache, metrics=cold)
+        warm = JobMetrics("warm")
+        fetch_range(pool, request, segments, cache=cache, metrics=warm)
+    finally:
+        pool.close()
+        cache.close()
+    assert (cold.segments, cold.cache_hits, cold.cache_misses) == (8, 0, 8)
+    assert (warm.segments, warm.cache_hits, warm.cache_misses) == (8, 8, 0)
+    assert len(origin.requests) == 1
+
+
+def test_bytes_written_counts_every_rendition(origin, stub_ffmpeg, tmp_path):
+    ffmpeg, _ = stub_ffmpeg()
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2"]
+    for idx in range(2):
+        origin.files[f"/s{idx}.ts"] = b"\x47" * 188
+        lines += ["#EXTINF:2.0,", f"s{idx}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    playlist = PlaylistFile("talk.m3u8", "\n".join(lines).encode(), url=f"{origin.url}/talk.m3u8")
+    output = str(tmp_path / "talk.mp4")
+    options = ConvertOptions(quality="Low", extra_qualities=["Medium"], ffmpeg=ffmpeg, cache_size_gb=0,
+                             min_free_gb=0)
+    metrics = JobMetrics("talk")
+
+    assert convert_m3u8_to_mp4(playlist, output, options, metrics=metrics)
+    sizes = [os.path.getsize(output), os.path.getsize(str(tmp_path / "talk_medium.mp4"))]
+    assert metrics.bytes_written == sum(sizes)
@@ -0,0 +1,25 @@
+from streamgrab import convert
+from streamgrab.convert import ConvertOptions, PlaylistFile, convert_m3u8_to_mp4
+from streamgrab.probe import StreamInfo
+
+
+def test_downloaded_segments_are_probed_locally(origin, stub_ffmpeg, tmp_path, monkeypatch):
+    ffmpeg, log = stub_ffmpeg()
+    probed = []
+
+    def probe_stream(target, fingerprint, ffprobe="ffprobe"):
+        probed.append(target)
+        return StreamInfo("h264", 640, 360, 800_000, "aac")
+
+    monkeypatch.setattr(convert, "probe_stream", probe_stream)
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2"]
+    for idx in range(3):
+        origin.files[f"/s{idx}.ts"] = b"\x47" * 188
+        lines += ["#EXTINF:2.0,", f"s{idx}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    playlist = PlaylistFile("talk.m3u8", "\n".join(lines).encode(), url=f"{origin.url}/talk.m3u8")
+    options = ConvertOptions(quality="Medium", ffmpeg=ffmpeg, cache_size_gb=0, min_free_gb=0)
+
+    assert convert_m3u8_to_mp4(playlist, str(tmp_path / "talk.mp4"), options)
+    assert probed and all(target.startswith(str(tmp_path)) and target.endswith(".m3u8") for target in probed)
+    assert "-c copy" in log.read_text()
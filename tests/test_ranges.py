@@ -0,0 +1,56 @@
+import os
+
+from streamgrab.fetch import coalesce_ranges, download_playlist
+from streamgrab.playlist import Segment, parse_playlist
+
+SOURCE = os.urandom(64 * 1024)
+
+
+def ranged(uri, spans):
+    return [Segment(uri, 2.0, byte_range=(length, offset)) for offset, length in spans]
+
+
+def test_adjacent_and_overlapping_ranges_merge():
+    segments = ranged("http://h/a.mp4", [(0, 100), (100, 50), (120, 80), (400, 10)])
+    requests = coalesce_ranges(segments)
+    assert [(r.offset, r.length, r.members) for r in requests] == [(0, 200, [0, 1, 2]), (400, 10, [3])]
+
+
+def test_merging_stops_at_max_span_and_at_other_resources():
+    segments = ranged("http://h/a.mp4", [(0, 100), (100, 100), (200, 100)])
+    segments += ranged("http://h/b.mp4", [(300, 100)])
+    segments.append(Segment("http://h/c.ts", 2.0))
+    requests = coalesce_ranges(segments, max_span=200)
+    assert [(r.uri.rsplit("/", 1)[1], r.offset, r.length, r.members) for r in requests] == [
+        ("a.mp4", 0, 200, [0, 1]), ("a.mp4", 200, 100, [2]), ("b.mp4", 300, 100, [3]), ("c.ts", None, None, [4])]
+
+
+def byte_range_playlist(origin, count=16, size=4096):
+    origin.files["/all.ts"] = SOURCE
+    lines = ["#EXTM3U", "#EXT-X-VERSION:4", "#EXT-X-TARGETDURATION:2"]
+    for idx in range(count):
+        lines += ["#EXTINF:2.0,", f"#EXT-X-BYTERANGE:{size}@{idx * size}", "all.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    return parse_playlist("\n".join(lines), f"{origin.url}/index.m3u8")
+
+
+def downloaded(work_dir, count):
+    return b"".join(open(os.path.join(work_dir, f"seg_{idx:06d}.ts"), "rb").read() for idx in range(count))
+
+
+def test_byte_range_segments_are_reassembled_from_merged_requests(origin, tmp_path):
+    playlist = byte_range_playlist(origin)
+    work_dir = str(tmp_path / "work")
+    download_playlist(playlist, work_dir, max_span=16 * 1024)
+    assert downloaded(work_dir, 16) == SOURCE
+    assert sorted(r for _, _, r in origin.requests) == [
+        "bytes=0-16383", "bytes=16384-32767", "bytes=32768-49151", "bytes=49152-65535"]
+
+
+def test_servers_ignoring_range_are_sliced(origin, tmp_path):
+    origin.honor_range = False
+    playlist = byte_range_playlist(origin)
+    work_dir = str(tmp_path / "work")
+    download_playlist(playlist, work_dir, max_span=32 * 1024)
+    assert downloaded(work_dir, 16) == SOURCE
+    assert len(origin.requests) == 2